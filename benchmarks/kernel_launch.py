@@ -0,0 +1,88 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Times the work xp does to give each block its environment.
+
+    python benchmarks/kernel_launch.py [-n BLOCKS] [-v VARIABLES] [--spawn]
+
+For each of n tiny blocks, the environment is built from a pipeline context
+with the given number of variables and converted the way subprocess does
+before it starts a process.  This is compared with copying os.environ and
+overlaying the context for every block, as xp used to.  With --spawn, the
+blocks are also run (as "true") with each kind of environment.
+"""
+
+import argparse
+import os, os.path
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,REPO_DIR)
+
+from xp.context import Context
+from xp.kernels.base import get_total_context
+
+def copied_environment(context):
+    """
+    The environment as xp used to build it: a new copy for every block.
+    """
+    total_context = dict(os.environ)
+    for k,v in context.items():
+        total_context[k] = v
+
+    return total_context
+
+def encode_environment(env):
+    # what subprocess does with env before it starts the process
+    return [os.fsencode(k) + b'=' + os.fsencode(v) for k,v in env.items()]
+
+def time_launches(get_env,context,num_blocks,spawn):
+    start = time.perf_counter()
+    for i in range(num_blocks):
+        # every block gets the pipeline's variables, as a task does
+        env = get_env(context.child())
+        if spawn:
+            subprocess.call('true',shell=True,env=env)
+        else:
+            encode_environment(env)
+
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser('kernel_launch',description='time building the environment of blocks')
+    parser.add_argument('-n','--blocks',type=int,default=10000,help='the number of blocks (default: %(default)s)')
+    parser.add_argument('-v','--variables',type=int,default=20,help='the number of pipeline variables (default: %(default)s)')
+    parser.add_argument('--spawn',action='store_true',help='also start a process for each block')
+
+    args = parser.parse_args()
+
+    context = Context({'VAR%d' % i:'value %d' % i for i in range(args.variables)})
+
+    print('%d blocks, %d variables, %d environment variables%s' %
+          (args.blocks,args.variables,len(os.environ),' (spawning)' if args.spawn else ''))
+
+    copied = time_launches(copied_environment,context,args.blocks,args.spawn)
+    print('  copied:  %.3fs (%.1fus per block)' % (copied,copied / args.blocks * 1e6))
+
+    cached = time_launches(get_total_context,context,args.blocks,args.spawn)
+    print('  cached:  %.3fs (%.1fus per block)' % (cached,cached / args.blocks * 1e6))
+    print('  speedup: %.2fx' % (copied / cached))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Times the pipeline parser on a generated pipeline file.
+
+    python benchmarks/parse_pipeline.py [-n LINES] [-r REPEATS] [--compare REV]
+
+With --compare, the parser in xp/pipeline.py as of the git revision REV is
+timed on the same file, e.g., --compare v1.0 to measure a change to the parser.
+"""
+
+import argparse
+import importlib.util
+import os, os.path
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,REPO_DIR)
+
+from xp import pipeline
+
+PREAMBLE = """\
+# a generated pipeline
+DATA_DIR=data
+YEARS=2011 2012 2013
+unset OLD_VAR
+prefix dir out
+
+###
+A block comment
+###
+
+"""
+
+TASK = """\
+task%(i)d: %(deps)s
+	@cpus 2
+	@mem 1G
+	export:
+		YEAR=$YEARS
+	code.sh:
+		echo $YEAR > $PLN(task%(i)d.txt)
+		# a shell comment
+
+		cat $PLN(task%(i)d.txt) | wc -l
+	code.py:
+		import sys
+		for i in range(10):
+			print(i)
+
+	# an xp comment
+"""
+
+def generate_pipeline(num_lines):
+    """
+    Return the contents of a pipeline with at least num_lines lines.
+    """
+    parts = [PREAMBLE]
+    num = PREAMBLE.count('\n')
+    i = 0
+    while num < num_lines:
+        deps = ' '.join(['task%d' % j for j in range(max(0,i-2),i)])
+        task = TASK % {'i':i, 'deps':deps}
+        parts.append(task)
+        num += task.count('\n')
+        i += 1
+
+    return ''.join(parts)
+
+def load_parser(rev):
+    """
+    Return the parse_pipeline_file function of xp/pipeline.py at the revision.
+    """
+    source = subprocess.check_output(['git','show','%s:xp/pipeline.py' % rev],cwd=REPO_DIR)
+
+    fd,module_file = tempfile.mkstemp(suffix='.py')
+    os.write(fd,source)
+    os.close(fd)
+    try:
+        spec = importlib.util.spec_from_file_location('pipeline_%s' % rev.replace('.','_'),module_file)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.remove(module_file)
+
+    return module.parse_pipeline_file
+
+def time_parser(parse,pipeline_file,repeats):
+    """
+    Return the fastest of the times taken to parse the file.
+    """
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        parse(pipeline_file)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser('parse_pipeline',description='time the pipeline parser')
+    parser.add_argument('-n','--lines',type=int,default=50000,help='the size of the generated pipeline (default: %(default)s)')
+    parser.add_argument('-r','--repeats',type=int,default=5,help='the number of times to parse it (default: %(default)s)')
+    parser.add_argument('--compare',metavar='REV',help='also time the parser at this git revision')
+
+    args = parser.parse_args()
+
+    fd,pipeline_file = tempfile.mkstemp(suffix='.xp')
+    os.write(fd,generate_pipeline(args.lines).encode('utf-8'))
+    os.close(fd)
+    try:
+        num_lines = sum(1 for line in open(pipeline_file))
+        print('parsing a pipeline of %d lines, best of %d' % (num_lines,args.repeats))
+
+        current = time_parser(pipeline.parse_pipeline_file,pipeline_file,args.repeats)
+        print('  current:  %.3fs (%d lines/s)' % (current,num_lines / current))
+
+        if args.compare is not None:
+            other = time_parser(load_parser(args.compare),pipeline_file,args.repeats)
+            print('  %-9s %.3fs (%d lines/s)' % (args.compare + ':',other,num_lines / other))
+            print('  speedup:  %.2fx' % (other / current))
+    finally:
+        os.remove(pipeline_file)
+
+if __name__ == '__main__':
+    main()
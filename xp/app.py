@@ -23,11 +23,16 @@ import time
 from xp.pipeline import *
 
 from xp.config import config_info, initialize_config_info
+from xp import config
+from xp.executor_loader import ExecutorLoader
+from xp.executors import workerpool
+from xp import marks
+from xp.cache import get_artifact_cache
 
 logger = logging.getLogger(os.path.basename(__file__))
 
 LOG_LEVELS = ['DEBUG','INFO','WARN','ERROR','CRITICAL']
-COMMANDS = ['tasks','unmark','mark','run','codeblock_info']
+COMMANDS = ['tasks','unmark','mark','migrate_marks','run','dry_run','codeblock_info','workers','cache']
 
 def do_codeblock_info(args):
 	parser = argparse.ArgumentParser('xp codeblock_info',
@@ -42,31 +47,31 @@ def do_codeblock_info(args):
 		ordered_prefixes = registered_code_blocks.keys()
 		ordered_prefixes.sort()
 	
-		print 'Supported code blocks:'
+		print('Supported code blocks:')
 		for prefix in ordered_prefixes:
 			cb = registered_code_blocks[prefix]
-			print'\t%s%s' % (prefix.ljust(max_prefix_len+2),cb.short_help)	
+			print('\t%s%s' % (prefix.ljust(max_prefix_len+2),cb.short_help))
 	
-		print
+		print()
 	else:
 		# print the info on that code prefix
 		if args.code_prefix not in registered_code_blocks:
-			print 'code prefix "%s" is unknown' % args.code_prefix
+			print('code prefix "%s" is unknown' % args.code_prefix)
 		else:
 			# TODO: Make this pretty format.  Currently no margins are enforced,
 			# so things will wrap and be ugly.
-			print
-			print registered_code_blocks[args.code_prefix].long_help
-			print
+			print()
+			print(registered_code_blocks[args.code_prefix].long_help)
+			print()
 
 			env_vars = registered_code_blocks[args.code_prefix].env_vars
 			if len(env_vars) > 0:
-				print 'Supported environment variables:'
+				print('Supported environment variables:')
 				max_var_length = max([len(x) for x in env_vars.keys()])
 				for var,info in env_vars.items():
-					print '  - %s%s' % (var.ljust(max_var_length+2),info)
+					print('  - %s%s' % (var.ljust(max_var_length+2),info))
 	
-				print
+				print()
 
 def do_info(args):
 	raise NotImplementedError
@@ -106,7 +111,7 @@ def do_tasks(args):
 		else:
 			info_str += '--'
 
-		print info_str
+		print(info_str)
 
 def do_unmark(args):
 	parser = argparse.ArgumentParser('xp unmark',description='unmark one or more tasks')
@@ -124,13 +129,13 @@ def do_unmark(args):
 		do_it = args.force
 		if not do_it:
 			# prompt
-			x = raw_input('are you sure you want to unmark entire pipelines? (y/n) ')
+			x = input('are you sure you want to unmark entire pipelines? (y/n) ')
 			do_it = (x == 'y')
 				
 		if do_it:
 			p.unmark_all_tasks(args.recur)
 		else:
-			print 'unmarking operation aborted'
+			print('unmarking operation aborted')
 
 	else:
 		for tname in args.task_names:
@@ -159,13 +164,13 @@ def do_mark(args):
 		do_it = args.force
 		if not do_it:
 			# prompt
-			x = raw_input('are you sure you want to mark entire pipelines? (y/n) ')
+			x = input('are you sure you want to mark entire pipelines? (y/n) ')
 			do_it = (x == 'y')
 				
 		if do_it:
 			p.mark_all_tasks(args.recur)
 		else:
-			print 'marking operation aborted'
+			print('marking operation aborted')
 	else:
 		for tname in args.task_names:
 			logger.debug('marking task: %s' % tname)
@@ -177,23 +182,36 @@ def do_mark(args):
 
 			task.mark()
 
-def do_dry_run(args):
-	raise NotImplementedError
-	pass
+def do_migrate_marks(args):
+	parser = argparse.ArgumentParser('xp migrate_marks',description='move the marks of tasks from one mark backend to another')
+	parser.add_argument('--from',dest='src_backend',choices=marks.BACKEND_CHOICES,default=marks.BACKEND_FILE,
+		help='the backend the marks are in now (default: %(default)s)')
+	parser.add_argument('--to',dest='dest_backend',choices=marks.BACKEND_CHOICES,default=marks.BACKEND_SQLITE,
+		help='the backend to move the marks to (default: %(default)s)')
+	parser.add_argument('-r','--recur',action='store_true',default=False,help='migrate the marks of the tasks in used pipelines as well')
+	parser.add_argument('pipeline_file',help='the pipeline whose marks should be migrated')
 
-def do_run(args):
-	parser = argparse.ArgumentParser('xp run',description='run a flex pipeline')
+	args = parser.parse_args(args)
+
+	# load the pipeline
+	p = get_pipeline(args.pipeline_file)
+
+	tasks = p.get_all_tasks() if args.recur else p.tasks
+	num_moved = marks.migrate_marks(tasks,args.src_backend,args.dest_backend)
+
+	print('moved %d marks from %s to %s' % (num_moved,args.src_backend,args.dest_backend))
+
+def add_force_arguments(parser):
 	parser.add_argument('-f','--force',choices=['NONE','TOP','ALL','SOLO'],default='NONE',
 		help='force tasks to run, even if they is already marked. NONE will not force any marked tasks to run; TOP will force the named task or the top-level tasks in the pipeline to run; ALL will force all marked tasks encountered in the dependency tree to run; SOLO will force the specified task to run, but NOT any of its dependencies (regardless of their state).')
 	parser.add_argument('-T',action='store_true',help='force all top level tasks to run. Equivalent to --force=TOP')
 	parser.add_argument('-A',action='store_true',help='force all tasks to run. Equivalent to --force=ALL')
 	parser.add_argument('-S',action='store_true',help='force the specified tasks to run, but NOT any of their dependencies. Equivalent to --force=SOLO')
-	parser.add_argument('pipeline_file',help='the pipeline to run')
-	parser.add_argument('task_name',nargs='?',help='the specific task to run. If omitted, the entire pipeline will be run')
-
-	
-	args = parser.parse_args(args)
 
+def get_force_value(args):
+	"""
+	Return the forcing selected by the arguments added by add_force_arguments.
+	"""
 	# ensure we don't have conflicting forcings
 	num_forcings = sum([args.force.upper() != 'NONE',args.T,args.A,args.S])
 	if num_forcings > 1:
@@ -215,22 +233,158 @@ def do_run(args):
 		logger.error('force status SOLO can only be used when tasks have been explicitly specified')
 		sys.exit(-1)
 
+	return force_val
+
+def do_dry_run(args):
+	parser = argparse.ArgumentParser('xp dry_run',description='print the tasks that running a pipeline would run, and why, without running them')
+	add_force_arguments(parser)
+	parser.add_argument('pipeline_file',help='the pipeline to check')
+	parser.add_argument('task_name',nargs='?',help='the specific task to check. If omitted, the entire pipeline will be checked')
+
+	args = parser.parse_args(args)
+
+	force_val = get_force_value(args)
+
 	# load the pipeline
 	p = get_pipeline(args.pipeline_file)
 
 	if not args.task_name:
-		# run the whole pipeline
-		p.run(force=force_val)
+		to_run = p.dry_run(force=force_val)
 	else:
 		t = p.get_task(args.task_name)
 
 		if t is None:
 			logger.error('task %s does not exist' % args.task_name)
 			sys.exit(-1)
+
+		to_run = t.dry_run(force=force_val)
+
+	if len(to_run) == 0:
+		print('nothing to run')
+		return
+
+	make_tname_str = lambda x: '%s/%s' % (x.pipeline.name,x.name)
+	tname_width = max([len(make_tname_str(x)) for x,reason in to_run]) + 4
+
+	for task,reason in to_run:
+		print(make_tname_str(task).ljust(tname_width) + reason)
+
+def do_run(args):
+	parser = argparse.ArgumentParser('xp run',description='run a flex pipeline')
+	add_force_arguments(parser)
+	parser.add_argument('-j','--jobs',type=int,default=1,help='the number of tasks that can be run at the same time')
+	parser.add_argument('-e','--engine',choices=['threads','asyncio'],default=None,
+		help='how tasks are executed when running them in parallel. threads runs each task in its own thread (the default); asyncio supervises all block processes from a single event loop, which scales to many concurrent tasks.')
+	parser.add_argument('-x','--executor',default=None,
+		help='the executor that runs the blocks of tasks that don\'t specify one with @executor (e.g., local or workers). The default is set in the configuration file.')
+	parser.add_argument('-k','--keep_going',action='store_true',
+		help='keep running the tasks that don\'t depend on a failed task and print a summary of the failed, blocked, and completed tasks at the end')
+	parser.add_argument('pipeline_file',help='the pipeline to run')
+	parser.add_argument('task_name',nargs='?',help='the specific task to run. If omitted, the entire pipeline will be run')
+
+	
+	args = parser.parse_args(args)
+
+	force_val = get_force_value(args)
+
+	if args.jobs < 1:
+		logger.error('the number of jobs must be at least 1')
+		sys.exit(-1)
+
+	if args.executor is not None and args.executor not in ExecutorLoader.singleton():
+		logger.error('unknown executor: %s' % args.executor)
+		sys.exit(-1)
+
+	# load the pipeline
+	p = get_pipeline(args.pipeline_file)
+
+	try:
+		if not args.task_name:
+			# run the whole pipeline
+			tasks_run = p.run(force=force_val,num_jobs=args.jobs,engine=args.engine,
+							  executor=args.executor,keep_going=args.keep_going)
 		else:
-			tasks_run = t.run(force=force_val)
-			if len(tasks_run) == 0:
-				logger.warn('task %s is already marked. Nothing done' % args.task_name)
+			t = p.get_task(args.task_name)
+
+			if t is None:
+				logger.error('task %s does not exist' % args.task_name)
+				sys.exit(-1)
+			else:
+				tasks_run = t.run(force=force_val,num_jobs=args.jobs,engine=args.engine,
+								  executor=args.executor,keep_going=args.keep_going)
+				if len(tasks_run) == 0:
+					logger.warn('task %s is already marked. Nothing done' % args.task_name)
+
+		if args.keep_going:
+			print_run_summary(tasks_run,[],[])
+	except TasksFailed as e:
+		print_run_summary(e.completed,e.failed,e.blocked)
+		sys.exit(-1)
+	finally:
+		ExecutorLoader.singleton().shutdown()
+
+def print_run_summary(completed,failed,blocked):
+	"""
+	Print what happened to the tasks of a keep-going run.
+	"""
+	print()
+	print('%d completed, %d failed, %d blocked' % (len(completed),len(failed),len(blocked)))
+	for t,e in failed:
+		print('\tFAILED\t%s (%s)' % (t.name,str(e)))
+	for t in blocked:
+		print('\tBLOCKED\t%s' % t.name)
+	for t in completed:
+		print('\tDONE\t%s' % t.name)
+
+def do_workers(args):
+	config_info = config.config_info()
+	default_socket = config_info.get(config.EXECUTORS_SECTION,config.WORKERPOOL_SOCKET_OPT).strip()
+	default_num_workers = int(config_info.get(config.EXECUTORS_SECTION,config.WORKERPOOL_WORKERS_OPT))
+
+	parser = argparse.ArgumentParser('xp workers',description='run a pool of worker processes that the workers executor sends blocks to')
+	parser.add_argument('-n','--num_workers',type=int,default=default_num_workers,help='the number of worker processes (default: %(default)s)')
+	parser.add_argument('-s','--socket',default=default_socket,help='the Unix socket to listen on. By default, the workerpool_socket configuration option is used')
+
+	args = parser.parse_args(args)
+
+	if not args.socket:
+		logger.error('no socket given and workerpool_socket is not configured')
+		sys.exit(-1)
+
+	workerpool.serve(args.socket,args.num_workers)
+
+def do_cache(args):
+	parser = argparse.ArgumentParser('xp cache',description='inspect and shrink the artifact cache of task outputs')
+	subparsers = parser.add_subparsers(dest='action')
+	subparsers.required = True
+
+	subparsers.add_parser('stats',help='print the size of the cache')
+
+	prune_parser = subparsers.add_parser('prune',help='evict the least recently used outputs')
+	prune_parser.add_argument('-s','--max_size',default=None,
+		help='the size to shrink the cache to (e.g., 2G). By default, the configured max_size is used')
+
+	args = parser.parse_args(args)
+
+	cache = get_artifact_cache(enabled_only=False)
+
+	if args.action == 'stats':
+		stats = cache.stats()
+		print('directory:\t%s' % stats['dir'])
+		print('enabled:\t%s' % ('yes' if get_artifact_cache() is not None else 'no'))
+		print('entries:\t%d' % stats['entries'])
+		print('size:\t\t%d bytes' % stats['size'])
+		print('max size:\t%s' % ('%d bytes' % stats['max_size'] if stats['max_size'] > 0 else 'unlimited'))
+		if stats['entries'] > 0:
+			print('oldest use:\t%s' % time.ctime(stats['oldest_use']))
+			print('newest use:\t%s' % time.ctime(stats['newest_use']))
+	else:
+		max_size = None
+		if args.max_size is not None:
+			max_size = int(config.parse_amount(args.max_size))
+
+		num_evicted,freed = cache.prune(max_size)
+		print('evicted %d entries (%d bytes)' % (num_evicted,freed))
 
 def main():
 	parser = argparse.ArgumentParser('xp')
@@ -254,16 +408,16 @@ def main():
 		eval('do_%s(args.cmd_args)' % args.command)
 	except ParseException as e:
 		if log_level in [logging.DEBUG,logging.INFO]:
-			logging.exception('parsing error on line %d: %s' % (e.lineno,e.message))
+			logging.exception('parsing error on line %d: %s' % (e.lineno,str(e)))
 		else:
-			logging.error('parsing error on line %d: %s' % (e.lineno,e.message))
+			logging.error('parsing error on line %d: %s' % (e.lineno,str(e)))
 
 		sys.exit(-1)
 	except Exception as e:
 		if log_level in [logging.DEBUG,logging.INFO]:
 			logging.exception('command %s failed' % args.command)
 		else:
-			logging.error('command %s failed: %s' % (args.command,e.message))
+			logging.error('command %s failed: %s' % (args.command,str(e)))
 
 		sys.exit(-1)
 
@@ -0,0 +1,345 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+This module contains the artifact cache, which keeps copies of the declared
+outputs of tasks (see the @outputs task property) that have been run.  When a
+task is run again with a fingerprint (see Task.fingerprint()) that is in the
+cache, its outputs are restored instead of running its blocks.
+
+The cache is a directory with one entry per fingerprint:
+
+    <dir>/<fingerprint[:2]>/<fingerprint>/
+        manifest.json   the paths of the outputs, relative to the directory
+                        of their pipeline, and their total size
+        0, 1, ...       copies of the outputs (files or directories)
+
+Since the paths are relative, an entry can be restored into any copy of the
+pipeline, e.g., another checkout of a project or another user's.
+
+The modification time of the manifest is the last time the entry was used.
+Whenever the cache grows beyond its max_size, the entries used least recently
+are evicted.
+
+If a remote cache is configured (see xp.remote_cache), the local cache is used
+as its staging area even if it isn't enabled itself.
+"""
+
+import os, os.path
+import json
+import errno
+import logging
+import shutil
+import tempfile
+import threading
+import time
+
+from xp import config
+from xp.config import parse_amount
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+MANIFEST_FNAME = 'manifest.json'
+
+# how outputs are put back in place: RESTORE_LINK makes copy-on-write clones
+# (reflinks) where the file system supports them and copies otherwise, so a
+# restored output never shares its data with the cache
+RESTORE_COPY = 'copy'
+RESTORE_LINK = 'link'
+RESTORE_CHOICES = [RESTORE_COPY,RESTORE_LINK]
+
+# the ioctl that clones a file on Linux (see ioctl_ficlone(2))
+FICLONE = 0x40049409
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def is_cache_enabled():
+    """
+    Return True if task outputs are cached, locally or remotely.
+    """
+    config_info = config.config_info()
+    return (config_info.getboolean(config.CACHE_SECTION,config.CACHE_ENABLED_OPT) or
+            len(config_info.get(config.CACHE_SECTION,config.CACHE_REMOTE_URL_OPT).strip()) > 0)
+
+def get_artifact_cache(enabled_only=True):
+    """
+    Return the configured ArtifactCache.  If enabled_only is True, None is
+    returned when the cache is disabled.
+    """
+    if enabled_only and not is_cache_enabled():
+        return None
+
+    config_info = config.config_info()
+    cache_dir = os.path.expanduser(config_info.get(config.CACHE_SECTION,config.CACHE_DIR_OPT).strip())
+    max_size = int(parse_amount(config_info.get(config.CACHE_SECTION,config.CACHE_MAX_SIZE_OPT)))
+    restore = config_info.get(config.CACHE_SECTION,config.CACHE_RESTORE_OPT).strip()
+
+    if restore not in RESTORE_CHOICES:
+        raise Exception('unknown cache restore method: %s' % restore)
+
+    key = (cache_dir,max_size,restore)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ArtifactCache(cache_dir,max_size,restore)
+
+        return _caches[key]
+
+def get_size(path):
+    """
+    Return the number of bytes taken up by the file or directory.
+    """
+    if not os.path.isdir(path):
+        return os.lstat(path).st_size
+
+    size = 0
+    for dirpath,dirnames,filenames in os.walk(path):
+        for fname in filenames:
+            size += os.lstat(os.path.join(dirpath,fname)).st_size
+
+    return size
+
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+def clone_file(src,dest):
+    """
+    Make dest a copy-on-write clone of src, which shares its data until either
+    is changed.  Return False if the file system (or platform) can't.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    src_fh = open(src,'rb')
+    try:
+        dest_fh = open(dest,'wb')
+        try:
+            fcntl.ioctl(dest_fh.fileno(),FICLONE,src_fh.fileno())
+        except OSError as e:
+            dest_fh.close()
+            os.remove(dest)
+            if e.errno not in (errno.EOPNOTSUPP,errno.ENOTTY,errno.EXDEV,errno.EINVAL,errno.ENOSYS):
+                raise
+            return False
+        dest_fh.close()
+    finally:
+        src_fh.close()
+
+    shutil.copystat(src,dest)
+    return True
+
+class ArtifactCache:
+    """
+    A local, content-addressed store of task outputs.  A max_size of 0 means
+    the cache is unbounded.
+    """
+    def __init__(self,cache_dir,max_size=0,restore=RESTORE_COPY):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.restore_method = restore
+
+        self._lock = threading.Lock()
+
+    def entry_dir(self,fingerprint):
+        """
+        Return the directory that holds (or would hold) the entry.
+        """
+        return os.path.join(self.cache_dir,fingerprint[:2],fingerprint)
+
+    def _read_manifest(self,entry_dir):
+        try:
+            fh = open(os.path.join(entry_dir,MANIFEST_FNAME),'r')
+            manifest = json.load(fh)
+            fh.close()
+        except (OSError,ValueError):
+            return None
+
+        return manifest
+
+    def __contains__(self,fingerprint):
+        return os.path.exists(os.path.join(self.entry_dir(fingerprint),MANIFEST_FNAME))
+
+    def entries(self):
+        """
+        Return a list of (fingerprint,last_used,size) tuples for the entries
+        in the cache, least recently used first.
+        """
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir() or shard.name.startswith('.'):
+                continue
+
+            for entry in os.scandir(shard.path):
+                manifest_file = os.path.join(entry.path,MANIFEST_FNAME)
+                manifest = self._read_manifest(entry.path)
+                if manifest is None:
+                    continue
+
+                entries.append((entry.name,os.stat(manifest_file).st_mtime,manifest['size']))
+
+        entries.sort(key=lambda x: x[1])
+        return entries
+
+    def stats(self):
+        """
+        Return a dictionary describing the contents of the cache.
+        """
+        entries = self.entries()
+        return {'dir':self.cache_dir,
+                'entries':len(entries),
+                'size':sum([e[2] for e in entries]),
+                'max_size':self.max_size,
+                'oldest_use':entries[0][1] if len(entries) > 0 else None,
+                'newest_use':entries[-1][1] if len(entries) > 0 else None}
+
+    def store(self,fingerprint,paths,base_dir):
+        """
+        Copy the files (or directories) at paths into the cache under the
+        fingerprint.  The paths are recorded relative to base_dir, the
+        directory of their pipeline.  Return True if the outputs are in the
+        cache afterwards.
+        """
+        entry_dir = self.entry_dir(fingerprint)
+        manifest = self._read_manifest(entry_dir)
+        if manifest is not None and 'paths' in manifest:
+            os.utime(os.path.join(entry_dir,MANIFEST_FNAME))
+            return True
+        elif manifest is not None:
+            # made by an older xp, which recorded absolute paths
+            shutil.rmtree(entry_dir,ignore_errors=True)
+
+        tmp_dir = self.make_tmp_dir()
+        try:
+            size = 0
+            for i,path in enumerate(paths):
+                dest = os.path.join(tmp_dir,str(i))
+                if os.path.isdir(path):
+                    shutil.copytree(path,dest,symlinks=True)
+                else:
+                    shutil.copy2(path,dest)
+                size += get_size(dest)
+
+            if self.max_size > 0 and size > self.max_size:
+                logger.info('outputs of %s are too large to cache (%d bytes)' % (fingerprint,size))
+                return False
+
+            fh = open(os.path.join(tmp_dir,MANIFEST_FNAME),'w')
+            json.dump({'paths':[os.path.relpath(p,base_dir) for p in paths], 'size':size},fh)
+            fh.close()
+
+            self.add_entry(fingerprint,tmp_dir)
+        finally:
+            shutil.rmtree(tmp_dir,ignore_errors=True)
+
+        return True
+
+    def make_tmp_dir(self):
+        """
+        Return a new temporary directory in the cache (see add_entry).
+        """
+        os.makedirs(self.cache_dir,exist_ok=True)
+        return tempfile.mkdtemp(prefix='.tmp-',dir=self.cache_dir)
+
+    def add_entry(self,fingerprint,src_dir):
+        """
+        Move a complete entry (a manifest and the outputs it lists) from
+        src_dir, a directory made by make_tmp_dir(), into the cache.
+        """
+        # the entry is moved in place in one step so that other processes
+        # never see a partial entry
+        entry_dir = self.entry_dir(fingerprint)
+        os.makedirs(os.path.dirname(entry_dir),exist_ok=True)
+        try:
+            os.rename(src_dir,entry_dir)
+        except OSError:
+            # another process stored the same outputs first
+            logger.debug('cache entry %s already exists' % fingerprint)
+
+        self.prune()
+
+    def restore(self,fingerprint,base_dir):
+        """
+        Put the outputs stored under the fingerprint in place, relative to
+        base_dir, the directory of the pipeline being run.  Return False if
+        the fingerprint isn't in the cache.
+        """
+        entry_dir = self.entry_dir(fingerprint)
+        manifest = self._read_manifest(entry_dir)
+        if manifest is None or 'paths' not in manifest:
+            return False
+
+        now = time.time()
+        for i,rel_path in enumerate(manifest['paths']):
+            src = os.path.join(entry_dir,str(i))
+            path = os.path.join(base_dir,rel_path)
+
+            remove_path(path)
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+            if os.path.isdir(src):
+                shutil.copytree(src,path,symlinks=True,copy_function=self._copy)
+            else:
+                self._copy(src,path)
+
+            # the outputs are as new as the run that restored them
+            os.utime(path,(now,now))
+
+        os.utime(os.path.join(entry_dir,MANIFEST_FNAME))
+
+        return True
+
+    def _copy(self,src,dest):
+        if self.restore_method == RESTORE_LINK and clone_file(src,dest):
+            return dest
+
+        return shutil.copy2(src,dest)
+
+    def prune(self,max_size=None):
+        """
+        Evict the least recently used entries until the cache is no larger
+        than max_size (by default, the cache's max_size; 0 means unbounded).
+        Return (number of entries evicted,bytes freed).
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        if max_size <= 0:
+            return 0,0
+
+        with self._lock:
+            entries = self.entries()
+            total_size = sum([e[2] for e in entries])
+
+            num_evicted = 0
+            freed = 0
+            for fingerprint,last_used,size in entries:
+                if total_size <= max_size:
+                    break
+
+                logger.debug('evicting cache entry %s' % fingerprint)
+                shutil.rmtree(self.entry_dir(fingerprint),ignore_errors=True)
+                total_size -= size
+                num_evicted += 1
+                freed += size
+
+        return num_evicted,freed
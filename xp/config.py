@@ -1,13 +1,57 @@
 import logging
 import os, os.path
+import re
 from configparser import RawConfigParser
 
 logger = logging.getLogger(os.path.basename(__file__))
 
 KERNELS_SECTION = 'Kernels'
 ACTIVE_KERNELS_OPT = 'active_kernels'
+PYTHON_PRELOAD_OPT = 'python_preload'
+
+EXECUTORS_SECTION = 'Executors'
+ACTIVE_EXECUTORS_OPT = 'active_executors'
+DEFAULT_EXECUTOR_OPT = 'default_executor'
+WORKERPOOL_WORKERS_OPT = 'workerpool_workers'
+WORKERPOOL_SOCKET_OPT = 'workerpool_socket'
+
+RESOURCES_SECTION = 'Resources'
+CPUS_OPT = 'cpus'
+MEM_OPT = 'mem'
+IO_OPT = 'io'
+DURATIONS_DIR_OPT = 'durations_dir'
+
+MARKS_SECTION = 'Marks'
+MARK_BACKEND_OPT = 'backend'
+MARK_DB_FILE_OPT = 'db_file'
+MARK_FINGERPRINTS_OPT = 'fingerprints'
+
+PARSING_SECTION = 'Parsing'
+PARSE_CACHE_OPT = 'cache'
+PARSE_CACHE_DIR_OPT = 'cache_dir'
+PARSE_CACHE_MAX_ENTRIES_OPT = 'max_entries'
+
+CACHE_SECTION = 'Cache'
+CACHE_ENABLED_OPT = 'enabled'
+CACHE_DIR_OPT = 'dir'
+CACHE_MAX_SIZE_OPT = 'max_size'
+CACHE_RESTORE_OPT = 'restore'
+CACHE_REMOTE_URL_OPT = 'remote_url'
+CACHE_REMOTE_TRANSFERS_OPT = 'remote_transfers'
+CACHE_REMOTE_TIMEOUT_OPT = 'remote_timeout'
+CACHE_REMOTE_UPLOAD_OPT = 'remote_upload'
+
+FUNCTIONS_SECTION = 'Functions'
+SHELL_TTL_OPT = 'shell_ttl'
+SHELL_CACHE_DIR_OPT = 'shell_cache_dir'
 
 DEFAULT_CONFIG_DIR = os.path.join(os.environ['HOME'],'.config','xp')
+DEFAULT_CACHE_DIR = os.path.join(os.environ['HOME'],'.cache','xp','artifacts')
+DEFAULT_SHELL_CACHE_DIR = os.path.join(os.environ['HOME'],'.cache','xp','shell')
+DEFAULT_DURATIONS_DIR = os.path.join(os.environ['HOME'],'.cache','xp','durations')
+
+AMOUNT_PATTERN = re.compile('^(\d+(\.\d*)?|\.\d+)\s*([KMGT]?)B?$',re.IGNORECASE)
+AMOUNT_MULTIPLIERS = {'':1, 'K':2**10, 'M':2**20, 'G':2**30, 'T':2**40}
 
 __config_info = None
 
@@ -24,16 +68,91 @@ def configure_parser(config_parser):
     config_parser.set(KERNELS_SECTION,'kernel_paths','%(config_dir)s/kernels')
     
     config_parser.set(KERNELS_SECTION,'active_kernels',
-        """    xp.kernels.test.TestKernel 
+        """    xp.kernels.test.TestKernel
+            xp.kernels.test.PersistentTestKernel
             xp.kernels.shell.ShellKernel
             xp.kernels.gnuplot.GNUPlotKernel
             xp.kernels.awk.AwkKernel
             xp.kernels.python.PythonKernel
+            xp.kernels.pyfork.PythonForkKernel
+            xp.kernels.pysession.PythonSessionKernel
+            xp.kernels.pyinline.PythonInlineKernel
             xp.kernels.ipython.IPythonKernel
             xp.kernels.pyhmr.PythonHadoopMapReduceKernel""")
 
+    # the modules the pyfork kernel imports when no @preload is given
+    config_parser.set(KERNELS_SECTION,PYTHON_PRELOAD_OPT,'')
+
+    # the executors that blocks can be sent to
+    config_parser.add_section(EXECUTORS_SECTION)
+    config_parser.set(EXECUTORS_SECTION,ACTIVE_EXECUTORS_OPT,
+        """    xp.executors.local.LocalExecutor
+            xp.executors.workerpool.WorkerPoolExecutor""")
+    config_parser.set(EXECUTORS_SECTION,DEFAULT_EXECUTOR_OPT,'local')
+    config_parser.set(EXECUTORS_SECTION,WORKERPOOL_WORKERS_OPT,str(os.cpu_count() or 1))
+    config_parser.set(EXECUTORS_SECTION,WORKERPOOL_SOCKET_OPT,'')
+
+    # the resources available on this host to tasks being run in parallel
+    config_parser.add_section(RESOURCES_SECTION)
+    config_parser.set(RESOURCES_SECTION,CPUS_OPT,str(os.cpu_count() or 1))
+    config_parser.set(RESOURCES_SECTION,MEM_OPT,str(physical_memory()))
+    config_parser.set(RESOURCES_SECTION,IO_OPT,'1')
+
+    # how long tasks took to run, used to schedule them (see xp.durations)
+    config_parser.set(RESOURCES_SECTION,DURATIONS_DIR_OPT,DEFAULT_DURATIONS_DIR)
+
+    # where the marks of tasks are kept (see xp.marks)
+    config_parser.add_section(MARKS_SECTION)
+    config_parser.set(MARKS_SECTION,MARK_BACKEND_OPT,'file')
+    config_parser.set(MARKS_SECTION,MARK_DB_FILE_OPT,'.xp-marks.db')
+    config_parser.set(MARKS_SECTION,MARK_FINGERPRINTS_OPT,'false')
+
+    # the cache of parsed pipeline files (see xp.parse_cache)
+    config_parser.add_section(PARSING_SECTION)
+    config_parser.set(PARSING_SECTION,PARSE_CACHE_OPT,'true')
+    config_parser.set(PARSING_SECTION,PARSE_CACHE_DIR_OPT,os.path.join(DEFAULT_CONFIG_DIR,'parse_cache'))
+    config_parser.set(PARSING_SECTION,PARSE_CACHE_MAX_ENTRIES_OPT,'500')
+
+    # the artifact cache for task outputs (see xp.cache)
+    config_parser.add_section(CACHE_SECTION)
+    config_parser.set(CACHE_SECTION,CACHE_ENABLED_OPT,'false')
+    config_parser.set(CACHE_SECTION,CACHE_DIR_OPT,DEFAULT_CACHE_DIR)
+    config_parser.set(CACHE_SECTION,CACHE_MAX_SIZE_OPT,'10G')
+    config_parser.set(CACHE_SECTION,CACHE_RESTORE_OPT,'copy')
+    config_parser.set(CACHE_SECTION,CACHE_REMOTE_URL_OPT,'')
+    config_parser.set(CACHE_SECTION,CACHE_REMOTE_TRANSFERS_OPT,'4')
+    config_parser.set(CACHE_SECTION,CACHE_REMOTE_TIMEOUT_OPT,'30')
+    config_parser.set(CACHE_SECTION,CACHE_REMOTE_UPLOAD_OPT,'true')
+
+    # how long the outputs of inline shell functions are kept (see xp.shell_memo)
+    config_parser.add_section(FUNCTIONS_SECTION)
+    config_parser.set(FUNCTIONS_SECTION,SHELL_TTL_OPT,'0')
+    config_parser.set(FUNCTIONS_SECTION,SHELL_CACHE_DIR_OPT,DEFAULT_SHELL_CACHE_DIR)
+
     return
 
+def parse_amount(value):
+    """
+    Parse an amount such as "2", "0.5" or "4G" (memory suffixes K, M, G and T
+    are powers of 1024).
+
+    Raise ValueError if the amount isn't valid.
+    """
+    m = AMOUNT_PATTERN.match(value.strip())
+    if m is None:
+        raise ValueError('invalid resource amount: %s' % value)
+
+    return float(m.group(1)) * AMOUNT_MULTIPLIERS[m.group(3).upper()]
+
+def physical_memory():
+    """
+    Return the number of bytes of physical memory on this host or 0 if it can't be determined.
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError,OSError,AttributeError):
+        return 0
+
 def initialize_config_info_from_string(config_content):
     from io import StringIO
     fh_like = StringIO(config_content)
@@ -0,0 +1,214 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+This module contains the contexts that hold the variables blocks are run with.
+
+A context is a stack of layers, each a dictionary.  A pipeline's preamble is
+evaluated into one context, and each task that runs gets a child of it (see
+Context.child()) that its export blocks write to.  Nothing is copied: a
+variable is looked up in each layer in turn, top first, and changes only ever
+go to the top layer, so they're never seen by the parent.
+
+Blocks are run with the variables on top of the process environment (see
+with_environment()).  The environment is read once per run and the merged
+environment of each context is kept until the context changes, so the tasks
+of a pipeline that don't change its variables all share one.
+
+The value of a variable can be a LazyValue, which is only worked out when the
+variable is first looked up.
+"""
+
+import os
+import threading
+from collections.abc import MutableMapping
+from types import MappingProxyType
+
+# marks a variable unset in a layer that's set in a layer below it
+_DELETED = object()
+
+_environment = None
+_environment_lock = threading.Lock()
+
+def get_environment():
+    """
+    Return a snapshot of the process environment.  The snapshot is taken the
+    first time it's needed and kept until refresh_environment() is called.
+    """
+    global _environment
+
+    with _environment_lock:
+        if _environment is None:
+            _environment = dict(os.environ)
+
+        return _environment
+
+def refresh_environment():
+    """
+    Forget the snapshot of the process environment, so that changes made to
+    os.environ since it was taken are seen.
+    """
+    global _environment
+
+    with _environment_lock:
+        _environment = None
+
+def with_environment(context):
+    """
+    Return an immutable mapping of the process environment with the
+    variables in the context on top.
+    """
+    if isinstance(context,Context):
+        return context.environment()
+
+    env = dict(get_environment())
+    env.update(context)
+    return MappingProxyType(env)
+
+class LazyValue:
+    """
+    A value that's worked out by calling evaluate() the first time it's
+    needed.  If evaluate() raises an exception, it's called again the next
+    time.
+    """
+    def __init__(self,evaluate):
+        self._evaluate = evaluate
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._evaluate is not None:
+                self._value = self._evaluate()
+                self._evaluate = None
+
+            return self._value
+
+class Context(MutableMapping):
+    """
+    A set of variables layered on top of a parent context.  A context must not
+    be changed once it has children.
+    """
+    def __init__(self,variables=None,parent=None):
+        self.parent = parent
+        self._layer = dict(variables) if variables is not None else {}
+
+        # incremented whenever the layer changes
+        self._version = 0
+        self._environment = None
+
+    def child(self):
+        """
+        Return a new, empty context on top of this one.  This is the cheap way
+        to get a copy of a context that can be changed.
+        """
+        return Context(parent=self)
+
+    def __getitem__(self,key):
+        context = self
+        while context is not None:
+            value = context._layer.get(key,None)
+            if value is not None or key in context._layer:
+                if value is _DELETED:
+                    break
+                elif value.__class__ is LazyValue:
+                    return value.get()
+                return value
+            context = context.parent
+
+        raise KeyError(key)
+
+    def __contains__(self,key):
+        # lazy values needn't be worked out to know they're there
+        context = self
+        while context is not None:
+            if key in context._layer:
+                return context._layer[key] is not _DELETED
+            context = context.parent
+
+        return False
+
+    def __setitem__(self,key,value):
+        self._layer[key] = value
+        self._version += 1
+
+    def __delitem__(self,key):
+        if key not in self:
+            raise KeyError(key)
+
+        if self.parent is not None and key in self.parent:
+            self._layer[key] = _DELETED
+        else:
+            del self._layer[key]
+        self._version += 1
+
+    def environment(self):
+        """
+        Return an immutable mapping of the process environment with these
+        variables on top (see with_environment()).
+        """
+        # an empty layer has the same variables as its parent
+        if len(self._layer) == 0 and self.parent is not None:
+            return self.parent.environment()
+
+        base_env = get_environment()
+        cached = self._environment
+        if cached is not None and cached[0] == self._version and cached[1] is base_env:
+            return cached[2]
+
+        env = dict(base_env)
+        env.update(self.items())
+        env = MappingProxyType(env)
+
+        self._environment = (self._version,base_env,env)
+        return env
+
+    def __iter__(self):
+        seen = set()
+        context = self
+        while context is not None:
+            for key,value in context._layer.items():
+                if key not in seen:
+                    seen.add(key)
+                    if value is not _DELETED:
+                        yield key
+            context = context.parent
+
+    def flatten(self):
+        """
+        Return a context with the same variables in a single layer.  Lazy
+        values are carried over without being worked out.
+        """
+        layer = {}
+        for context in reversed(self._layers()):
+            layer.update(context._layer)
+
+        return Context({k:v for k,v in layer.items() if v is not _DELETED})
+
+    def _layers(self):
+        layers = []
+        context = self
+        while context is not None:
+            layers.append(context)
+            context = context.parent
+
+        return layers
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return 'Context(%r)' % dict(self)
@@ -0,0 +1,105 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+This module keeps track of how long the tasks of a pipeline took to run the
+last time they were run.  The scheduler uses these durations to start the
+tasks on the longest chains first.
+
+The durations of a pipeline's tasks are stored as a JSON dictionary in the
+durations directory (the durations_dir option of the Resources section), in a
+file named after the pipeline's path, so that pipelines in read-only
+directories are scheduled the same way and nothing is left beside them.
+"""
+
+import os, os.path
+import hashlib
+import json
+import logging
+import threading
+
+from xp import config
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+def get_duration_history(pipeline):
+    """
+    Return the DurationHistory for the pipeline.  Only one history object is
+    created per pipeline file.
+    """
+    durations_dir = os.path.expanduser(config.config_info().get(config.RESOURCES_SECTION,config.DURATIONS_DIR_OPT).strip())
+    fname = os.path.join(durations_dir,'%s.json' % hashlib.sha1(pipeline.abs_filename.encode('utf-8')).hexdigest())
+
+    with _histories_lock:
+        if fname not in _histories:
+            _histories[fname] = DurationHistory(fname)
+
+        return _histories[fname]
+
+class DurationHistory:
+    """
+    The wall-clock durations (in seconds) of the tasks in one pipeline.
+    """
+    def __init__(self,fname):
+        self.fname = fname
+        self._lock = threading.Lock()
+        self._durations = None
+
+    def _load(self):
+        if self._durations is not None:
+            return
+
+        self._durations = {}
+        if not os.path.exists(self.fname):
+            return
+
+        try:
+            fh = open(self.fname,'r')
+            durations = json.load(fh)
+            fh.close()
+        except (OSError,ValueError) as e:
+            logger.warn('ignoring unreadable duration history %s: %s' % (self.fname,e))
+            return
+
+        self._durations = {k:float(v) for k,v in durations.items()}
+
+    def get(self,task_name):
+        """
+        Return the duration of the last successful run of the task or None if
+        it hasn't been run.
+        """
+        with self._lock:
+            self._load()
+            return self._durations.get(task_name,None)
+
+    def record(self,task_name,duration):
+        with self._lock:
+            self._load()
+            self._durations[task_name] = duration
+
+            # write to a temporary file first so readers never see a partial file
+            tmp_fname = '%s.tmp' % self.fname
+            try:
+                os.makedirs(os.path.dirname(self.fname),exist_ok=True)
+                fh = open(tmp_fname,'w')
+                json.dump(self._durations,fh,indent=1,sort_keys=True)
+                fh.close()
+                os.replace(tmp_fname,self.fname)
+            except OSError as e:
+                logger.warn('unable to save duration history %s: %s' % (self.fname,e))
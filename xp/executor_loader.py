@@ -0,0 +1,141 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os.path
+import logging
+import re
+import threading
+
+from xp import config
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+ACTIVE_EXECUTOR_CLASS_PATTERN = re.compile('(\w[\w_\.]*)(\([\w_]+\))?')
+
+class ExecutorLoader:
+
+    _singleton = None
+
+    @staticmethod
+    def reinitialize_singleton():
+        """
+        Re-create the singleton and return the new object.
+        This is typically only used for unit testing.
+        """
+        if ExecutorLoader._singleton is not None:
+            ExecutorLoader._singleton.shutdown()
+
+        ExecutorLoader._singleton = None
+        return ExecutorLoader.singleton()
+
+    @staticmethod
+    def singleton():
+        """
+        Return the ExecutorLoader instance that is used in this VM.
+        """
+        if ExecutorLoader._singleton is None:
+            ExecutorLoader()
+
+        return ExecutorLoader._singleton
+
+    def __init__(self):
+        if ExecutorLoader._singleton is not None:
+            raise Exception('An ExecutorLoader already exists')
+
+        self.__initialize()
+
+        ExecutorLoader._singleton = self
+
+    def __initialize(self):
+        config_info = config.config_info()
+
+        # load the name to executor mapping
+        self._name_map = {}
+
+        executor_names = config_info.get(config.EXECUTORS_SECTION,config.ACTIVE_EXECUTORS_OPT).split()
+        for ename in executor_names:
+            m = ACTIVE_EXECUTOR_CLASS_PATTERN.match(ename)
+            if not m:
+                raise Exception('unable to parse executor name: %s' % ename)
+
+            ename = m.group(1)
+            name = m.group(2)
+
+            executor_class = self.__get_executor_class(ename)
+            if not name:
+                name = executor_class.default_name()
+            else:
+                name = name[1:-1]
+
+            self._name_map[name] = executor_class
+
+        self._default_name = config_info.get(config.EXECUTORS_SECTION,config.DEFAULT_EXECUTOR_OPT).strip()
+
+        # unlike kernels, executors hold on to resources (e.g., worker
+        # processes), so one instance of each is shared for the whole run
+        self._instances = {}
+        self._lock = threading.Lock()
+
+        # done
+
+    def __get_executor_class(self,full_class_name):
+        module_path,class_name = full_class_name.rsplit('.',1)
+        logger.debug('getting executor: %s.%s' % (module_path,class_name))
+
+        module = __import__(module_path, fromlist=[class_name])
+        executor_class = getattr(module,class_name)
+
+        return executor_class
+
+    def __contains__(self,name):
+        return name in self._name_map
+
+    def default_name(self):
+        return self._default_name
+
+    def get_executor(self,name=None):
+        """
+        Return the executor with the given name.  If name is None, the
+        configured default executor is returned.
+        """
+        if name is None:
+            name = self._default_name
+
+        if name not in self._name_map:
+            raise Exception('unknown executor: %s' % name)
+
+        with self._lock:
+            if name not in self._instances:
+                self._instances[name] = self._name_map[name]()
+
+            return self._instances[name]
+
+    def shutdown(self):
+        """
+        Shut down all executors that have been used.
+        """
+        with self._lock:
+            instances = list(self._instances.values())
+            self._instances = {}
+
+        for executor in instances:
+            executor.shutdown()
+
+    def executors(self):
+        return [*self._name_map.values()]
+
+    def names(self):
+        return [*self._name_map.keys()]
@@ -0,0 +1,80 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+
+class ExecutionFailed(Exception):
+    """
+    Raised by an executor when a block couldn't be run for a reason other than
+    the block's process failing (e.g., an unknown kernel or a lost worker).
+    """
+    pass
+
+#######
+# The Executor base class
+#######
+class Executor:
+    """
+    An executor decides where and how the (fully expanded) code blocks of a
+    task are run.  A single executor object is used for an entire run.
+    """
+
+    @staticmethod
+    def default_name():
+        """
+        Return the name the executor is selected by (e.g., with @executor).
+        """
+        raise NotImplementedError('default_name not implemented')
+
+    @staticmethod
+    def short_help():
+        """
+        Return a short description of the executor.
+        """
+        raise NotImplementedError('short_help not implemented')
+
+    def run_block(self,lang,arg_str,context,cwd,content):
+        """
+        Run the block.
+
+        Params
+        ------
+
+          - lang is the language suffix of the block, which selects the kernel
+          - arg_str is the expanded argument string on the block definition line
+          - context is the set of environment variables the block is aware of
+          - cwd is the current working directory
+          - content is the expanded content of the block
+
+        Raises a CalledProcessError if the block's process fails and an
+        ExecutionFailed if it couldn't be run at all.
+        """
+        raise NotImplementedError('run_block not implemented')
+
+    async def run_block_async(self,lang,arg_str,context,cwd,content):
+        """
+        Run the block from within an asyncio event loop.  By default,
+        run_block(...) is called in a worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None,self.run_block,lang,arg_str,context,cwd,content)
+
+    def shutdown(self):
+        """
+        Release any resources (processes, connections) held by the executor.
+        This is called at the end of a run.
+        """
+        pass
@@ -0,0 +1,55 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import logging
+import os.path
+
+from xp.executors.base import Executor, ExecutionFailed
+from xp.kernel_loader import KernelLoader
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+class LocalExecutor(Executor):
+
+    @staticmethod
+    def default_name():
+        return 'local'
+
+    @staticmethod
+    def short_help():
+        return 'run blocks in the xp process using the active kernels'
+
+    def get_kernel(self,lang):
+        kloader = KernelLoader.singleton()
+        if lang in kloader:
+            return kloader.get_kernel(lang)
+        else:
+            raise ExecutionFailed('unknown language suffix: %s' % lang)
+
+    def run_block(self,lang,arg_str,context,cwd,content):
+        kernel = self.get_kernel(lang)
+        kernel.run(arg_str,context,cwd,content)
+
+    async def run_block_async(self,lang,arg_str,context,cwd,content):
+        kernel = self.get_kernel(lang)
+
+        if hasattr(kernel,'run_async'):
+            await kernel.run_async(arg_str,context,cwd,content)
+        else:
+            # kernels that don't derive from Kernel are run in a worker thread
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None,kernel.run,arg_str,context,cwd,content)
@@ -0,0 +1,311 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+An executor that ships blocks to a pool of long-lived worker processes over
+a Unix socket.
+
+The pool is either a daemon started with ``xp workers`` (in which case the
+workerpool_socket configuration option points to its socket) or, if no socket
+is configured, a private pool that is started on first use and shut down at
+the end of the run.
+
+Each request is one connection carrying one message (see xp.messaging):
+
+    {"lang": ..., "arg_str": ..., "context": {...}, "cwd": ..., "content": [...]}
+
+and the worker replies with
+
+    {"status": "ok" | "failed" | "error", "retcode": ..., "message": ...,
+     "stdout": ..., "stderr": ...}
+
+where "failed" means the block's process exited with a non-zero return code
+and "error" means the block couldn't be run.
+"""
+
+import argparse
+import asyncio
+import atexit
+import logging
+import os, os.path
+import shutil
+import signal
+import socket
+import subprocess
+from subprocess import CalledProcessError
+import sys
+import tempfile
+import threading
+import time
+
+import xp
+from xp import config
+from xp.executors.base import Executor, ExecutionFailed
+from xp.executors.local import LocalExecutor
+from xp.kernels.persistent import run_captured, STATUS_OK, STATUS_FAILED, STATUS_ERROR
+from xp.messaging import send_message, recv_message, send_message_async, recv_message_async, ConnectionClosed
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+# how long to wait for a private pool to start listening
+POOL_STARTUP_TIMEOUT = 30
+
+LISTEN_BACKLOG = 128
+
+########
+# The client side
+########
+class WorkerPoolExecutor(Executor):
+
+    @staticmethod
+    def default_name():
+        return 'workers'
+
+    @staticmethod
+    def short_help():
+        return 'run blocks in a pool of worker processes connected by a Unix socket'
+
+    def __init__(self):
+        config_info = config.config_info()
+        self.num_workers = int(config_info.get(config.EXECUTORS_SECTION,config.WORKERPOOL_WORKERS_OPT))
+        self.socket_path = config_info.get(config.EXECUTORS_SECTION,config.WORKERPOOL_SOCKET_OPT).strip()
+
+        self._lock = threading.Lock()
+        self._server = None
+        self._server_dir = None
+
+    def _ensure_pool(self):
+        """
+        Make sure there is a pool to send blocks to, starting a private one if need be.
+        """
+        with self._lock:
+            if self._server is not None:
+                return
+            elif len(self.socket_path) > 0:
+                if not is_listening(self.socket_path):
+                    raise ExecutionFailed('no worker pool is listening on %s (start one with "xp workers")' % self.socket_path)
+            else:
+                self._start_private_pool()
+
+    def _start_private_pool(self):
+        self._server_dir = tempfile.mkdtemp(prefix='xp-workers-')
+        self.socket_path = os.path.join(self._server_dir,'workers.sock')
+
+        # the workers should use the same configuration as we are
+        config_file = os.path.join(self._server_dir,'xp.ini')
+        fh = open(config_file,'w')
+        config.config_info().write(fh)
+        fh.close()
+
+        env = dict(os.environ)
+        xp_path = os.path.dirname(os.path.dirname(os.path.abspath(xp.__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([xp_path] + [x for x in [env.get('PYTHONPATH')] if x])
+
+        logger.info('starting a pool of %d workers on %s' % (self.num_workers,self.socket_path))
+        self._server = subprocess.Popen([sys.executable,'-m','xp.executors.workerpool',
+                                         '-s',self.socket_path,'-n',str(self.num_workers),
+                                         '-C',config_file],env=env)
+        atexit.register(self.shutdown)
+
+        start_time = time.time()
+        while not is_listening(self.socket_path):
+            if self._server.poll() is not None:
+                raise ExecutionFailed('worker pool exited during startup (code %d)' % self._server.returncode)
+            elif time.time() - start_time > POOL_STARTUP_TIMEOUT:
+                raise ExecutionFailed('worker pool did not start listening on %s' % self.socket_path)
+            time.sleep(0.05)
+
+    def make_request(self,lang,arg_str,context,cwd,content):
+        return {'lang':lang, 'arg_str':arg_str, 'context':dict(context), 'cwd':cwd, 'content':list(content)}
+
+    def handle_response(self,response):
+        sys.stdout.write(response.get('stdout',''))
+        sys.stdout.flush()
+        sys.stderr.write(response.get('stderr',''))
+        sys.stderr.flush()
+
+        status = response['status']
+        if status == STATUS_FAILED:
+            raise CalledProcessError(response['retcode'],response.get('message',''),None)
+        elif status != STATUS_OK:
+            raise ExecutionFailed(response.get('message','worker failed to run the block'))
+
+    def run_block(self,lang,arg_str,context,cwd,content):
+        self._ensure_pool()
+
+        sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            fh = sock.makefile('rwb')
+            send_message(fh,self.make_request(lang,arg_str,context,cwd,content))
+            response = recv_message(fh)
+            fh.close()
+        except (ConnectionClosed,OSError) as e:
+            raise ExecutionFailed('lost connection to the worker pool: %s' % e)
+        finally:
+            sock.close()
+
+        self.handle_response(response)
+
+    async def run_block_async(self,lang,arg_str,context,cwd,content):
+        self._ensure_pool()
+
+        try:
+            reader,writer = await asyncio.open_unix_connection(self.socket_path)
+            try:
+                await send_message_async(writer,self.make_request(lang,arg_str,context,cwd,content))
+                response = await recv_message_async(reader)
+            finally:
+                writer.close()
+        except (ConnectionClosed,OSError) as e:
+            raise ExecutionFailed('lost connection to the worker pool: %s' % e)
+
+        self.handle_response(response)
+
+    def shutdown(self):
+        with self._lock:
+            if self._server is None:
+                return
+
+            logger.info('stopping the worker pool on %s' % self.socket_path)
+            self._server.terminate()
+            self._server.wait()
+            self._server = None
+
+            shutil.rmtree(self._server_dir,ignore_errors=True)
+            self._server_dir = None
+            self.socket_path = ''
+
+def is_listening(socket_path):
+    """
+    Return True if something accepts connections on the Unix socket.
+    """
+    if not os.path.exists(socket_path):
+        return False
+
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+########
+# The server side
+########
+def run_request(request):
+    """
+    Run the block described by the request and return the response.  The
+    output of the block is captured at the file descriptor level so that
+    the output of subprocesses is included.
+    """
+    return run_captured(LocalExecutor().run_block,request['lang'],request['arg_str'],
+                        request['context'],request['cwd'],request['content'])
+
+def worker_loop(listener):
+    """
+    Accept and handle requests forever.  This runs in a forked worker process.
+    """
+    signal.signal(signal.SIGTERM,signal.SIG_DFL)
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+
+    while True:
+        conn,_ = listener.accept()
+        try:
+            fh = conn.makefile('rwb')
+            request = recv_message(fh)
+            send_message(fh,run_request(request))
+            fh.close()
+        except ConnectionClosed:
+            # clients checking if the pool is up connect without sending anything
+            logger.debug('connection closed without a complete request')
+        except OSError as e:
+            logger.warn('dropped a request: %s' % e)
+        finally:
+            conn.close()
+
+def start_worker(listener):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            worker_loop(listener)
+        finally:
+            os._exit(1)
+
+    return pid
+
+def serve(socket_path,num_workers):
+    """
+    Listen on the Unix socket and run blocks using num_workers worker processes
+    until terminated.  Workers that die are replaced.
+    """
+    if os.path.exists(socket_path):
+        if is_listening(socket_path):
+            raise Exception('a worker pool is already listening on %s' % socket_path)
+        os.remove(socket_path)
+
+    listener = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(LISTEN_BACKLOG)
+
+    def stop(signum,frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM,stop)
+    signal.signal(signal.SIGINT,stop)
+
+    workers = set()
+    try:
+        for i in range(num_workers):
+            workers.add(start_worker(listener))
+
+        logger.info('%d workers listening on %s' % (num_workers,socket_path))
+
+        while True:
+            pid,status = os.wait()
+            if pid in workers:
+                logger.warn('worker %d exited, starting a new one' % pid)
+                workers.remove(pid)
+                workers.add(start_worker(listener))
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid,signal.SIGTERM)
+                os.waitpid(pid,0)
+            except OSError:
+                pass
+
+        listener.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def main():
+    parser = argparse.ArgumentParser('xp.executors.workerpool',description='run a pool of xp worker processes')
+    parser.add_argument('-s','--socket',required=True,help='the Unix socket to listen on')
+    parser.add_argument('-n','--num_workers',type=int,default=1,help='the number of worker processes')
+    parser.add_argument('-C','--config_file',default=None,help='the configuration file the workers should use')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARN,format='%(levelname)s: %(message)s')
+    config.initialize_config_info(args.config_file)
+
+    serve(args.socket,args.num_workers)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+This module contains the TaskGraph, which holds the dependency graph of a set
+of tasks (and everything they depend on) and answers questions about it.
+
+Building a TaskGraph takes time linear in the number of tasks and dependencies.
+Everything that can be derived from it cheaply is computed up front; the
+transitive closure of a task is computed on demand and remembered.
+"""
+
+import os.path
+import logging
+from collections import deque
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+class DependencyCycle(Exception):
+    def __init__(self,tasks):
+        Exception.__init__(self,'dependency cycle among tasks: %s' % ', '.join(sorted([t.name for t in tasks])))
+        self.tasks = tasks
+
+class TaskGraph:
+    """
+    The dependency graph of the given tasks and all the tasks they (directly or
+    indirectly) depend on.
+
+    A leaf is a task that no other task in the graph depends on.  The depth of
+    a task is the length of the longest chain of dependents between it and a
+    leaf (leaves have depth 0).
+    """
+
+    def __init__(self,tasks):
+        # collect the tasks and the edges in both directions
+        self._deps = {}
+        self._dependents = {}
+
+        to_visit = list(tasks)
+        while len(to_visit) > 0:
+            task = to_visit.pop()
+            if task in self._deps:
+                continue
+
+            deps = task.get_deps()
+            self._deps[task] = deps
+            self._dependents.setdefault(task,[])
+            for d in deps:
+                self._dependents.setdefault(d,[]).append(task)
+                if d not in self._deps:
+                    to_visit.append(d)
+
+        self._order = self.__topological_sort()
+        self._depths = self.__compute_depths()
+
+        self._upstream = {}
+        self._downstream = {}
+
+    def __topological_sort(self):
+        """
+        Kahn's algorithm: dependencies come before the tasks that depend on them.
+        """
+        num_pending = {t:len(set(deps)) for t,deps in self._deps.items()}
+        to_visit = deque([t for t,n in num_pending.items() if n == 0])
+
+        order = []
+        while len(to_visit) > 0:
+            task = to_visit.popleft()
+            order.append(task)
+
+            for t in set(self._dependents[task]):
+                num_pending[t] -= 1
+                if num_pending[t] == 0:
+                    to_visit.append(t)
+
+        if len(order) < len(self._deps):
+            raise DependencyCycle([t for t,n in num_pending.items() if n > 0])
+
+        return order
+
+    def __compute_depths(self):
+        depths = {}
+        for task in reversed(self._order):
+            dependents = self._dependents[task]
+            if len(dependents) == 0:
+                depths[task] = 0
+            else:
+                depths[task] = 1 + max([depths[t] for t in dependents])
+
+        return depths
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self,task):
+        return task in self._deps
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def tasks(self):
+        return set(self._order)
+
+    def deps(self,task):
+        """
+        Return the tasks that task depends on directly.
+        """
+        return list(self._deps[task])
+
+    def dependents(self,task):
+        """
+        Return the tasks that depend on task directly.
+        """
+        return list(self._dependents[task])
+
+    def leaves(self):
+        return [t for t in self._order if len(self._dependents[t]) == 0]
+
+    def topological_order(self):
+        """
+        Return all tasks such that each task comes after its dependencies.
+        """
+        return list(self._order)
+
+    def depth(self,task):
+        return self._depths[task]
+
+    def visitation_list(self):
+        """
+        Return a list of (task,depth) tuples, with the deepest tasks (the
+        roots) first and the leaves last.
+        """
+        return sorted(self._depths.items(),key=lambda x: -x[1])
+
+    def upstream(self,task):
+        """
+        Return the set of tasks that task depends on, directly or indirectly.
+        """
+        if task not in self._upstream:
+            self._upstream[task] = self.__closure(task,self._deps)
+
+        return set(self._upstream[task])
+
+    def downstream(self,task):
+        """
+        Return the set of tasks that depend on task, directly or indirectly.
+        """
+        if task not in self._downstream:
+            self._downstream[task] = self.__closure(task,self._dependents)
+
+        return set(self._downstream[task])
+
+    def __closure(self,task,edges):
+        reached = set()
+        to_visit = list(edges[task])
+        while len(to_visit) > 0:
+            t = to_visit.pop()
+            if t not in reached:
+                reached.add(t)
+                to_visit.extend(edges[t])
+
+        return reached
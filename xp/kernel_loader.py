@@ -1,6 +1,8 @@
+import atexit
 import os.path
 import logging
 import re
+import threading
 
 from xp import config
 
@@ -18,6 +20,9 @@ class KernelLoader:
         Re-create the singleton and return the new object.  
         This is typically only used for unit testing.
         """
+        if KernelLoader._singleton is not None:
+            KernelLoader._singleton.shutdown_kernel_processes()
+
         KernelLoader._singleton = None
         return KernelLoader.singleton()
 
@@ -35,6 +40,12 @@ class KernelLoader:
         if KernelLoader._singleton is not None:
             raise Exception('A KernelLoader already exists')
 
+        # the processes of persistent kernels, by the command that starts them
+        self._processes = set()
+        self._idle_processes = {}
+        self._process_lock = threading.Lock()
+        atexit.register(self.shutdown_kernel_processes)
+
         self.__initialize()
 
         KernelLoader._singleton = self
@@ -88,3 +99,80 @@ class KernelLoader:
 
     def lang_suffixes(self):
         return [*self._lang_map.keys()]
+
+    def get_kernel_process(self,command,get_environment):
+        """
+        Return a kernel process started with the command (see
+        xp.kernels.persistent), which is the caller's until it's given back
+        with release_kernel_process(...) or discard_kernel_process(...).
+
+        An idle process is reused if it answers a health check.  Otherwise,
+        it's shut down and a new one is started with the environment returned
+        by get_environment().
+        """
+        # imported here since the kernel module uses the loader
+        from xp.kernels.persistent import KernelProcess
+
+        key = tuple(command)
+        while True:
+            with self._process_lock:
+                idle = self._idle_processes.get(key)
+                process = idle.pop() if idle else None
+
+            if process is None:
+                break
+            elif process.is_healthy():
+                return process
+
+            logger.warn('kernel %s (pid %d) stopped responding, starting a new one' % (' '.join(command),process.pid))
+            self.discard_kernel_process(process)
+
+        process = KernelProcess(command,get_environment())
+        with self._process_lock:
+            self._processes.add(process)
+
+        return process
+
+    def release_kernel_process(self,process):
+        """
+        Make the process available to run other blocks.
+        """
+        with self._process_lock:
+            running = process in self._processes
+            if running:
+                self._idle_processes.setdefault(tuple(process.command),[]).append(process)
+
+        # the kernels were shut down while the process was in use
+        if not running:
+            process.stop()
+
+    def discard_kernel_process(self,process):
+        """
+        Shut the process down, e.g., because it crashed.  The next block gets a
+        new process.
+        """
+        with self._process_lock:
+            self._processes.discard(process)
+
+        process.stop()
+
+    def shutdown_kernel_processes(self,command=None):
+        """
+        Shut down the processes of all persistent kernels, or only those started
+        with the command if one is given.  All are shut down at the end of
+        every run.
+        """
+        with self._process_lock:
+            if command is None:
+                processes = list(self._processes)
+                self._processes.clear()
+                self._idle_processes.clear()
+            else:
+                key = tuple(command)
+                processes = [p for p in self._processes if tuple(p.command) == key]
+                self._processes.difference_update(processes)
+                self._idle_processes.pop(key,None)
+
+        for process in processes:
+            logger.debug('stopping kernel %s (pid %d)' % (' '.join(process.command),process.pid))
+            process.stop()
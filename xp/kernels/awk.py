@@ -14,17 +14,15 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import subprocess
-from subprocess import CalledProcessError
 import logging
-import os.path
+import os, os.path
 import tempfile
 
-from xp.kernels.base import Kernel, get_total_context
+from xp.kernels.base import CommandKernel
 
 logger = logging.getLogger(os.path.basename(__file__))
 
-class AwkKernel(Kernel):
+class AwkKernel(CommandKernel):
 
     @staticmethod
     def default_lang_suffix():
@@ -51,10 +49,7 @@ class AwkKernel(Kernel):
         """
         return {}
 
-    def run(self,arg_str,context,cwd,content):
-        """
-        Raises a CalledProcessError if this fails.
-        """
+    def make_command(self,arg_str,context,cwd,content):
         # write awk code to a tmp file
         fh,tmp_filename = tempfile.mkstemp(suffix='awk')
         os.write(fh,'\n'.join(content).encode())
@@ -65,9 +60,6 @@ class AwkKernel(Kernel):
         exec_name = context.get('AWK','awk')
         cmd = '%s -f %s %s' % (exec_name,tmp_filename,arg_str)
         logger.debug('using cmd: %s' % cmd)
-        retcode = subprocess.call(cmd,shell=True,
-                    cwd=cwd,env=get_total_context(context))
-    
-        if retcode != 0:
-            raise CalledProcessError(retcode,cmd,None)
+
+        return cmd
     
@@ -15,6 +15,13 @@ limitations under the License.
 """
 
 import os
+import sys
+import asyncio
+import codecs
+import subprocess
+from subprocess import CalledProcessError
+
+from xp.context import with_environment
 
 ########
 # Helper function
@@ -23,13 +30,10 @@ def get_total_context(context):
 	"""
 	Return the total environmental context, including the
 	local context and all environment variables from the
-	OS-level.
+	OS-level, as an immutable mapping.  It's only built again
+	when the context changes (see xp.context).
 	"""
-	total_context = dict(os.environ)
-	for k,v in context.items():
-		total_context[k] = v
-
-	return total_context
+	return with_environment(context)
 
 #######
 # The Kernel base class
@@ -77,3 +81,90 @@ class Kernel:
 		  - content is the actual raw text content of the block
 		"""
 		raise NotImplemented('run not implemented')
+
+	async def run_async(self,arg_str,context,cwd,content):
+		"""
+		Run the block from within an asyncio event loop.  The parameters are
+		the same as for run(...).
+
+		Kernels that can't run their blocks asynchronously don't need to
+		override this: by default, run(...) is called in a worker thread.
+		"""
+		loop = asyncio.get_running_loop()
+		await loop.run_in_executor(None,self.run,arg_str,context,cwd,content)
+
+#######
+# Base class for kernels that run a block as a single shell command
+#######
+SHELL_EXECUTABLE = '/bin/sh'
+
+# how much output is read from a block's process at a time
+OUTPUT_CHUNK_SIZE = 65536
+
+class CommandKernel(Kernel):
+	"""
+	A kernel that runs a block by executing one shell command.  Subclasses
+	only need to implement make_command(...).
+	"""
+
+	def make_command(self,arg_str,context,cwd,content):
+		"""
+		Return the shell command that will run the block.  The parameters are
+		the same as for run(...).
+		"""
+		raise NotImplementedError('make_command not implemented')
+
+	def run(self,arg_str,context,cwd,content):
+		"""
+		Raises a CalledProcessError if this fails.
+		"""
+		cmd = self.make_command(arg_str,context,cwd,content)
+		retcode = subprocess.call(cmd,shell=True,cwd=cwd,env=get_total_context(context))
+
+		if retcode != 0:
+			raise CalledProcessError(retcode,cmd,None)
+
+	async def run_async(self,arg_str,context,cwd,content):
+		"""
+		Raises a CalledProcessError if this fails.
+
+		The output of the command is streamed to this process's stdout and
+		stderr as it arrives.
+		"""
+		cmd = self.make_command(arg_str,context,cwd,content)
+		proc = await asyncio.create_subprocess_exec(SHELL_EXECUTABLE,'-c',cmd,
+								stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.PIPE,
+								cwd=cwd,env=get_total_context(context))
+
+		try:
+			await asyncio.gather(stream_output(proc.stdout,sys.stdout),
+								 stream_output(proc.stderr,sys.stderr))
+			retcode = await proc.wait()
+		finally:
+			# don't leave the process behind if streaming failed or was cancelled
+			if proc.returncode is None:
+				try:
+					proc.kill()
+				except ProcessLookupError:
+					pass
+				await proc.wait()
+
+		if retcode != 0:
+			raise CalledProcessError(retcode,cmd,None)
+
+async def stream_output(reader,out):
+	"""
+	Copy the output from the asyncio stream reader to the text file out as it
+	arrives.  It's read in chunks rather than lines, so lines of any length
+	are fine.
+	"""
+	decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+	while True:
+		data = await reader.read(OUTPUT_CHUNK_SIZE)
+		text = decoder.decode(data,not data)
+		if text:
+			out.write(text)
+			out.flush()
+
+		if not data:
+			break
@@ -14,17 +14,15 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import subprocess
-from subprocess import CalledProcessError
 import logging
-import os.path
+import os, os.path
 import tempfile
 
-from xp.kernels.base import Kernel, get_total_context
+from xp.kernels.base import CommandKernel
 
 logger = logging.getLogger(os.path.basename(__file__))
 
-class GNUPlotKernel(Kernel):
+class GNUPlotKernel(CommandKernel):
 
 	@staticmethod
 	def default_lang_suffix():
@@ -51,14 +49,11 @@ class GNUPlotKernel(Kernel):
 		"""
 		return {}
 
-	def run(self,arg_str,context,cwd,content):
-		"""
-		Raises a CalledProcessError if this fails.
-		"""
+	def make_command(self,arg_str,context,cwd,content):
 			
 		# write gnuplot code to a tmp file
 		fh,tmp_filename = tempfile.mkstemp(suffix='gp')
-		os.write(fh,'\n'.join(content))
+		os.write(fh,'\n'.join(content).encode())
 		os.close(fh)
 	
 		logger.debug('wrote gnuplot content to %s' % tmp_filename)
@@ -66,9 +61,6 @@ class GNUPlotKernel(Kernel):
 		exec_name = context.get('GNUPLOT','gnuplot')
 		cmd = '%s %s %s' % (exec_name,arg_str,tmp_filename)
 		logger.debug('using cmd: %s' % cmd)
-		retcode = subprocess.call(cmd,shell=True,
-					cwd=cwd,env=get_total_context(context))
-	
-		if retcode != 0:
-			raise CalledProcessError(retcode,cmd,None)
+
+		return cmd
 	
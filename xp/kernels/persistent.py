@@ -0,0 +1,425 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Kernels that run their blocks in a long-lived process.
+
+A persistent kernel is a process that's started the first time one of its
+blocks is run and is then sent every block of that kind until the end of the
+run, so the cost of starting an interpreter is paid once rather than once per
+block.  The kernel process can be written in any language: xp talks to it over
+its stdin and stdout using length-prefixed JSON messages (see xp.messaging),
+one request and one reply at a time.
+
+When the process has started, it sends
+
+    {"type": "ready", "protocol": 1}
+
+Then, for each block, xp sends
+
+    {"type": "run", "arg_str": ..., "context": {...}, "cwd": ..., "content": [...]}
+
+While the block runs, the kernel sends its output as it's written, in any
+number of
+
+    {"type": "output", "stream": "stdout" | "stderr", "data": ...}
+
+messages, and then replies with
+
+    {"type": "result", "status": "ok" | "failed" | "error", "retcode": ...,
+     "message": ...}
+
+where "failed" means the block ran and failed (retcode is its return code) and
+"error" means the block couldn't be run.  A kernel's stdout carries the
+protocol, so the output of blocks must be captured and sent in messages.
+Kernels that can't stream it may instead return all of it in the "stdout" and
+"stderr" fields of the reply.  Anything the kernel itself writes to stderr is
+passed through to the user.
+
+Before an idle kernel is given a block, xp checks that it's healthy by sending
+
+    {"type": "ping"}
+
+to which the kernel replies {"type": "pong"}.  At the end of the run, xp sends
+
+    {"type": "shutdown"}
+
+and the kernel should exit.  It should also exit if its stdin is closed.
+
+The xp side is PersistentKernel: a kernel class that derives from it only
+needs to say how to start its process (see kernel_command()).  The processes
+themselves are managed by the KernelLoader, which starts them, restarts them
+if they die or stop answering and shuts them down at the end of the run.
+Kernels written in python can use serve() to implement their side of the
+protocol.
+"""
+
+import codecs
+import logging
+import os, os.path
+import select
+import subprocess
+from subprocess import CalledProcessError
+import sys
+import threading
+
+import xp
+from xp.kernels.base import Kernel
+from xp.executors.base import ExecutionFailed
+from xp.kernel_loader import KernelLoader
+from xp.messaging import send_message, recv_message, ConnectionClosed
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+PROTOCOL_VERSION = 1
+
+MSG_READY = 'ready'
+MSG_RUN = 'run'
+MSG_OUTPUT = 'output'
+MSG_RESULT = 'result'
+MSG_PING = 'ping'
+MSG_PONG = 'pong'
+MSG_SHUTDOWN = 'shutdown'
+
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+STATUS_ERROR = 'error'
+
+STDOUT = 'stdout'
+STDERR = 'stderr'
+
+# how long a kernel process has to say it's ready
+KERNEL_STARTUP_TIMEOUT = 30
+
+# how long an idle kernel process has to answer a ping
+HEALTH_CHECK_TIMEOUT = 5
+
+# how long a kernel process has to exit once asked to
+SHUTDOWN_TIMEOUT = 5
+
+# once a block is done, how long to wait for output from processes it left
+# running before replying
+OUTPUT_DRAIN_TIMEOUT = 0.1
+
+OUTPUT_CHUNK_SIZE = 65536
+
+class KernelTimeout(Exception):
+    pass
+
+########
+# The xp side
+########
+class KernelProcess:
+    """
+    A running kernel process and the pipes to it.
+    """
+    def __init__(self,command,env=None):
+        self.command = command
+
+        # unbuffered, so that select() sees everything the kernel has sent
+        self._proc = subprocess.Popen(command,stdin=subprocess.PIPE,stdout=subprocess.PIPE,
+                                      bufsize=0,env=env)
+
+        try:
+            msg = self._recv(KERNEL_STARTUP_TIMEOUT)
+        except (ConnectionClosed,KernelTimeout) as e:
+            self.stop()
+            raise ExecutionFailed('kernel %s did not start: %s' % (' '.join(command),e))
+
+        if msg.get('type') != MSG_READY or msg.get('protocol') != PROTOCOL_VERSION:
+            self.stop()
+            raise ExecutionFailed('kernel %s does not speak protocol %d' % (' '.join(command),PROTOCOL_VERSION))
+
+        logger.debug('started kernel %s (pid %d)' % (' '.join(command),self.pid))
+
+    @property
+    def pid(self):
+        return self._proc.pid
+
+    def _recv(self,timeout=None):
+        """
+        Return the next message from the kernel.  KernelTimeout is raised if
+        none starts to arrive within timeout seconds.
+        """
+        if timeout is not None:
+            ready,_,_ = select.select([self._proc.stdout],[],[],timeout)
+            if not ready:
+                raise KernelTimeout('no reply within %d seconds' % timeout)
+
+        return recv_message(self._proc.stdout)
+
+    def _send(self,msg):
+        try:
+            send_message(self._proc.stdin,msg)
+        except OSError as e:
+            raise ConnectionClosed('unable to write to the kernel: %s' % e)
+
+    def is_alive(self):
+        return self._proc.poll() is None
+
+    def is_healthy(self):
+        """
+        Return True if the kernel is running and answers a ping.
+        """
+        if not self.is_alive():
+            return False
+
+        try:
+            self._send({'type':MSG_PING})
+            return self._recv(HEALTH_CHECK_TIMEOUT).get('type') == MSG_PONG
+        except (ConnectionClosed,KernelTimeout,ValueError):
+            return False
+
+    def run_block(self,arg_str,context,cwd,content):
+        """
+        Send the block to the kernel, write out its output as it arrives and
+        return the kernel's reply.  ConnectionClosed is raised if the kernel
+        goes away before replying.
+        """
+        self._send({'type':MSG_RUN, 'arg_str':arg_str, 'context':dict(context),
+                    'cwd':cwd, 'content':list(content)})
+
+        while True:
+            msg = self._recv()
+            if msg.get('type') != MSG_OUTPUT:
+                return msg
+
+            write_output(msg.get('stream'),msg.get('data',''))
+
+    def stop(self):
+        """
+        Ask the kernel to exit, killing it if it doesn't.
+        """
+        if self.is_alive():
+            try:
+                self._send({'type':MSG_SHUTDOWN})
+            except ConnectionClosed:
+                pass
+
+        for fh in (self._proc.stdin,self._proc.stdout):
+            try:
+                fh.close()
+            except OSError:
+                pass
+
+        try:
+            self._proc.wait(SHUTDOWN_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            logger.warn('kernel %s (pid %d) did not exit, killing it' % (' '.join(self.command),self.pid))
+            self._proc.kill()
+            self._proc.wait()
+
+class PersistentKernel(Kernel):
+    """
+    A kernel that sends its blocks to a long-lived kernel process.  Subclasses
+    only need to implement kernel_command().
+    """
+
+    def kernel_command(self,context):
+        """
+        Return the command (a list of arguments) that starts the kernel process
+        for a block run with the variables in context.  Blocks whose kernels
+        have the same command share their processes.
+        """
+        raise NotImplementedError('kernel_command not implemented')
+
+    def kernel_environment(self):
+        """
+        Return the environment the kernel process is started with.  Blocks get
+        their variables with each request, so this is the environment of xp
+        with xp importable, for kernels written in python.
+        """
+        env = dict(os.environ)
+        xp_path = os.path.dirname(os.path.dirname(os.path.abspath(xp.__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([xp_path] + [x for x in [env.get('PYTHONPATH')] if x])
+
+        return env
+
+    def shutdown(self,context):
+        """
+        Shut down the kernel processes that run blocks with the variables in
+        context (see kernel_command()).
+        """
+        KernelLoader.singleton().shutdown_kernel_processes(self.kernel_command(context))
+
+    def run(self,arg_str,context,cwd,content):
+        """
+        Raises a CalledProcessError if the block fails and ExecutionFailed if
+        it can't be run.
+        """
+        kloader = KernelLoader.singleton()
+        command = self.kernel_command(context)
+        process = kloader.get_kernel_process(command,self.kernel_environment)
+
+        try:
+            response = process.run_block(arg_str,context,cwd,content)
+        except (ConnectionClosed,ValueError) as e:
+            # the next block gets a new process
+            kloader.discard_kernel_process(process)
+            raise ExecutionFailed('kernel %s exited while running the block: %s' % (' '.join(command),e))
+
+        kloader.release_kernel_process(process)
+
+        handle_response(response,' '.join(command))
+
+def write_output(stream,data):
+    fh = sys.stderr if stream == STDERR else sys.stdout
+    fh.write(data)
+    fh.flush()
+
+def handle_response(response,cmd):
+    """
+    Write out the output returned in a block's reply, if any, and raise the
+    error, if any, it reports.
+    """
+    write_output(STDOUT,response.get(STDOUT,''))
+    write_output(STDERR,response.get(STDERR,''))
+
+    status = response.get('status')
+    if status == STATUS_FAILED:
+        raise CalledProcessError(response.get('retcode',1),cmd,None)
+    elif status != STATUS_OK:
+        raise ExecutionFailed(response.get('message','the kernel failed to run the block'))
+
+########
+# The kernel side
+########
+def forward_output(streams,on_output,done):
+    """
+    Pass what's written to the pipes in streams (a dictionary from the file
+    descriptors of their read ends to stream names) to on_output(stream,data)
+    until they're closed or, once done is set, they've been quiet for
+    OUTPUT_DRAIN_TIMEOUT seconds.
+    """
+    decoders = {fd:codecs.getincrementaldecoder('utf-8')(errors='replace') for fd in streams}
+    open_fds = list(streams)
+
+    while open_fds:
+        ready,_,_ = select.select(open_fds,[],[],OUTPUT_DRAIN_TIMEOUT)
+        if not ready and done.is_set():
+            break
+
+        for fd in ready:
+            data = os.read(fd,OUTPUT_CHUNK_SIZE)
+            if not data:
+                open_fds.remove(fd)
+                continue
+
+            text = decoders[fd].decode(data)
+            if text:
+                on_output(streams[fd],text)
+
+    for fd,decoder in decoders.items():
+        text = decoder.decode(b'',True)
+        if text:
+            on_output(streams[fd],text)
+
+def run_captured(run,*args,on_output=None):
+    """
+    Call run(*args) and return the reply describing how it went.  The output
+    is captured at the file descriptor level so that the output of
+    subprocesses is included.  If on_output is given, on_output(stream,data)
+    is called with each chunk of output as it's written (stream is "stdout"
+    or "stderr"); otherwise the output is returned in the reply.
+    """
+    output = {STDOUT:[], STDERR:[]}
+    collect = on_output is None
+    if collect:
+        on_output = lambda stream,data: output[stream].append(data)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_stdout = os.dup(1)
+    saved_stderr = os.dup(2)
+
+    out_r,out_w = os.pipe()
+    err_r,err_w = os.pipe()
+    os.dup2(out_w,1)
+    os.dup2(err_w,2)
+    os.close(out_w)
+    os.close(err_w)
+
+    done = threading.Event()
+    forwarder = threading.Thread(target=forward_output,args=({out_r:STDOUT, err_r:STDERR},on_output,done))
+    forwarder.start()
+
+    try:
+        run(*args)
+        response = {'status':STATUS_OK}
+    except CalledProcessError as e:
+        response = {'status':STATUS_FAILED, 'retcode':e.returncode, 'message':str(e)}
+    except Exception as e:
+        response = {'status':STATUS_ERROR, 'message':'%s: %s' % (e.__class__.__name__,e)}
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_stdout,1)
+        os.dup2(saved_stderr,2)
+        os.close(saved_stdout)
+        os.close(saved_stderr)
+
+        done.set()
+        forwarder.join()
+        os.close(out_r)
+        os.close(err_r)
+
+    if collect:
+        response[STDOUT] = ''.join(output[STDOUT])
+        response[STDERR] = ''.join(output[STDERR])
+
+    return response
+
+def serve(run_block):
+    """
+    Run the kernel side of the protocol on stdin and stdout until xp asks the
+    kernel to exit.  run_block(arg_str,context,cwd,content) is called for each
+    block and should raise a CalledProcessError if the block fails.
+    """
+    # the protocol gets stdin and stdout to itself: blocks read from /dev/null
+    # and, outside of a block, anything printed goes to stderr
+    sys.stdout.flush()
+    protocol_in = os.fdopen(os.dup(0),'rb',buffering=0)
+    protocol_out = os.fdopen(os.dup(1),'wb')
+
+    devnull = os.open(os.devnull,os.O_RDONLY)
+    os.dup2(devnull,0)
+    os.close(devnull)
+    os.dup2(2,1)
+
+    send_message(protocol_out,{'type':MSG_READY, 'protocol':PROTOCOL_VERSION})
+
+    while True:
+        try:
+            msg = recv_message(protocol_in)
+        except ConnectionClosed:
+            break
+
+        msg_type = msg.get('type')
+        if msg_type == MSG_RUN:
+            def send_output(stream,data):
+                send_message(protocol_out,{'type':MSG_OUTPUT, 'stream':stream, 'data':data})
+
+            response = run_captured(run_block,msg['arg_str'],msg['context'],msg['cwd'],msg['content'],
+                                    on_output=send_output)
+            response['type'] = MSG_RESULT
+            send_message(protocol_out,response)
+        elif msg_type == MSG_PING:
+            send_message(protocol_out,{'type':MSG_PONG})
+        elif msg_type == MSG_SHUTDOWN:
+            break
+        else:
+            send_message(protocol_out,{'type':MSG_RESULT, 'status':STATUS_ERROR,
+                                       'message':'unknown message type: %s' % msg_type})
@@ -0,0 +1,151 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+A python kernel that forks each block from a server with modules preloaded.
+
+The server is a persistent kernel (see xp.kernels.persistent) that imports the
+preloaded modules once and then, for each block, forks a child that runs the
+block and exits.  Blocks get a copy of the server, with the modules already
+imported, so they don't pay for starting python or importing the modules, but
+nothing a block does is seen by the next one.  As with the pyinline kernel, a
+block's variables are in os.environ and in a dictionary named context.
+
+This module is also the server: python -m xp.kernels.pyfork [MODULE ...]
+"""
+
+import builtins
+import linecache
+import logging
+import os, os.path
+import shlex
+from subprocess import CalledProcessError
+import sys
+import traceback
+
+from xp import config
+from xp.kernels.persistent import PersistentKernel, serve
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+BLOCK_FILENAME = '<xp block>'
+
+class PythonForkKernel(PersistentKernel):
+
+    @staticmethod
+    def default_lang_suffix():
+        return 'pyfork'
+
+    @staticmethod
+    def short_help():
+        """
+        Return a short description of the kernel.
+        """
+        return 'run python code forked from a server with modules preloaded'
+
+    @staticmethod
+    def long_help():
+        """
+        Return a detailed description of the kernel, how it works, how it is configured, and used.
+        """
+        return ('Run the commands in a child forked from a python server that is started once per run. '
+                'The modules listed in the @preload task property (or the python_preload option of the '
+                'Kernels section) are imported by the server, so blocks don\'t pay for importing them. '
+                'The argument string is ignored. To run all py blocks this way, activate the kernel as '
+                'xp.kernels.pyfork.PythonForkKernel(py) in place of the python kernel.')
+
+    @staticmethod
+    def env_vars_help():
+        """
+        Return a dictionary of environment variables (keys) and their meaning (values).
+        """
+        return {
+            'PYTHON_CMD': 'the python executable that will be run as the server',
+            'PYTHON_PRELOAD': 'the modules the server imports (set by the @preload task property)'
+        }
+
+    def kernel_command(self,context):
+        exec_name = context.get('PYTHON_CMD','python')
+
+        preload = context.get('PYTHON_PRELOAD',None)
+        if preload is None:
+            preload = config.config_info().get(config.KERNELS_SECTION,config.PYTHON_PRELOAD_OPT)
+
+        # the modules are sorted so that blocks that preload the same modules share a server
+        modules = sorted(set(preload.replace(',',' ').split()))
+
+        return shlex.split(exec_name) + ['-m','xp.kernels.pyfork'] + modules
+
+def run_block(source,context,cwd):
+    """
+    Run the source as the __main__ module.  This is done in the forked child
+    and never returns.
+    """
+    retcode = 0
+    try:
+        os.chdir(cwd)
+        os.environ.update(context)
+        sys.argv = ['']
+
+        # so that tracebacks show the lines of the block
+        linecache.cache[BLOCK_FILENAME] = (len(source),None,source.splitlines(True),BLOCK_FILENAME)
+
+        code = compile(source,BLOCK_FILENAME,'exec')
+        exec(code,{'__name__':'__main__', '__builtins__':builtins, 'context':dict(context)})
+    except SystemExit as e:
+        if e.code is None:
+            retcode = 0
+        elif isinstance(e.code,int):
+            retcode = e.code
+        else:
+            print(e.code,file=sys.stderr)
+            retcode = 1
+    except BaseException:
+        traceback.print_exc()
+        retcode = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(retcode)
+
+def fork_block(arg_str,context,cwd,content):
+    """
+    Run the block in a forked child.  Raises a CalledProcessError if it fails.
+    """
+    # the child inherits the (captured) stdout and stderr
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    pid = os.fork()
+    if pid == 0:
+        run_block('\n'.join(content),context,cwd)
+
+    _,status = os.waitpid(pid,0)
+    retcode = os.waitstatus_to_exitcode(status)
+    if retcode != 0:
+        raise CalledProcessError(retcode,'python block',None)
+
+def preload_modules(modules):
+    for module in modules:
+        try:
+            __import__(module)
+        except Exception as e:
+            # the blocks that need the module will fail and say why
+            print('xp.kernels.pyfork: unable to preload %s: %s' % (module,e),file=sys.stderr)
+
+if __name__ == '__main__':
+    preload_modules(sys.argv[1:])
+    serve(fork_block)
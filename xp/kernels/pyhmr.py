@@ -14,17 +14,15 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import subprocess
-from subprocess import CalledProcessError
 import logging
-import os.path
+import os, os.path
 import tempfile
 
-from xp.kernels.base import Kernel, get_total_context
+from xp.kernels.base import CommandKernel
 
 logger = logging.getLogger(os.path.basename(__file__))
 
-class PythonHadoopMapReduceKernel(Kernel):
+class PythonHadoopMapReduceKernel(CommandKernel):
 
     @staticmethod
     def default_lang_suffix():
@@ -72,10 +70,7 @@ set: PYHMR_INPUT, PYHMR_OUTPUT, and PYHMR_STREAMING_API_JAR.""",
                     'PYHMR_TEST_CMD':'a command that can be used to test this map-reduce task. If this is set, then the task will be run in test mode (Hadoop will not be run, the HDFS will not be accessed).  The output of this command will be used as input to the mapper (which will then be used as input to the reducer).  The output will be printed to STDOUT.',
                     'PYHMR_TEST_OUTPUT':'the file that the result of the test will be written to.  If not specified, STDOUT will be used.'}
 
-    def run(self,arg_str,context,cwd,content):
-        """
-        Raises a CalledProcessError if this fails.
-        """
+    def make_command(self,arg_str,context,cwd,content):
         # get configuration
         HADOOP_CMD_EV = 'PYHMR_HADOOP_CMD'
         PYTHON_CMD_EV = 'PYHMR_PYTHON_CMD'
@@ -135,12 +130,6 @@ if __name__ == '__main__':
     
             if test_output is not None:
                 cmd += ' > %s' % test_output
-    
-            logger.debug('using cmd: %s' % cmd)
-            retcode = subprocess.call(cmd,shell=True,cwd=cwd,env=get_total_context(context))
-        
-            if retcode != 0:
-                raise CalledProcessError(retcode,cmd,None)
         else:
             logger.info('running map-reduce task in normal mode')
     
@@ -151,9 +140,7 @@ if __name__ == '__main__':
             if num_reducers is not None:
                 cmd += ' -D mapred.reduce.tasks=%s' % num_reducers
     
-            logger.debug('using cmd: %s' % cmd)
-            retcode = subprocess.call(cmd,shell=True,cwd=cwd,env=get_total_context(context))
-        
-            if retcode != 0:
-                raise CalledProcessError(retcode,cmd,None)
+        logger.debug('using cmd: %s' % cmd)
+
+        return cmd
         
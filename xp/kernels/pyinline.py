@@ -0,0 +1,192 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+A python kernel that runs blocks inside the xp process.
+
+Starting python takes far longer than running a few lines of glue code, so
+this kernel runs each block with exec() instead.  Every block gets a fresh
+namespace with its variables in a dictionary named context and, while it runs,
+in os.environ, and it runs in the pipeline's directory.  Since the
+environment, the working directory and the output streams (which are captured
+at the file descriptor level, so that the output of the processes a block
+starts is passed on in order) belong to the whole process, inline blocks are
+run one at a time and, while several tasks are being run at
+once (e.g., xp run -j 4), they're handed to the pyfork kernel instead so that
+the other tasks aren't affected.
+"""
+
+import builtins
+import contextlib
+import io
+import linecache
+import logging
+import os, os.path
+from subprocess import CalledProcessError
+import sys
+import threading
+import traceback
+
+from xp.context import get_environment
+from xp.executors.base import ExecutionFailed
+from xp.kernels.base import Kernel
+from xp.kernels.persistent import run_captured, STDOUT, STDERR, STATUS_ERROR
+from xp.kernels.pyfork import PythonForkKernel
+from xp.scheduler import is_running_in_parallel
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+BLOCK_FILENAME = '<xp inline block>'
+
+_run_lock = threading.Lock()
+
+def output_writer(fh,fd):
+    """
+    Return a function that writes text to the file fh and flushes it.  If fh
+    writes to the file descriptor fd, which is redirected while a block runs,
+    a duplicate of fd taken now is written to instead.  The function's close
+    attribute closes the duplicate, if any.
+    """
+    fh.flush()
+    try:
+        is_fd = fh.fileno() == fd
+    except (AttributeError,OSError,ValueError):
+        is_fd = False
+
+    if not is_fd:
+        def write(data):
+            fh.write(data)
+            fh.flush()
+        write.close = lambda: None
+        return write
+
+    saved_fd = os.dup(fd)
+    encoding = getattr(fh,'encoding',None) or 'utf-8'
+
+    def write(data):
+        os.write(saved_fd,data.encode(encoding,errors='replace'))
+    write.close = lambda: os.close(saved_fd)
+    return write
+
+@contextlib.contextmanager
+def environment_overlay(context,cwd):
+    """
+    Put the variables in context on top of os.environ and change to cwd for
+    the duration of the with block.  Everything is put back afterwards,
+    including changes made in the with block.
+    """
+    # make sure the snapshot blocks are run with doesn't include the overlay
+    get_environment()
+
+    saved_environ = dict(os.environ)
+    saved_cwd = os.getcwd()
+
+    os.environ.update(context)
+    os.chdir(cwd)
+    try:
+        yield
+    finally:
+        os.chdir(saved_cwd)
+        for key in set(os.environ) | set(saved_environ):
+            if key not in saved_environ:
+                del os.environ[key]
+            elif os.environ.get(key) != saved_environ[key]:
+                os.environ[key] = saved_environ[key]
+
+class PythonInlineKernel(Kernel):
+
+    @staticmethod
+    def default_lang_suffix():
+        return 'pyinline'
+
+    @staticmethod
+    def short_help():
+        """
+        Return a short description of the kernel.
+        """
+        return 'run python code inside the xp process'
+
+    @staticmethod
+    def long_help():
+        """
+        Return a detailed description of the kernel, how it works, how it is configured, and used.
+        """
+        return ('Run the commands inside the xp process, in a fresh namespace with the block\'s '
+                'variables in a dictionary named context and in os.environ. This avoids starting python '
+                'for small blocks, but inline blocks are run one at a time and can affect the xp process '
+                '(e.g., by changing the modules it has imported). When tasks are run in parallel, the '
+                'blocks are run by the pyfork kernel instead. The argument string is ignored.')
+
+    @staticmethod
+    def env_vars_help():
+        """
+        Return a dictionary of environment variables (keys) and their meaning (values).
+        """
+        return {}
+
+    def run(self,arg_str,context,cwd,content):
+        """
+        Raises a CalledProcessError if the block exits with a non-zero code and
+        ExecutionFailed if it raises an exception.
+        """
+        if is_running_in_parallel():
+            # other threads are running blocks, so the process can't be changed
+            logger.debug('running an inline block in the pyfork kernel')
+            context = dict(context)
+            context.setdefault('PYTHON_CMD',sys.executable)
+            context.setdefault('PYTHON_PRELOAD','')
+            return PythonForkKernel().run(arg_str,context,cwd,content)
+
+        source = '\n'.join(content)
+        namespace = {'__name__':'__main__', '__builtins__':builtins, 'context':dict(context)}
+
+        errors = []
+
+        def run_block():
+            # the block writes straight to the (captured) file descriptors, so
+            # its output and that of the processes it starts stay in order
+            out = io.TextIOWrapper(io.FileIO(1,'w',closefd=False),write_through=True)
+            err = io.TextIOWrapper(io.FileIO(2,'w',closefd=False),write_through=True)
+
+            with environment_overlay(context,cwd), contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                try:
+                    exec(compile(source,BLOCK_FILENAME,'exec'),namespace)
+                except SystemExit as e:
+                    if e.code is not None and e.code != 0:
+                        if not isinstance(e.code,int):
+                            print(e.code,file=sys.stderr)
+                        errors.append(CalledProcessError(e.code if isinstance(e.code,int) else 1,BLOCK_FILENAME,None))
+                except Exception as e:
+                    traceback.print_exc()
+                    errors.append(ExecutionFailed('%s: %s' % (e.__class__.__name__,e)))
+
+        with _run_lock:
+            # so that tracebacks show the lines of the block
+            linecache.cache[BLOCK_FILENAME] = (len(source),None,source.splitlines(True),BLOCK_FILENAME)
+
+            # the output is passed on as it's written
+            writers = {STDOUT:output_writer(sys.stdout,1), STDERR:output_writer(sys.stderr,2)}
+            try:
+                response = run_captured(run_block,on_output=lambda stream,data: writers[stream](data))
+            finally:
+                for write in writers.values():
+                    write.close()
+
+        if len(errors) > 0:
+            raise errors[0]
+        elif response['status'] == STATUS_ERROR:
+            # e.g., the pipeline's directory is gone
+            raise ExecutionFailed(response['message'])
@@ -0,0 +1,133 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+A python kernel that runs the blocks of a session in one interpreter.
+
+A task with the @session python property has its python and ipython blocks
+run by this kernel (see xp.pipeline.Task.get_blocks()).  The interpreter is a
+persistent kernel (see xp.kernels.persistent) that's started for the session,
+identified by the XP_SESSION variable, and shut down when the task is done.
+All the blocks share one set of globals, so data loaded by one block can be
+used by the next without going through a file.
+
+This module is also the interpreter: python -m xp.kernels.pysession SESSION
+"""
+
+import builtins
+import linecache
+import logging
+import os, os.path
+import shlex
+from subprocess import CalledProcessError
+import sys
+import traceback
+
+from xp.kernels.persistent import PersistentKernel, serve
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+SESSION_VAR = 'XP_SESSION'
+
+# the session of blocks run outside of a @session task
+DEFAULT_SESSION = 'default'
+
+class PythonSessionKernel(PersistentKernel):
+
+    @staticmethod
+    def default_lang_suffix():
+        return 'pysession'
+
+    @staticmethod
+    def short_help():
+        """
+        Return a short description of the kernel.
+        """
+        return 'run python code in an interpreter shared by the blocks of a session'
+
+    @staticmethod
+    def long_help():
+        """
+        Return a detailed description of the kernel, how it works, how it is configured, and used.
+        """
+        return ('Run the commands in a python interpreter that is shared by all the blocks of a session, '
+                'so that they share their globals. Tasks with the @session python property run their py '
+                'and ipy blocks this way, in an interpreter that lasts until the task is done. The '
+                'argument string is ignored and IPython-specific syntax is not supported.')
+
+    @staticmethod
+    def env_vars_help():
+        """
+        Return a dictionary of environment variables (keys) and their meaning (values).
+        """
+        return {
+            'PYTHON_CMD': 'the python executable that will be run as the interpreter',
+            SESSION_VAR: 'the session the block belongs to (set for @session tasks)'
+        }
+
+    def kernel_command(self,context):
+        exec_name = context.get('PYTHON_CMD','python')
+        session = context.get(SESSION_VAR,DEFAULT_SESSION)
+
+        # the session is part of the command so that each session gets its own interpreter
+        return shlex.split(exec_name) + ['-m','xp.kernels.pysession',session]
+
+class Session:
+    """
+    The globals and base environment that the blocks of a session share.
+    """
+    def __init__(self,name):
+        self.name = name
+        self.namespace = {'__name__':'__main__', '__builtins__':builtins}
+        self.environ = dict(os.environ)
+        self.num_blocks = 0
+
+    def run_block(self,arg_str,context,cwd,content):
+        """
+        Run the block in the session's globals.  Raises a CalledProcessError
+        if it fails.
+        """
+        self.num_blocks += 1
+        filename = '<xp block %d>' % self.num_blocks
+        source = '\n'.join(content)
+
+        # variables unset since the last block are removed from the environment
+        os.environ.clear()
+        os.environ.update(self.environ)
+        os.environ.update(context)
+        os.chdir(cwd)
+
+        # so that tracebacks show the lines of the block
+        linecache.cache[filename] = (len(source),None,source.splitlines(True),filename)
+
+        try:
+            exec(compile(source,filename,'exec'),self.namespace)
+        except SystemExit as e:
+            if e.code is None or e.code == 0:
+                return
+            elif not isinstance(e.code,int):
+                print(e.code,file=sys.stderr)
+                raise CalledProcessError(1,filename,None)
+            raise CalledProcessError(e.code,filename,None)
+        except Exception:
+            traceback.print_exc()
+            raise CalledProcessError(1,filename,None)
+
+if __name__ == '__main__':
+    session = Session(sys.argv[1])
+    sys.argv = ['']
+
+    serve(session.run_block)
@@ -14,17 +14,15 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import subprocess
-from subprocess import CalledProcessError
 import logging
-import os.path
+import os, os.path
 import tempfile
 
-from xp.kernels.base import Kernel, get_total_context
+from xp.kernels.base import CommandKernel
 
 logger = logging.getLogger(os.path.basename(__file__))
 
-class PythonKernel(Kernel):
+class PythonKernel(CommandKernel):
 
     @staticmethod
     def default_lang_suffix():
@@ -53,10 +51,7 @@ class PythonKernel(Kernel):
             'PYTHON_CMD': 'the python executable that will be run to execute the block code'
         }
 
-    def run(self,arg_str,context,cwd,content):
-        """
-        Raises a CalledProcessError if this fails.
-        """
+    def make_command(self,arg_str,context,cwd,content):
     
         # write python code to a tmp file
         fh,tmp_filename = tempfile.mkstemp(suffix='py')
@@ -68,8 +63,6 @@ class PythonKernel(Kernel):
         exec_name = context.get('PYTHON_CMD','python')
         cmd = '%s %s %s' % (exec_name,arg_str,tmp_filename)
         logger.debug('using cmd: %s',cmd)
-        retcode = subprocess.call(cmd,shell=True,cwd=cwd,env=get_total_context(context))
-    
-        if retcode != 0:
-            raise CalledProcessError(retcode,cmd,None)
+
+        return cmd
 
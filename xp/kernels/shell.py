@@ -14,16 +14,14 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import subprocess
-from subprocess import CalledProcessError
 import logging
 import os.path
 
-from xp.kernels.base import Kernel, get_total_context
+from xp.kernels.base import CommandKernel
 
 logger = logging.getLogger(os.path.basename(__file__))
 
-class ShellKernel(Kernel):
+class ShellKernel(CommandKernel):
 
 	@staticmethod
 	def default_lang_suffix():
@@ -50,17 +48,9 @@ class ShellKernel(Kernel):
 		"""
 		return {}
 
-	def run(self,arg_str,context,cwd,content):
-		"""
-		Raises a CalledProcessError if this fails.
-		"""
+	def make_command(self,arg_str,context,cwd,content):
 	
 		if len(arg_str.strip()) > 0:
 			logger.warn('shell block ignoring argument string: %s' % arg_str)
 	
-		cmd = '\n'.join(content)
-		retcode = subprocess.call(cmd,shell=True,
-								  cwd=cwd,env=get_total_context(context))
-	
-		if retcode != 0:
-			raise CalledProcessError(retcode,cmd,None)
+		return '\n'.join(content)
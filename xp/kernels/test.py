@@ -14,14 +14,16 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import os.path
+import os, os.path
 import logging
+import sys
 
 from xp.kernels.base import Kernel, get_total_context
+from xp.kernels.persistent import PersistentKernel, serve
 
 logger = logging.getLogger(os.path.basename(__file__))
 
-class TestKernel:
+class TestKernel(Kernel):
 
     @staticmethod
     def default_lang_suffix():
@@ -62,5 +64,45 @@ class TestKernel:
     
         # done
         return
-    
+
+class PersistentTestKernel(PersistentKernel):
+
+    @staticmethod
+    def default_lang_suffix():
+        return 'ptest'
+
+    @staticmethod
+    def short_help():
+        """
+        Return a short description of the kernel.
+        """
+        return 'a persistent kernel for internal testing'
+
+    @staticmethod
+    def long_help():
+        """
+        Return a detailed description of the kernel, how it works, how it is configured, and used.
+        """
+        return 'This code block is run as python code by a kernel process that lasts for the whole run.'
+
+    @staticmethod
+    def env_vars_help():
+        """
+        Return a dictionary of environment variables (keys) and their meaning (values).
+        """
+        return {}
+
+    def kernel_command(self,context):
+        return [sys.executable,'-m','xp.kernels.test']
+
+def run_test_block(arg_str,context,cwd,content):
+    """
+    Run the block as python code in cwd, with its variables in a dictionary
+    named context.
+    """
+    os.chdir(cwd)
+    exec('\n'.join(content),{'context':context})
+
+if __name__ == '__main__':
+    serve(run_test_block)
 
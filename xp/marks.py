@@ -0,0 +1,319 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+This module contains the stores that keep track of which tasks are marked.
+
+A mark is recorded as a *stamp*: an integer that is larger for tasks that were
+marked more recently.  Stamps are nanoseconds since the epoch, so stamps from
+different stores can be compared with one another.
+
+Two backends are available, selected by the backend option in the Marks
+section of the configuration:
+
+  - file (the default) keeps a .<pipeline>-<task>.mark file next to the
+    pipeline and uses its modification time as the stamp.
+
+  - sqlite keeps the marks of all the pipelines in a directory in a single
+    SQLite database (the db_file option, relative to the pipeline's
+    directory).  Marking is atomic and every new stamp is strictly larger
+    than all the stamps before it, regardless of the clock's resolution.
+
+A mark can also record the fingerprint of the task's inputs at the time it was
+run (see Task.fingerprint()).  If the fingerprints option is on, a marked task
+is re-run when its fingerprint changes instead of when one of its
+dependencies has a newer mark.
+"""
+
+import os, os.path
+import logging
+import sqlite3
+import threading
+import time
+
+from xp import config
+from xp.cache import is_cache_enabled
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+BACKEND_FILE = 'file'
+BACKEND_SQLITE = 'sqlite'
+BACKEND_CHOICES = [BACKEND_FILE,BACKEND_SQLITE]
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_mark_store(pipeline,backend=None):
+    """
+    Return the store that holds the marks of the pipeline's tasks.  If backend
+    is None, the configured backend is used.
+    """
+    config_info = config.config_info()
+    if backend is None:
+        backend = config_info.get(config.MARKS_SECTION,config.MARK_BACKEND_OPT).strip()
+
+    if backend == BACKEND_FILE:
+        key = (backend,)
+    elif backend == BACKEND_SQLITE:
+        db_file = config_info.get(config.MARKS_SECTION,config.MARK_DB_FILE_OPT).strip()
+        key = (backend,os.path.join(pipeline.abs_path(),db_file))
+    else:
+        raise Exception('unknown mark backend: %s' % backend)
+
+    with _stores_lock:
+        if key not in _stores:
+            if backend == BACKEND_FILE:
+                _stores[key] = FileMarkStore()
+            else:
+                _stores[key] = SqliteMarkStore(key[1])
+
+        return _stores[key]
+
+def use_fingerprints():
+    """
+    Return True if staleness is decided by comparing fingerprints.  The
+    artifact caches (see xp.cache) are keyed by fingerprints, so enabling
+    one turns them on as well.
+    """
+    return (config.config_info().getboolean(config.MARKS_SECTION,config.MARK_FINGERPRINTS_OPT) or
+            is_cache_enabled())
+
+def get_mark_stamps(tasks):
+    """
+    Return a dictionary mapping each task to its mark stamp (see
+    Task.mark_stamp()).  The marks held by each store are read in one batch.
+    """
+    stamps = {}
+    tasks_by_store = {}
+    for task in tasks:
+        if not task.is_markable():
+            stamps[task] = None
+        else:
+            tasks_by_store.setdefault(task.mark_store(),[]).append(task)
+
+    for store,store_tasks in tasks_by_store.items():
+        stamps.update(store.get_stamps(store_tasks))
+
+    return stamps
+
+def migrate_marks(tasks,src_backend,dest_backend):
+    """
+    Move the marks of the tasks from one backend to another, keeping their
+    stamps (and so their order).  Return the number of marks moved.
+    """
+    num_moved = 0
+
+    tasks_by_pipeline = {}
+    for task in tasks:
+        tasks_by_pipeline.setdefault(task.pipeline,[]).append(task)
+
+    for pipeline,pipeline_tasks in tasks_by_pipeline.items():
+        src_store = get_mark_store(pipeline,src_backend)
+        dest_store = get_mark_store(pipeline,dest_backend)
+        if src_store is dest_store:
+            continue
+
+        stamps = src_store.get_stamps(pipeline_tasks)
+        marked = sorted([t for t in pipeline_tasks if stamps[t] is not None],key=lambda t: stamps[t])
+
+        for task in marked:
+            logger.debug('moving the mark of %s/%s' % (pipeline.name,task.name))
+            dest_store.set_stamp(task,stamps[task],src_store.get_fingerprint(task))
+            src_store.unmark(task)
+
+        num_moved += len(marked)
+
+    return num_moved
+
+class MarkStore:
+
+    def get_stamp(self,task):
+        """
+        Return the stamp of the task's mark or None if it isn't marked.
+        """
+        raise NotImplementedError('get_stamp not implemented')
+
+    def get_stamps(self,tasks):
+        """
+        Return a dictionary mapping each task to its stamp (or None).
+        """
+        return {t:self.get_stamp(t) for t in tasks}
+
+    def get_fingerprint(self,task):
+        """
+        Return the fingerprint recorded with the task's mark or None.
+        """
+        raise NotImplementedError('get_fingerprint not implemented')
+
+    def mark(self,task,fingerprint=None):
+        """
+        Mark the task with a stamp newer than that of any existing mark.
+        """
+        raise NotImplementedError('mark not implemented')
+
+    def set_stamp(self,task,stamp,fingerprint=None):
+        """
+        Mark the task with the stamp given.
+        """
+        raise NotImplementedError('set_stamp not implemented')
+
+    def set_fingerprint(self,task,fingerprint):
+        """
+        Record a fingerprint with the task's existing mark, keeping its stamp.
+        """
+        stamp = self.get_stamp(task)
+        if stamp is not None:
+            self.set_stamp(task,stamp,fingerprint)
+
+    def unmark(self,task):
+        raise NotImplementedError('unmark not implemented')
+
+class FileMarkStore(MarkStore):
+
+    def get_stamp(self,task):
+        try:
+            return os.stat(task.mark_file()).st_mtime_ns
+        except OSError:
+            return None
+
+    def get_stamps(self,tasks):
+        # list each directory that holds marks only once
+        dir_stamps = {}
+        stamps = {}
+        for task in tasks:
+            mark_dir,mark_fname = os.path.split(task.mark_file())
+            if mark_dir not in dir_stamps:
+                dir_stamps[mark_dir] = {}
+                try:
+                    for entry in os.scandir(mark_dir):
+                        if entry.name.startswith('.') and entry.name.endswith('.mark'):
+                            dir_stamps[mark_dir][entry.name] = entry.stat().st_mtime_ns
+                except OSError:
+                    pass
+
+            stamps[task] = dir_stamps[mark_dir].get(mark_fname,None)
+
+        return stamps
+
+    def get_fingerprint(self,task):
+        try:
+            fh = open(task.mark_file(),'r')
+            fingerprint = fh.read().strip()
+            fh.close()
+        except OSError:
+            return None
+
+        return fingerprint if len(fingerprint) > 0 else None
+
+    def mark(self,task,fingerprint=None):
+        mark_file = task.mark_file()
+
+        logger.debug('writing mark file: %s' % mark_file)
+        fh = open(mark_file,'w')
+        if fingerprint is not None:
+            fh.write(fingerprint)
+        fh.close()
+
+    def set_stamp(self,task,stamp,fingerprint=None):
+        self.mark(task,fingerprint)
+        os.utime(task.mark_file(),ns=(stamp,stamp))
+
+    def unmark(self,task):
+        mark_file = task.mark_file()
+        if os.path.exists(mark_file):
+            logger.debug('removing mark file %s' % mark_file)
+            os.remove(mark_file)
+
+class SqliteMarkStore(MarkStore):
+
+    def __init__(self,db_file):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+
+        logger.debug('opening mark database: %s' % db_file)
+        self._conn = sqlite3.connect(db_file,timeout=30,isolation_level=None,check_same_thread=False)
+        with self._lock:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS marks (pipeline TEXT, task TEXT, stamp INTEGER NOT NULL, fingerprint TEXT, PRIMARY KEY (pipeline,task))')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS sequence (id INTEGER PRIMARY KEY CHECK (id = 0), last_stamp INTEGER NOT NULL)')
+            self._conn.execute('INSERT OR IGNORE INTO sequence VALUES (0,0)')
+
+            # databases made before fingerprints were recorded
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(marks)')]
+            if 'fingerprint' not in columns:
+                self._conn.execute('ALTER TABLE marks ADD COLUMN fingerprint TEXT')
+
+    def get_stamp(self,task):
+        with self._lock:
+            row = self._conn.execute('SELECT stamp FROM marks WHERE pipeline = ? AND task = ?',
+                                     (task.pipeline.name,task.name)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def get_stamps(self,tasks):
+        pipeline_names = set([t.pipeline.name for t in tasks])
+
+        known = {}
+        with self._lock:
+            for pname in pipeline_names:
+                for tname,stamp in self._conn.execute('SELECT task, stamp FROM marks WHERE pipeline = ?',(pname,)):
+                    known[(pname,tname)] = stamp
+
+        return {t:known.get((t.pipeline.name,t.name),None) for t in tasks}
+
+    def get_fingerprint(self,task):
+        with self._lock:
+            row = self._conn.execute('SELECT fingerprint FROM marks WHERE pipeline = ? AND task = ?',
+                                     (task.pipeline.name,task.name)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def _set_stamp(self,task,stamp,fingerprint):
+        """
+        Store the stamp for the task.  If stamp is None, the next stamp in the
+        sequence is used.
+        """
+        with self._lock:
+            # the write lock is taken right away so that concurrent xp processes
+            # can't hand out the same stamp
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                last_stamp, = self._conn.execute('SELECT last_stamp FROM sequence').fetchone()
+                if stamp is None:
+                    stamp = max(time.time_ns(),last_stamp + 1)
+
+                self._conn.execute('INSERT OR REPLACE INTO marks (pipeline, task, stamp, fingerprint) VALUES (?,?,?,?)',
+                                   (task.pipeline.name,task.name,stamp,fingerprint))
+                self._conn.execute('UPDATE sequence SET last_stamp = ?',(max(stamp,last_stamp),))
+                self._conn.execute('COMMIT')
+            except:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def mark(self,task,fingerprint=None):
+        self._set_stamp(task,None,fingerprint)
+
+    def set_stamp(self,task,stamp,fingerprint=None):
+        self._set_stamp(task,stamp,fingerprint)
+
+    def set_fingerprint(self,task,fingerprint):
+        with self._lock:
+            self._conn.execute('UPDATE marks SET fingerprint = ? WHERE pipeline = ? AND task = ?',
+                               (fingerprint,task.pipeline.name,task.name))
+
+    def unmark(self,task):
+        with self._lock:
+            self._conn.execute('DELETE FROM marks WHERE pipeline = ? AND task = ?',
+                               (task.pipeline.name,task.name))
@@ -0,0 +1,90 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Helpers for exchanging length-prefixed JSON messages with other processes.
+
+Each message is a 4-byte, big-endian unsigned length followed by that many
+bytes of UTF-8 encoded JSON.
+"""
+
+import json
+import struct
+import asyncio
+
+HEADER_FORMAT = '>I'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+class ConnectionClosed(Exception):
+    pass
+
+def encode_message(msg):
+    """
+    Return the bytes for msg, including the length header.
+    """
+    payload = json.dumps(msg).encode('utf-8')
+    return struct.pack(HEADER_FORMAT,len(payload)) + payload
+
+def decode_payload(payload):
+    return json.loads(payload.decode('utf-8'))
+
+def send_message(fh,msg):
+    """
+    Write msg to the binary file-like object fh.
+    """
+    fh.write(encode_message(msg))
+    fh.flush()
+
+def read_exactly(fh,size):
+    data = b''
+    while len(data) < size:
+        chunk = fh.read(size - len(data))
+        if not chunk:
+            raise ConnectionClosed('connection closed while reading a message')
+        data += chunk
+
+    return data
+
+def recv_message(fh):
+    """
+    Read one message from the binary file-like object fh.
+
+    Raise ConnectionClosed if the other end has gone away.
+    """
+    header = read_exactly(fh,HEADER_SIZE)
+    size, = struct.unpack(HEADER_FORMAT,header)
+
+    return decode_payload(read_exactly(fh,size))
+
+async def send_message_async(writer,msg):
+    """
+    Write msg to an asyncio StreamWriter.
+    """
+    writer.write(encode_message(msg))
+    await writer.drain()
+
+async def recv_message_async(reader):
+    """
+    Read one message from an asyncio StreamReader.
+    """
+    try:
+        header = await reader.readexactly(HEADER_SIZE)
+        size, = struct.unpack(HEADER_FORMAT,header)
+        payload = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise ConnectionClosed('connection closed while reading a message')
+
+    return decode_payload(payload)
@@ -0,0 +1,145 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+This module keeps the parsed form of pipeline files between invocations of
+xp, so that files that haven't changed needn't be parsed again.
+
+Each pipeline file has a pickle in the cache directory (the cache_dir option
+of the Parsing section), named after its path.  A pickle is only used if the
+file's path, modification time and size, the version of xp and the version of
+the parser all match those it was made with.
+
+The cache holds at most max_entries pickles: when a new one is written, the
+pickles of files that no longer exist are removed, then the least recently
+used ones until there are few enough.
+"""
+
+import os, os.path
+import hashlib
+import logging
+import pickle
+import tempfile
+
+import xp
+from xp import config
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+# changes to the parser invalidate the cache, even within an xp version
+PARSER_STAMP = os.stat(os.path.join(os.path.dirname(__file__),'pipeline.py')).st_mtime_ns
+
+def get_cache_dir():
+    """
+    Return the directory of the parse cache or None if it's disabled.
+    """
+    config_info = config.config_info()
+    if not config_info.getboolean(config.PARSING_SECTION,config.PARSE_CACHE_OPT):
+        return None
+
+    return os.path.expanduser(config_info.get(config.PARSING_SECTION,config.PARSE_CACHE_DIR_OPT).strip())
+
+def parse_with_cache(pipeline_file,parse):
+    """
+    Return parse(pipeline_file) or, if the file hasn't changed since it was
+    last parsed, the result of that parse.  pipeline_file must be a real,
+    absolute path.
+    """
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return parse(pipeline_file)
+
+    # stat before reading so that a change made while parsing is noticed next time
+    st = os.stat(pipeline_file)
+    key = (pipeline_file,st.st_mtime_ns,st.st_size,xp.__version__,PARSER_STAMP)
+    cache_file = os.path.join(cache_dir,'%s.pickle' % hashlib.sha1(pipeline_file.encode('utf-8')).hexdigest())
+
+    try:
+        with open(cache_file,'rb') as fh:
+            # the key comes first so that stale pickles needn't be read in full
+            cached_key = pickle.load(fh)
+            if cached_key == key:
+                result = pickle.load(fh)
+
+        if cached_key == key:
+            logger.debug('using the cached parse of %s' % pipeline_file)
+            # the modification time of a pickle records when it was last used
+            os.utime(cache_file)
+            return result
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.debug('ignoring unreadable parse cache %s: %s' % (cache_file,e))
+
+    result = parse(pipeline_file)
+
+    # write to a temporary file first so that readers never see a partial file
+    tmp_file = None
+    try:
+        os.makedirs(cache_dir,exist_ok=True)
+        fd,tmp_file = tempfile.mkstemp(dir=cache_dir)
+        fh = os.fdopen(fd,'wb')
+        pickle.dump(key,fh,pickle.HIGHEST_PROTOCOL)
+        pickle.dump(result,fh,pickle.HIGHEST_PROTOCOL)
+        fh.close()
+        os.replace(tmp_file,cache_file)
+    except Exception as e:
+        logger.debug('unable to cache the parse of %s: %s' % (pipeline_file,e))
+        if tmp_file is not None and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return result
+
+    prune(cache_dir)
+
+    return result
+
+def prune(cache_dir):
+    """
+    Remove the pickles of pipeline files that no longer exist and then the
+    least recently used pickles until at most max_entries are left.
+    """
+    max_entries = config.config_info().getint(config.PARSING_SECTION,config.PARSE_CACHE_MAX_ENTRIES_OPT)
+
+    entries = []
+    for fname in os.listdir(cache_dir):
+        if not fname.endswith('.pickle'):
+            continue
+
+        cache_file = os.path.join(cache_dir,fname)
+        try:
+            with open(cache_file,'rb') as fh:
+                pipeline_file,_,_,_,_ = pickle.load(fh)
+
+            if os.path.exists(pipeline_file):
+                entries.append((os.stat(cache_file).st_mtime_ns,cache_file))
+                continue
+        except FileNotFoundError:
+            # removed by another xp process
+            continue
+        except Exception as e:
+            logger.debug('removing unreadable parse cache %s: %s' % (cache_file,e))
+
+        remove_entry(cache_file)
+
+    entries.sort()
+    for _,cache_file in entries[:max(len(entries) - max_entries,0)]:
+        remove_entry(cache_file)
+
+def remove_entry(cache_file):
+    try:
+        os.remove(cache_file)
+    except FileNotFoundError:
+        pass
@@ -21,11 +21,25 @@ a pipeline.
 
 import re
 import os, os.path
+import glob
 import subprocess
 import logging
+import asyncio
+import time
+import hashlib
+import copy
 
-from xp.kernels.base import get_total_context
+from xp.executor_loader import ExecutorLoader
 from xp.kernel_loader import KernelLoader
+from xp.executors.base import ExecutionFailed
+from xp.durations import get_duration_history
+from xp.graph import TaskGraph
+from xp.marks import get_mark_store, get_mark_stamps, use_fingerprints
+from xp.cache import get_artifact_cache
+from xp.remote_cache import get_remote_cache
+from xp.parse_cache import parse_with_cache
+from xp.shell_memo import run_shell_function, forget_outputs
+from xp.context import Context, LazyValue, refresh_environment
 
 logger = logging.getLogger(os.path.basename(__file__))
 
@@ -68,8 +82,8 @@ def reset_pipeline_factory():
     """
     Wipe out any knowledge of the pipeline factory about any pipelines it knows about.
     """
-    _pipelines = {}
-    _under_construction = {}
+    _pipelines.clear()
+    _under_construction.clear()
 
     return
 
@@ -122,27 +136,266 @@ def get_visitation_list(all_tasks):
     Each element in the visitation list, V[i], is a tuple (task,depth)
     where a higher depth indicates being closer to a root.
     """
-    leaves = get_leaves(all_tasks)
-    
-    # put tasks into layers
-    depth = 0
-    cur_layer = leaves
-    task_depths = {t:0 for t in leaves}
-    while len(cur_layer) > 0:
-        depth += 1
-        next_layer = set()
+    return TaskGraph(all_tasks).visitation_list()
+
+def get_critical_path_lengths(all_tasks,durations):
+    """
+    Return a dictionary mapping each task to the length of the longest path
+    from it to a leaf, where the length of a path is the sum of the durations
+    of the tasks on it (including the task itself).  Only dependencies among
+    all_tasks are considered.
+
+    durations is a dictionary mapping each task to its (expected) duration.
+    """
+    all_tasks = set(all_tasks)
+    graph = TaskGraph(all_tasks)
+
+    # visit the leaves first so a task's dependents are done before it is
+    path_lengths = {}
+    for task in reversed(graph.topological_order()):
+        if task not in all_tasks:
+            continue
+
+        downstream = [path_lengths[t] for t in graph.dependents(task) if t in all_tasks]
+        path_lengths[task] = durations[task] + max(downstream + [0])
+
+    return path_lengths
+
+def build_plan(targets,force=FORCE_NONE):
+    """
+    Collect the tasks that need to be considered in order to run the target
+    tasks with the given forcing.
+
+    Return a dictionary mapping each task to True if the task is forced to
+    run, False otherwise.  The targets receive the force given, their
+    dependencies are forced only under FORCE_ALL and under FORCE_SOLO they
+    aren't considered at all.  Each task appears in the plan only once, no matter how many paths
+    lead to it.
+    """
+    assert force in FORCE_CHOICES
+
+    plan = {}
+    to_visit = [(t,force) for t in targets]
+    while len(to_visit) > 0:
+        task,task_force = to_visit.pop()
+        forced = task_force != FORCE_NONE
+
+        if task in plan and (plan[task] or not forced):
+            # we've already seen it with at least as strong a forcing
+            continue
+
+        plan[task] = forced
+
+        if task_force != FORCE_SOLO:
+            dep_force = FORCE_ALL if task_force == FORCE_ALL else FORCE_NONE
+            to_visit.extend([(d,dep_force) for d in task.get_deps()])
+
+    return plan
+
+def get_plan_order(targets,plan):
+    """
+    Return the tasks in the plan in the order they should be run: each task
+    comes after its dependencies and, otherwise, tasks are in the order in
+    which they are reached from the targets.
+    """
+    order = []
+    visited = set()
+    for target in targets:
+        if target in visited:
+            continue
+
+        visited.add(target)
+        to_visit = [(target,iter(target.get_deps()))]
+        while len(to_visit) > 0:
+            task,deps = to_visit[-1]
+            for d in deps:
+                if d in plan and d not in visited:
+                    visited.add(d)
+                    to_visit.append((d,iter(d.get_deps())))
+                    break
+            else:
+                to_visit.pop()
+                order.append(task)
+
+    return order
 
-        for t in cur_layer:
-            for d in t.get_deps():
-                task_depths[d] = depth
-                next_layer.add(d)
+def get_plan_mark_stamps(plan):
+    """
+    Read the mark stamps of the tasks in the plan, and of their dependencies,
+    in one batch.
+    """
+    all_tasks = set(plan)
+    for task in plan:
+        all_tasks.update(task.get_deps())
+
+    return get_mark_stamps(all_tasks)
+
+GLOB_PATTERN = re.compile('[*?[]')
+
+# the task properties that declare files (see Task.declared_files())
+FILE_PROPERTIES = ['inputs','outputs']
+
+# the task properties that are passed to kernels as variables (see Task.get_context())
+PROPERTY_VARIABLES = {'preload':'PYTHON_PRELOAD'}
+
+# for each kind of @session, the kernel that runs the session and the
+# languages of the blocks it runs (see Task.get_blocks())
+SESSION_KERNELS = {'python':('pysession',['py','ipy'])}
+SESSION_VAR = 'XP_SESSION'
+
+def relative_paths(text,base_dir):
+    """
+    Return the text with the absolute path base_dir replaced by "." wherever
+    it appears, e.g., in variables and block lines expanded with $PLN(...).
+    """
+    if base_dir == os.sep:
+        return text
+
+    return text.replace(base_dir,'.')
+
+def get_file_stamp(path):
+    """
+    Return the modification time of the file in nanoseconds or None if it
+    doesn't exist.
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def get_oldest_stamp(files):
+    """
+    Return (stamp,missing) for the (pattern,paths) tuples given (see
+    Task.declared_files): the modification time of the oldest file (in
+    nanoseconds) and the first pattern that has no existing file (or None).
+    """
+    oldest = None
+    for pattern,paths in files:
+        stamps = [get_file_stamp(p) for p in paths]
+        if len(stamps) == 0 or None in stamps:
+            return oldest,pattern
+
+        if oldest is None or min(stamps) < oldest:
+            oldest = min(stamps)
+
+    return oldest,None
 
-        cur_layer = next_layer
+_file_digests = {}
+
+def get_file_digest(path):
+    """
+    Return the sha256 digest of the file's content (for a directory, of the
+    names and contents of everything in it) or None if it doesn't exist.
+    Digests are remembered as long as the file's size and modification time
+    don't change.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    h = hashlib.sha256()
+    if os.path.isdir(path):
+        for dirpath,dirnames,filenames in os.walk(path):
+            dirnames.sort()
+            for fname in sorted(filenames):
+                fpath = os.path.join(dirpath,fname)
+                h.update(os.path.relpath(fpath,path).encode('utf-8'))
+                h.update((get_file_digest(fpath) or '').encode('utf-8'))
+
+        return h.hexdigest()
+
+    key = (path,st.st_size,st.st_mtime_ns)
+    if key not in _file_digests:
+        fh = open(path,'rb')
+        for chunk in iter(lambda: fh.read(2**20),b''):
+            h.update(chunk)
+        fh.close()
 
-    # visit nodes in order of increasing depth
-    visitation_list = sorted(task_depths.items(),key=lambda x: -x[1])
+        _file_digests[key] = h.hexdigest()
 
-    return visitation_list
+    return _file_digests[key]
+
+def check_task(task,forced,mark_stamps,fingerprints=None,adopt=True):
+    """
+    Decide whether the task needs to run.  Return (reason,fingerprint), where
+    reason is given by Task.run_reason(...).
+
+    fingerprints is None unless staleness is decided by fingerprints (see
+    xp.marks), in which case it's a dictionary of the fingerprints computed so
+    far in this run, to which the task's fingerprint is added.  If adopt is
+    True and the task is up to date but its mark predates fingerprints, the
+    fingerprint is recorded with the mark.
+    """
+    fingerprint = None
+    if fingerprints is not None:
+        fingerprint = task.fingerprint(fingerprints)
+        fingerprints[task] = fingerprint
+
+    reason = task.run_reason(forced,mark_stamps,fingerprint)
+
+    if reason is None and fingerprint is not None and adopt and task.mark_fingerprint() is None:
+        task.mark_store().set_fingerprint(task,fingerprint)
+
+    return reason,fingerprint
+
+def run_plan(targets,force=FORCE_NONE,executor=None):
+    """
+    Run the target tasks and their dependencies one at a time.  Every task is
+    considered exactly once (see build_plan).
+
+    Return the list of tasks that were actually run, in order.
+    """
+    plan = build_plan(targets,force)
+
+    for task in plan:
+        if task.pipeline.is_abstract:
+            raise Exception('an abstract pipeline cannot be run: %s' % task.pipeline.abs_filename)
+
+    tasks_run = []
+    mark_stamps = get_plan_mark_stamps(plan)
+    fingerprints = {} if use_fingerprints() else None
+    for task in get_plan_order(targets,plan):
+        task.pipeline.pre_run(task)
+
+        reason,fingerprint = check_task(task,plan[task],mark_stamps,fingerprints)
+        if reason is None:
+            logger.debug('task %s is up to date' % task.name)
+            continue
+
+        logger.debug('run task %s: %s' % (task.name,reason))
+        # forced tasks are really run, not restored from the cache
+        task.execute(executor,fingerprint,not plan[task])
+
+        # its mark just changed
+        mark_stamps.pop(task,None)
+        tasks_run.append(task)
+
+    return tasks_run
+
+def plan_run(targets,force=FORCE_NONE):
+    """
+    Work out which tasks would be run by running the targets with the given
+    forcing, without running anything.
+
+    Return a list of (task,reason) tuples, in the order the tasks would be
+    run, where reason is the one given by Task.run_reason(...).
+    """
+    plan = build_plan(targets,force)
+
+    mark_stamps = get_plan_mark_stamps(plan)
+    fingerprints = {} if use_fingerprints() else None
+
+    to_run = []
+    for task in get_plan_order(targets,plan):
+        reason,fingerprint = check_task(task,plan[task],mark_stamps,fingerprints,adopt=False)
+        if reason is not None:
+            to_run.append((task,reason))
+
+            # once it has run, its mark will be newer than all the others
+            mark_stamps[task] = float('inf')
+
+    return to_run
 
 def dep_graph_iter(all_tasks):
     
@@ -200,7 +453,10 @@ class Pipeline:
         return None
 
     def initialize(self):
-        
+
+        # the dependency graph is built the first time it's needed
+        self._task_graph = None
+
         # go through and deal with the extend and use statements
         self.used_pipelines = {}
 
@@ -293,41 +549,49 @@ class Pipeline:
 
     def build_context(self):
         # build context by processing all variables
-        self.context = {}
+        context = Context()
 
         # insert the pipline prefix for us to use and for code blocks to use
-        self.context[PIPELINE_PREFIX_VARNAME] = self.prefix_stmt.get_prefix(self.abs_filename)
+        context[PIPELINE_PREFIX_VARNAME] = self.prefix_stmt.get_prefix(self.abs_filename)
         
-        # update all variables from statements in the preamble
+        # update all variables from statements in the preamble.  A variable's
+        # value is only worked out when it's first needed, in the context as it
+        # was at its assignment - later statements go into a new layer.
         cwd = self.abs_path()
+        pipelines = self.get_used_pipelines()
         for s in self.preamble:
-            s.update_context(self.context,cwd,self.get_used_pipelines())
+            if isinstance(s,VariableAssignment):
+                scope = context
+                context = context.child()
+                context[s.varname] = LazyValue(s.evaluator(scope,cwd,pipelines))
+            else:
+                s.update_context(context,cwd,pipelines)
+
+        self.context = context.flatten()
 
     def pre_run(self,task):
         # initialize the prefix space if need be
         self.prefix_stmt.create_prefix(self.abs_filename)
 
+    def get_task_graph(self):
+        """
+        Return the TaskGraph of this pipeline's tasks and all the tasks they
+        depend on.  It's built once and kept until the pipeline is
+        re-initialized.
+        """
+        if self._task_graph is None:
+            self._task_graph = TaskGraph(self.tasks)
+
+        return self._task_graph
+
     def get_visitation_list(self):
-        # compile all tasks
-        return get_visitation_list(self.get_all_tasks())
+        return self.get_task_graph().visitation_list()
 
     def get_all_tasks(self):
         """
         Get all tasks that this pipeline uses
         """
-        all_tasks = set(self.tasks)
-        new_tasks = self.tasks
-        while len(new_tasks) > 0:
-            next_tasks = set()
-            for t in new_tasks:
-                for d in t.get_deps():
-                    if d not in all_tasks:
-                        next_tasks.add(d)
-                        all_tasks.add(d)
-            new_tasks = next_tasks
-
-        # TODO: Should probably memorize this
-        return all_tasks
+        return self.get_task_graph().tasks()
 
     def get_task(self,task_name):
         if task_name in self.task_lookup:
@@ -337,18 +601,22 @@ class Pipeline:
 
     def get_context(self):
         """
-        Return a dictionary of variables
+        Return the pipeline's variables as a Context that can be changed
+        without affecting the pipeline.
         """
-        return dict(self.context)
+        return self.context.child()
 
     def mark_all_tasks(self,recur=False):
-        for t in self.tasks:
-            t.mark()
-
+        # dependencies are marked first so that no task ends up older than them
         if recur:
             for pipeline in self.used_pipelines.values():
                 pipeline.mark_all_tasks(recur=True)
 
+        own_tasks = set(self.tasks)
+        for t in self.get_task_graph().topological_order():
+            if t in own_tasks:
+                t.mark()
+
     def unmark_all_tasks(self,recur=False):
         for t in self.tasks:
             t.unmark()
@@ -357,19 +625,49 @@ class Pipeline:
             for pipeline in self.used_pipelines.values():
                 pipeline.unmark_all_tasks(recur=True)
 
-    def run(self,force=FORCE_NONE):
+    def run(self,force=FORCE_NONE,num_jobs=1,engine=None,executor=None,keep_going=False):
+        """
+        Run the pipeline.  If num_jobs is larger than one, an execution
+        engine is given or keep_going is True (see xp.scheduler), the tasks
+        are run by the scheduler.  executor is the name of the executor that
+        blocks are sent to by default.
+        """
         if self.is_abstract:
             raise Exception('an abstract pipeline cannot be run: %s' % self.abs_filename)
 
-        self.build_context()    
+        try:
+            self.build_context()    
+
+            if num_jobs > 1 or engine is not None or keep_going:
+                from xp.scheduler import Scheduler, ENGINE_THREADS
+                return Scheduler(num_jobs,engine=engine or ENGINE_THREADS,executor=executor,
+                                 keep_going=keep_going).run(self.get_leaf_tasks(),force)
+
+            return run_plan(self.get_leaf_tasks(),force,executor)
+        finally:
+            # inline shell functions and the environment are evaluated afresh
+            # in the next run, which also gets new kernel processes
+            forget_outputs()
+            refresh_environment()
+            KernelLoader.singleton().shutdown_kernel_processes()
+
+    def dry_run(self,force=FORCE_NONE):
+        """
+        Return the (task,reason) tuples for the tasks that running the pipeline
+        would run (see plan_run).
+        """
+        if self.is_abstract:
+            raise Exception('an abstract pipeline cannot be run: %s' % self.abs_filename)
 
-        tasks_run = []
-        # run the leaf tasks - this will trigger other tasks as needed
-        for t in get_leaves(self.tasks):
-            logger.debug('running task %s' % t.name)
-            tasks_run.extend(t.run(force))
+        return plan_run(self.get_leaf_tasks(),force)
 
-        return tasks_run
+    def get_leaf_tasks(self):
+        """
+        Return the tasks in this pipeline that no other task depends on, in the
+        order they're defined.  Running these runs the whole pipeline.
+        """
+        graph = self.get_task_graph()
+        return [t for t in self.tasks if len(graph.dependents(t)) == 0]
     
 class VariableAssignment:
     def __init__(self,varname,value,source_file,lineno):
@@ -378,9 +676,22 @@ class VariableAssignment:
         self.source_file = source_file
         self.lineno = lineno
 
+        self.template = compile_template(value,source_file,lineno)
+
+    def evaluator(self,context,cwd,pipelines):
+        """
+        Return a function that evaluates the value in the context given, which
+        mustn't change afterwards.
+        """
+        def evaluate():
+            value = self.template.expand(context,cwd,pipelines)
+            logger.debug('expanded "%s" to "%s"' % (self.value,value))
+            return value
+
+        return evaluate
+
     def update_context(self,context,cwd,pipelines):
-        # TODO: Keep track of the line number
-        value = expand_variables(self.value,context,cwd,pipelines,self.source_file,self.lineno)
+        value = self.template.expand(context,cwd,pipelines)
         logger.debug('expanded "%s" to "%s"' % (self.value,value))
 
         context[self.varname] = value    
@@ -483,6 +794,9 @@ class Task:
         self.source_file = source_file
         self.lineno = lineno
 
+        self._file_templates = {p:compile_template(properties[p],source_file,lineno)
+                                for p in FILE_PROPERTIES if p in properties}
+
         self._dependencies = []
 
     def properties(self):
@@ -511,98 +825,420 @@ class Task:
         return self._is_markable
 
     def mark_file(self):
+        """
+        Return the file that marks this task when the file mark backend is used.
+        """
         return os.path.join(self.pipeline.abs_path(),'.%s-%s.mark' % (self.pipeline.name,self.name))
 
+    def mark_store(self):
+        return get_mark_store(self.pipeline)
+
     def unmark(self):
-        # Remove the marker file
-        if self.is_marked():
-            logger.debug('removing mark file %s' % self.mark_file())
-            os.remove(self.mark_file())
+        self.mark_store().unmark(self)
     
-    def mark(self):
-        mark_file = self.mark_file()
-
-        logger.debug('writing mark file: %s' % mark_file)
-        # Make the marker file
-        fh = open(mark_file,'w')
-        fh.close()
+    def mark(self,fingerprint=None):
+        self.mark_store().mark(self,fingerprint)
 
     def is_marked(self):
-        # if it's unmarkable, ignore any mark file
+        return self.mark_stamp() is not None
+
+    def mark_stamp(self):
+        """
+        Return the stamp of this task's mark (see xp.marks) or None if it isn't
+        marked.  A task marked later has a larger stamp.
+        """
+        # if it's unmarkable, ignore any mark
         if not self._is_markable:
-            return False
+            return None
 
-        return os.path.exists(self.mark_file())
+        return self.mark_store().get_stamp(self)
 
     def mark_timestamp(self):
-        if not self.is_marked():
+        """
+        Return the time the task was marked or None if it isn't marked.
+        """
+        stamp = self.mark_stamp()
+        return stamp / 1e9 if stamp is not None else None
+
+    def mark_fingerprint(self):
+        """
+        Return the fingerprint recorded when the task was marked or None.
+        """
+        if not self._is_markable:
             return None
-        else:
-            logger.debug('returning ts for mark file: %s' % self.mark_file())
-            return os.path.getmtime(self.mark_file())
 
-    def run(self,force=FORCE_NONE):
+        return self.mark_store().get_fingerprint(self)
+
+    def fingerprint(self,fingerprints=None):
+        """
+        Return a fingerprint of everything that determines what running this
+        task does: its blocks with all variables and functions expanded, the
+        context each block is run in, the contents of its declared inputs, the
+        outputs it declares and the fingerprints of its dependencies.
+
+        fingerprints is an optional dictionary of the fingerprints of tasks
+        that are already known.  The fingerprints of other dependencies are
+        read from their marks.
+        """
+        context = self.get_context()
+        pipelines = self.pipeline.get_used_pipelines()
+        cwd = self.pipeline.abs_path()
+
+        # paths within the pipeline's directory are hashed relative to it, so
+        # that every checkout of a pipeline has the same fingerprints
+        h = hashlib.sha256()
+        def add(*values):
+            for v in values:
+                h.update(relative_paths(v,cwd).encode('utf-8'))
+                h.update(b'\0')
+
+        for b in self.blocks:
+            if isinstance(b,ExportBlock):
+                b.update_context(context,cwd,pipelines)
+                continue
+
+            arg_str,content = b.expand(context,pipelines,cwd)
+            add('block',b.lang,arg_str,*content)
+            for k in sorted(context.keys()):
+                add(k,context[k])
+
+        for pattern,paths in self.declared_files('inputs'):
+            add('input',pattern)
+            for path in paths:
+                add(path,get_file_digest(path) or '')
+
+        for pattern,paths in self.declared_files('outputs'):
+            add('output',pattern)
+
+        for d in self._dependencies:
+            if fingerprints is not None and d in fingerprints:
+                dep_fingerprint = fingerprints[d]
+            else:
+                dep_fingerprint = d.mark_fingerprint()
+
+            add('dependency',d.pipeline.name,d.name,dep_fingerprint or '')
+
+        return h.hexdigest()
+
+    def expected_duration(self):
+        """
+        Return how long (in seconds) this task took the last time it was run
+        successfully or None if this isn't known.
+        """
+        return get_duration_history(self.pipeline).get(self.name)
+
+    def record_duration(self,duration):
+        get_duration_history(self.pipeline).record(self.name,duration)
+
+    def declared_files(self,prop_name):
+        """
+        Return the files declared by a property (@inputs or @outputs) as a list
+        of (pattern,paths) tuples.  Patterns are separated by whitespace, can
+        use the pipeline's variables and functions (e.g., $PLN(...)) and are
+        relative to the pipeline's directory.  paths holds the files matching
+        a glob pattern or, for a plain path, the path itself.
+        """
+        if prop_name not in self._file_templates:
+            return []
+
+        cwd = self.pipeline.abs_path()
+        value = self._file_templates[prop_name].expand(self.pipeline.get_context(),cwd,
+                                                       self.pipeline.get_used_pipelines())
+
+        files = []
+        for pattern in value.split():
+            path = os.path.join(cwd,pattern)
+            if GLOB_PATTERN.search(pattern):
+                files.append((pattern,sorted(glob.glob(path))))
+            else:
+                files.append((pattern,[path]))
+
+        return files
+
+    def outputs_stamp(self):
+        """
+        Return the modification time (in nanoseconds) of the oldest of the
+        task's declared outputs or None if it declares none or one is missing.
+        """
+        stamp,missing = get_oldest_stamp(self.declared_files('outputs'))
+        return stamp if missing is None else None
+
+    def restore_outputs(self,fingerprint):
+        """
+        Restore the task's declared outputs from the artifact cache (see
+        xp.cache), downloading them from the remote cache (see
+        xp.remote_cache) if need be.  Return True if they were restored.
+        """
+        cache = get_artifact_cache()
+        if cache is None or fingerprint is None or 'outputs' not in self._properties:
+            return False
+
+        try:
+            if fingerprint not in cache:
+                remote = get_remote_cache()
+                if remote is None or not remote.fetch(fingerprint,cache):
+                    return False
+
+            return cache.restore(fingerprint,self.pipeline.abs_path())
+        except Exception as e:
+            logger.warn('task %s: unable to restore outputs from the cache: %s' % (self.name,e))
+            return False
+
+    def save_outputs(self,fingerprint):
+        """
+        Store the task's declared outputs in the artifact cache (if enabled).
+        """
+        cache = get_artifact_cache()
+        if cache is None or fingerprint is None or 'outputs' not in self._properties:
+            return
+
+        outputs = self.declared_files('outputs')
+        stamp,missing = get_oldest_stamp(outputs)
+        if missing is not None:
+            logger.warn('task %s: output %s is missing, not caching outputs' % (self.name,missing))
+            return
+
+        try:
+            if cache.store(fingerprint,[p for pattern,paths in outputs for p in paths],self.pipeline.abs_path()):
+                remote = get_remote_cache()
+                if remote is not None:
+                    remote.upload(fingerprint,cache)
+        except Exception as e:
+            logger.warn('task %s: unable to cache outputs: %s' % (self.name,e))
+
+    def run_reason(self,forced=False,mark_stamps=None,fingerprint=None):
+        """
+        Return a short description of why this task needs to be run or None if
+        it is up to date.  Since the decision depends on the marks of the 
+        dependencies, this should only be called once they have been run.
+
+        mark_stamps is an optional dictionary of the mark stamps that are
+        already known (see get_mark_stamps).  It is used instead of reading the
+        marks again and is updated with the stamps that had to be read.
 
-        tasks_run = []
+        If fingerprint is given, a marked task needs to be run only if the
+        fingerprint differs from the one recorded with its mark.  Marks without
+        a fingerprint fall back on comparing the marks of the dependencies.
+
+        A task that declares @outputs is also judged by its files, like make:
+        even if it's marked, it needs to be run if an output is missing or
+        older than one of its @inputs or the mark of a dependency.
+        """
+        if forced:
+            return 'forced'
+
+        def get_mark_stamp(task):
+            if mark_stamps is None:
+                return task.mark_stamp()
+            elif task not in mark_stamps:
+                mark_stamps[task] = task.mark_stamp()
+
+            return mark_stamps[task]
+
+        def get_stamp(task):
+            stamp = get_mark_stamp(task)
+            if stamp is None:
+                # a dependency can be up to date by its outputs alone
+                return task.outputs_stamp()
+
+            return stamp
+
+        outputs = self.declared_files('outputs')
+        if len(outputs) > 0:
+            mst,missing = get_oldest_stamp(outputs)
+            if missing is not None:
+                return 'output %s is missing' % missing
+
+        if get_mark_stamp(self) is None:
+            return 'unmarked'
+        elif len(outputs) == 0:
+            mst = get_mark_stamp(self)
+
+        for pattern,paths in self.declared_files('inputs'):
+            for path in paths:
+                ist = get_file_stamp(path)
+                if ist is None:
+                    return 'input %s is missing' % pattern
+                elif ist > mst:
+                    return 'input %s changed' % pattern
+
+        if fingerprint is not None:
+            recorded_fingerprint = self.mark_fingerprint()
+            if recorded_fingerprint is not None:
+                return 'inputs changed' if recorded_fingerprint != fingerprint else None
+
+        for d in self._dependencies:
+            dts = get_stamp(d)
+            if dts is None or mst < dts:
+                return 'dependency %s is newer' % d.name
+
+        return None
+
+    def run(self,force=FORCE_NONE,num_jobs=1,engine=None,executor=None,keep_going=False):
 
         if self.pipeline.is_abstract:
             raise Exception('an abstract pipeline cannot be run: %s' % self.pipeline.abs_filename)
 
-        self.pipeline.pre_run(self)
-
         assert force in FORCE_CHOICES 
 
-#        logger.debug('task %s: marked = %d' % (self.name,self.is_marked()))
-#        if force == FORCE_NONE and self.is_marked():
-#            logger.info('task %s is marked, skipping' % self.name)
-#            return
-
-        # first run all dependencies
-        if force != FORCE_SOLO:
-            dep_force = FORCE_ALL if force == FORCE_ALL else FORCE_NONE
-            logger.debug('task %s: run dependencies' % self.name)
-            for d in self._dependencies:
-                tasks_run.extend(d.run(force=dep_force))
-        else:
-            logger.debug('task %s: skipping dependencies, solo mode!' % self.name)
-        
-        # check if we need to run this task
-        run_task = False
-        if force != FORCE_NONE:
-            logger.debug('run task %s: forced' % self.name)
-            run_task = True
-        elif not self.is_marked():
-            logger.debug('run task %s: unmarked' % self.name)
-            run_task = True
-        else:
-            mst = self.mark_timestamp()
-            for d in self._dependencies:
-                if mst < d.mark_timestamp():
-                    run_task = True
-                    break
+        try:
+            if num_jobs > 1 or engine is not None or keep_going:
+                from xp.scheduler import Scheduler, ENGINE_THREADS
+                return Scheduler(num_jobs,engine=engine or ENGINE_THREADS,executor=executor,
+                                 keep_going=keep_going).run([self],force)
 
-        if not run_task:
-            return tasks_run
+            return run_plan([self],force,executor)
+        finally:
+            # inline shell functions and the environment are evaluated afresh
+            # in the next run, which also gets new kernel processes
+            forget_outputs()
+            refresh_environment()
+            KernelLoader.singleton().shutdown_kernel_processes()
 
-        logger.debug('run task %s: dep timestamp' % self.name)
+    def dry_run(self,force=FORCE_NONE):
+        """
+        Return the (task,reason) tuples for the tasks that running this task
+        would run (see plan_run).
+        """
+        assert force in FORCE_CHOICES
 
-        # get ready to run this task
+        return plan_run([self],force)
+
+    def get_context(self):
+        """
+        Return the variables this task's blocks are run with: those of its
+        pipeline and those set by its properties (see PROPERTY_VARIABLES).
+        """
         context = self.pipeline.get_context()
+        for prop_name,var_name in PROPERTY_VARIABLES.items():
+            if prop_name in self._properties:
+                context[var_name] = self._properties[prop_name].strip()
+
+        if self.get_session() is not None:
+            context[SESSION_VAR] = '%s:%s' % (self.pipeline.abs_filename,self.name)
+
+        return context
+
+    def get_session(self):
+        """
+        Return the kind of session (see SESSION_KERNELS) set by the @session
+        property or None if the task's blocks don't share one.
+        """
+        session = self._properties.get('session',None)
+        if session is None:
+            return None
+
+        session = session.strip()
+        if session not in SESSION_KERNELS:
+            raise Exception('task %s: unknown session: %s' % (self.name,session))
+
+        kernel_lang = SESSION_KERNELS[session][0]
+        if kernel_lang not in KernelLoader.singleton():
+            raise Exception('task %s: the %s kernel, which runs %s sessions, is not active' % (self.name,kernel_lang,session))
+
+        return session
+
+    def get_blocks(self):
+        """
+        Return the blocks to run.  In a session, the blocks in the session's
+        languages are run by its kernel instead.
+        """
+        session = self.get_session()
+        if session is None:
+            return self.blocks
+
+        kernel_lang,langs = SESSION_KERNELS[session]
+        return [b.with_lang(kernel_lang) if isinstance(b,CodeBlock) and b.lang in langs else b
+                for b in self.blocks]
+
+    def end_session(self,context):
+        """
+        Shut down the kernel of the task's session, if it has one.
+        """
+        session = self.get_session()
+        if session is not None:
+            KernelLoader.singleton().get_kernel(SESSION_KERNELS[session][0]).shutdown(context)
+
+    def get_executor(self,executor_name=None):
+        """
+        Return the executor that should run this task's blocks.  The @executor
+        property takes precedence over executor_name, which is the executor
+        chosen for the run.  If neither is given, the default executor is used.
+        """
+        executor_name = self._properties.get('executor',executor_name)
+        if executor_name is not None:
+            executor_name = executor_name.strip()
+
+        # the blocks of a session must all be run by this process
+        if self.get_session() is not None and executor_name not in (None,'local'):
+            logger.warn('task %s: running the blocks of a session with the local executor' % self.name)
+            executor_name = 'local'
+
+        return ExecutorLoader.singleton().get_executor(executor_name)
+
+    def execute(self,executor_name=None,fingerprint=None,use_cache=True):
+        """
+        Run the blocks of this task (regardless of its mark) and mark it,
+        recording the fingerprint given (if any).  Dependencies are not
+        considered.
+
+        If use_cache is True and the task's outputs are in the artifact cache
+        under the fingerprint, they are restored instead of running the blocks.
+        """
+        if use_cache and self.restore_outputs(fingerprint):
+            logger.info('task %s: restored outputs from the cache' % self.name)
+            self.mark(fingerprint)
+            return
+
+        # get ready to run this task
+        context = self.get_context()
         pipelines = self.pipeline.get_used_pipelines()
         cwd = self.pipeline.abs_path()
+        executor = self.get_executor(executor_name)
 
         # run this tasks
         logger.info('task %s: running blocks...' % self.name)
-        for b in self.blocks:
-            logger.debug('task %s: running block %s' % (self.name,str(b.__class__)))
-            b.run(context,pipelines,cwd)
+        start_time = time.time()
+        try:
+            for b in self.get_blocks():
+                logger.debug('task %s: running block %s' % (self.name,str(b.__class__)))
+                b.run(context,pipelines,cwd,executor)
+        finally:
+            self.end_session(context)
+
+        self.record_duration(time.time() - start_time)
+        self.save_outputs(fingerprint)
 
         # Update the marker
-        self.mark()
+        self.mark(fingerprint)
 
-        tasks_run.append(self)
+    async def execute_async(self,executor_name=None,fingerprint=None,use_cache=True):
+        """
+        The same as execute(), but the blocks are run from within an asyncio event loop.
+        """
+        if use_cache and self.restore_outputs(fingerprint):
+            logger.info('task %s: restored outputs from the cache' % self.name)
+            self.mark(fingerprint)
+            return
 
-        return tasks_run
+        context = self.get_context()
+        pipelines = self.pipeline.get_used_pipelines()
+        cwd = self.pipeline.abs_path()
+        executor = self.get_executor(executor_name)
+
+        logger.info('task %s: running blocks...' % self.name)
+        start_time = time.time()
+        try:
+            for b in self.get_blocks():
+                logger.debug('task %s: running block %s' % (self.name,str(b.__class__)))
+                await b.run_async(context,pipelines,cwd,executor)
+        finally:
+            self.end_session(context)
+
+        self.record_duration(time.time() - start_time)
+        self.save_outputs(fingerprint)
+
+        self.mark(fingerprint)
 
 class ExportBlock:
     def __init__(self,statements,source_file,lineno):
@@ -613,10 +1249,13 @@ class ExportBlock:
     def copy(self):
         return ExportBlock(self.statements,self.source_file,self.lineno)
 
-    def run(self,context,pipelines,cwd):
+    def run(self,context,pipelines,cwd,executor=None):
         # modify the context - that's all the export block can do
         self.update_context(context,cwd,pipelines)
 
+    async def run_async(self,context,pipelines,cwd,executor=None):
+        self.run(context,pipelines,cwd)
+
     def update_context(self,context,cwd,pipelines):
         for s in self.statements:
             s.update_context(context,cwd,pipelines)
@@ -635,6 +1274,11 @@ class CodeBlock:
         self.source_file = source_file
         self.lineno = lineno
 
+        # the block is parsed once, when it's loaded, and expanded on every run
+        self.arg_template = compile_template(arg_str,source_file,lineno)
+        self.templates = [compile_template(line,source_file,lineno+i)
+                          for i,line in enumerate(content,1)]
+
     def get_final_lineno(self):
         # num lines
         return self.lineno + len(self.content)
@@ -642,30 +1286,56 @@ class CodeBlock:
     def copy(self):
         return CodeBlock(self.lang,self.arg_str,self.content,self.source_file,self.lineno)
 
-    def run(self,context,pipelines,cwd):
+    def with_lang(self,lang):
+        """
+        Return a copy of this block that's run by the kernel for lang.  The
+        templates are shared rather than compiled again.
+        """
+        block = copy.copy(self)
+        block.lang = lang
+        return block
 
-        # expand any variables in the argument string
-        # TODO: Update line numbers
-        arg_str = expand_variables(self.arg_str,context,cwd,pipelines,
-                                   self.source_file,self.lineno)
+    def expand(self,context,pipelines,cwd):
+        """
+        Return (arg_str,content) with all variables and functions expanded.
+        """
+        arg_str = self.arg_template.expand(context,cwd,pipelines)
+        content = [t.expand(context,cwd,pipelines) for t in self.templates]
 
-        # expand any variables in the content
-        # TODO: Update line numbers
-        content = []
-        for i,line in enumerate(self.content,1):
-            content.append(expand_variables(line,context,cwd,pipelines,self.source_file,self.lineno+i))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('expanded\n%s\n\nto\n%s' % (self.content,content))
 
-        logger.debug('expanded\n%s\n\nto\n%s' % (self.content,content))
+        return arg_str,content
 
-        kloader = KernelLoader.singleton()
-        if self.lang in kloader:
-            kernel = kloader.get_kernel(self.lang) 
-            try:
-                kernel.run(arg_str,context,cwd,content)
-            except subprocess.CalledProcessError:
-                raise BlockFailed('process failed')
-        else:
-            raise BlockFailed('unknown language suffix: %s' % self.lang)
+    def run(self,context,pipelines,cwd,executor=None):
+        """
+        Expand the block and run it using the executor given (or the default
+        executor if None).
+        """
+        arg_str,content = self.expand(context,pipelines,cwd)
+
+        if executor is None:
+            executor = ExecutorLoader.singleton().get_executor()
+
+        try:
+            executor.run_block(self.lang,arg_str,context,cwd,content)
+        except subprocess.CalledProcessError:
+            raise BlockFailed('process failed')
+        except ExecutionFailed as e:
+            raise BlockFailed(str(e))
+
+    async def run_async(self,context,pipelines,cwd,executor=None):
+        arg_str,content = self.expand(context,pipelines,cwd)
+
+        if executor is None:
+            executor = ExecutorLoader.singleton().get_executor()
+
+        try:
+            await executor.run_block_async(self.lang,arg_str,context,cwd,content)
+        except subprocess.CalledProcessError:
+            raise BlockFailed('process failed')
+        except ExecutionFailed as e:
+            raise BlockFailed(str(e))
 
 class PipelineNotFound(Exception):
     def __init__(self,pipeline_file):
@@ -675,6 +1345,21 @@ class PipelineNotFound(Exception):
 class BlockFailed(Exception):
     pass
 
+class TasksFailed(Exception):
+    """
+    Raised at the end of a keep-going run in which some tasks failed.
+
+      - completed is the list of tasks that were run successfully
+      - failed is a list of (task,exception) pairs
+      - blocked is the list of tasks that weren't run because a task they
+        depend on failed
+    """
+    def __init__(self,completed,failed,blocked):
+        Exception.__init__(self,'%d task(s) failed, %d task(s) blocked' % (len(failed),len(blocked)))
+        self.completed = completed
+        self.failed = failed
+        self.blocked = blocked
+
 class ParseException(Exception):
     
     def __init__(self,source_file,lineno,message):
@@ -703,75 +1388,62 @@ FILE_PATTERN = '.+?'
 
 def parse_pipeline(pipeline_file,default_prefix):
     
-    # read in the content of the file
     pipeline_file = os.path.realpath(os.path.abspath(pipeline_file))
-    lines = open(pipeline_file,'r').readlines()
 
-    # read the preamble
-    extend_pattern = re.compile('^extend\s+(%s)$' % FILE_PATTERN)
-    use_pattern = re.compile('^use\s+(%s)(\s+as\s+(%s))?$' % (FILE_PATTERN,VAR_PATTERN))
-    prefix_pattern = re.compile('^prefix\s+(file|dir)(\s+%s)?\s*$' % FILE_PATTERN)
-    var_assign_pattern = re.compile('^(%s)\s*=(.+)' % VAR_PATTERN)
-    var_del_pattern = re.compile('^unset\s+(%s)$' % VAR_PATTERN)
+    # an unchanged file needn't be parsed again (see xp.parse_cache)
+    statements,tasks = parse_with_cache(pipeline_file,parse_pipeline_file)
 
-    lineno = 0
-    in_comment_block = False
-    in_preamble = True
-    statements = []
-    while lineno < len(lines) and in_preamble:
-        cur_line = lines[lineno].strip()
+    # make the pipeline
+    pipeline = Pipeline(pipeline_file,statements,tasks,default_prefix=default_prefix)
+
+    # return the pipeline
+    return pipeline
+
+# The grammar of a pipeline file, one construct per line:
+#
+#   pipeline     := preamble task*
+#   preamble     := (blank | comment | comment_block | extend | use | prefix
+#                    | assignment | unset)*
+#   task         := ['*'] NAME ['.' LANG] ':' NAME* ['#' ...] task_body
+#   task_body    := block_content                  (if the task has a LANG)
+#                 | (INDENT (comment | comment_block | property
+#                            | 'code.' LANG ':' ARGS block_content
+#                            | 'export:' block_content))*
+#   block_content := lines indented deeper than the line that opened the block
+#
+# INDENT is the indentation of the first line in the task's body.  The parser
+# makes a single pass over the lines, deciding what each line is by its
+# indentation and (at most) one of the patterns below.
+PREAMBLE_PATTERN = re.compile('^(?:extend\s+(?P<extend>%s)'
+                              '|(?P<assign>%s)\s*=(?P<value>.+)'
+                              '|unset\s+(?P<unset>%s)'
+                              '|use\s+(?P<use>%s)(?:\s+as\s+(?P<alias>%s))?'
+                              '|prefix\s+(?P<prefix_type>file|dir)(?P<prefix>\s+%s)?\s*)$' %
+                              (FILE_PATTERN,VAR_PATTERN,VAR_PATTERN,FILE_PATTERN,VAR_PATTERN,FILE_PATTERN))
+TASK_PATTERN = re.compile('^(\*?)(%s)(\.%s)?\s*:([^#]*)' % (VAR_PATTERN,LANG_SUFFIX_PATTERN))
+DEPENDENCY_PATTERN = re.compile('^%s(\.%s)?$' % (VAR_PATTERN,VAR_PATTERN))
+TASK_CONTENT_PATTERN = re.compile('^(?:code\.(?P<lang>\w+):(?P<arg_str>.*)'
+                                  '|export:(?P<export_arg_str>.*)'
+                                  '|@(?P<prop_name>[^\s]+)\s+(?P<prop_value>.*))$')
+EXPORT_STMT_PATTERN = re.compile('^(?:(?P<assign>%s)\s*=(?P<value>.*)|unset\s+(?P<unset>%s))$' %
+                                 (VAR_PATTERN,VAR_PATTERN))
+
+def parse_pipeline_file(pipeline_file):
+    """
+    Parse the pipeline file and return (preamble statements,tasks).
+    """
+    # read in the content of the file
+    fh = open(pipeline_file,'r')
+    lines = fh.read().split('\n')
+    fh.close()
+
+    # a final newline doesn't start another line
+    if len(lines) > 0 and lines[-1] == '':
+        lines.pop()
+
+    lineno,statements = parse_preamble(lines,pipeline_file)
 
-        m = extend_pattern.match(cur_line)
-        if in_comment_block:
-            if cur_line.startswith('###'):
-                in_comment_block = False
-        elif cur_line.startswith('###'):
-            in_comment_block = True
-        elif m:    
-            # load in the pipeline
-            fname = m.group(1)
-            complete_fname = os.path.join(os.path.dirname(pipeline_file),fname)
-            statements.append(ExtendStatement(complete_fname,pipeline_file,lineno))
-        else:
-            m = var_assign_pattern.match(cur_line)
-            if m:
-                logger.debug('found variable assignment: %s,%s' % (m.group(1),m.group(2)))
-                statements.append(VariableAssignment(m.group(1),m.group(2),pipeline_file,lineno))
-            else:
-                m = var_del_pattern.match(cur_line)
-                if m:
-                    logger.debug('found delete variable: %s' % m.group(1))
-                    statements.append(DeleteVariable(m.group(1),pipeline_file,lineno))
-                else:
-                    m = use_pattern.match(cur_line)
-                    if m:
-                        alias = m.group(3)
-                        logger.debug('found use: %s,%s' % (m.group(1),str(m.group(3))))
-                        statements.append(UseStatement(m.group(1),pipeline_file,lineno,alias))
-                    else:
-                        m = prefix_pattern.match(cur_line)
-                        if m:
-                            prefix_type = m.group(1)
-                            prefix = m.group(2)
-
-                            if prefix:
-                                prefix = prefix.strip()
-                                if len(prefix) == 0:
-                                    prefix = None
-
-                            logger.debug('found prefix: %s, %s' % (prefix_type,prefix))
-                            statements.append(PrefixStatement(prefix_type,prefix,pipeline_file,lineno))
-                        else:
-                            if len(cur_line) == 0 or cur_line.startswith('#'):
-                                pass
-                            else:
-                                in_preamble = False
-
-        if in_preamble:
-            lineno += 1
-            
     # read the tasks
-    task_pattern = re.compile('^(\*?)(%s)(\.%s)?\s*:(.*)$' % (VAR_PATTERN,LANG_SUFFIX_PATTERN))
     tasks = []
     in_comment_block = False
 
@@ -785,249 +1457,262 @@ def parse_pipeline(pipeline_file,default_prefix):
         elif cur_line.startswith('###'):
             lineno += 1
             in_comment_block = True
-        elif len(cur_line) == 0 or cur_line.strip().startswith('#'):
+        elif len(cur_line) == 0 or cur_line.lstrip().startswith('#'):
             lineno += 1
         else:
-            m = task_pattern.match(cur_line)
-            if m:
-                is_markable = m.group(1) == ''
-                task_name = m.group(2)
-                lang_suffix = m.group(3)
-                dep_str = m.group(4)
-
-                # drop the leading period from the language suffix, if it exists
-                if lang_suffix != None:
-                    lang_suffix = lang_suffix[1:]
-                else:
-                    lang_suffix = ''
+            lineno,task = parse_task(lines,pipeline_file,lineno)
+            tasks.append(task)
+
+    return statements,tasks
 
-                logger.debug('parsing task: %s (LANG=%s)' % (task_name,lang_suffix))
+def parse_preamble(lines,pipeline_file):
+    """
+    Parse the statements at the top of the pipeline file.
 
-                lineno,task = parse_task(task_name,is_markable,lang_suffix,dep_str,lines,pipeline_file,lineno)
+    Return (lineno of the first task,statements)
+    """
+    statements = []
+    in_comment_block = False
 
-                tasks.append(task)
+    lineno = 0
+    while lineno < len(lines):
+        cur_line = lines[lineno].strip()
+
+        if in_comment_block:
+            if cur_line.startswith('###'):
+                in_comment_block = False
+        elif cur_line.startswith('###'):
+            in_comment_block = True
+        elif len(cur_line) == 0 or cur_line.startswith('#'):
+            pass
+        else:
+            m = PREAMBLE_PATTERN.match(cur_line)
+            if m is None:
+                # the tasks start here
+                break
+
+            if m.group('extend') is not None:
+                complete_fname = os.path.join(os.path.dirname(pipeline_file),m.group('extend'))
+                statements.append(ExtendStatement(complete_fname,pipeline_file,lineno))
+            elif m.group('assign') is not None:
+                logger.debug('found variable assignment: %s,%s' % (m.group('assign'),m.group('value')))
+                statements.append(VariableAssignment(m.group('assign'),m.group('value'),pipeline_file,lineno))
+            elif m.group('unset') is not None:
+                logger.debug('found delete variable: %s' % m.group('unset'))
+                statements.append(DeleteVariable(m.group('unset'),pipeline_file,lineno))
+            elif m.group('use') is not None:
+                logger.debug('found use: %s,%s' % (m.group('use'),str(m.group('alias'))))
+                statements.append(UseStatement(m.group('use'),pipeline_file,lineno,m.group('alias')))
             else:
-                raise ParseException(pipeline_file,lineno,'expected a task definition, got: %s' % cur_line)
+                prefix_type = m.group('prefix_type')
+                prefix = m.group('prefix')
 
-    # make the pipeline
-    pipeline = Pipeline(pipeline_file,statements,tasks,default_prefix=default_prefix)
+                if prefix:
+                    prefix = prefix.strip()
+                    if len(prefix) == 0:
+                        prefix = None
 
-    # return the pipeline
-    return pipeline
+                logger.debug('found prefix: %s, %s' % (prefix_type,prefix))
+                statements.append(PrefixStatement(prefix_type,prefix,pipeline_file,lineno))
+
+        lineno += 1
+
+    return lineno,statements
+
+def get_indentation(line):
+    """
+    Return the whitespace that the line starts with or None if the line is
+    blank.
+    """
+    content = line.lstrip()
+    if len(content) == 0:
+        return None
+
+    return line[:len(line)-len(content)]
 
-def find_indentation_match(lines,lineno,pattern):
+def next_indentation(lines,lineno):
     """
-    Find the first line that matches the specified pattern and isn't an empty line
-    Return None if there aren't any lines found.
+    Return the indentation of the first non-blank line at or after lineno or
+    None if there are no more lines.
     """
     while lineno < len(lines):
-        if len(lines[lineno].strip()) == 0:
-            lineno += 1
-        else:
-            return pattern.match(lines[lineno])
-    
-    # if we got here, we ran out of lines
+        indent = get_indentation(lines[lineno])
+        if indent is not None:
+            return indent
+        lineno += 1
+
     return None
 
-def parse_task(task_name,is_markable,lang_suffix,dep_str,lines,pipeline_file,lineno):
+def parse_task(lines,pipeline_file,lineno):
     """
-    Parse the task.
-
-    task_name is the name of the task
-    is_markable is False if the task cannot be marked by running it
-    lang_suffix is the suffix given with the task. For multi-block tasks, this will be
-      the empty string.  For simple tasks, this will be a suffix resolving to one of 
-      the supported code block types.
-    dep_str is the dependency string on the task definition line
-    lineno is the line number where the task definition starts - on which the
-    task_name and dependencies string appears.
-
-    Raise exception if the task was invalid otherwise, 
+    Parse the task that starts on the given line.
+
+    Raise ParseException if the task is invalid, otherwise
     return (next_lineno,Task)
     """
+    cur_line = lines[lineno].rstrip()
+    m = TASK_PATTERN.match(cur_line)
+    if m is None:
+        raise ParseException(pipeline_file,lineno,'expected a task definition, got: %s' % cur_line)
 
-    start_lineno = lineno
-
-    ####
-    # parse the dependency list
-    live_deps_string = re.compile('^([^#]*)')
-    valid_dep_string = re.compile('^%s(\.%s)?$' % (VAR_PATTERN,VAR_PATTERN))
+    is_markable = m.group(1) == ''
+    task_name = m.group(2)
+    lang_suffix = m.group(3)[1:] if m.group(3) is not None else ''
 
-    # drop any comment end part
-    m = live_deps_string.match(dep_str)
-    dep_str = m.group(1)
+    logger.debug('parsing task: %s (LANG=%s)' % (task_name,lang_suffix))
 
-    # extract the dependencies
-    dependencies = dep_str.split()
-    
+    # the dependencies end at any comment
+    dependencies = m.group(4).split()
     for dep in dependencies:
-        if valid_dep_string.match(dep) is None:
+        if DEPENDENCY_PATTERN.match(dep) is None:
             raise ParseException(pipeline_file,lineno,'expected a dependency, got: %s' % dep)
 
+    start_lineno = lineno
     lineno += 1
 
-    # prepare to load the blocks
     task_props = {}
     blocks = []
 
-    # if we have a lang suffix, load the implicit block
     if lang_suffix != '':
+        # a simple task is a single implicit block
         logger.debug('loading a simple task')
-        
+
         block_lineno = lineno
         lineno,content,content_linenos = read_block_content(lines,lineno,NO_INDENT)
-        
+
         blocks.append(CodeBlock(lang_suffix,'',content,pipeline_file,block_lineno))
     else:
-        # otherwise, load all the contents
         lineno,task_props,blocks = read_task_contents(lines,pipeline_file,lineno)
 
     return lineno,Task(task_name,is_markable,dependencies,task_props,blocks,pipeline_file,start_lineno)
 
 def read_task_contents(lines,pipeline_file,lineno):
-    #####
-    # setup the patterns for parsing the task contents
-    indention_pattern = re.compile('^(\s+)[^\s]')
-    var_assignment_pattern = re.compile('^(%s)\s*=(.*)$' % VAR_PATTERN)
-    delete_var_pattern = re.compile('^unset\s+(%s)$' % VAR_PATTERN)
-    
-    # these patterns need to be initialized once we know the indentation sequence
-    code_pattern = None 
-    export_pattern = None 
-    property_pattern = None
+    """
+    Read the properties and blocks of a task, which are all indented by the
+    indentation of the first line after the task definition.
 
-    #####
-    # load the content
+    Return (next_lineno,properties,blocks)
+    """
     task_props = {}
     blocks = []
-    in_task = True    
-    in_comment_block = False
 
-    im = find_indentation_match(lines,lineno,indention_pattern) 
-    logger.debug('match = %s' % im)
-    indent_seq = None
-    if im is not None:
-        # there's valid content
-        indent_seq = im.group(1)
-        logger.debug('indent_seq len = %d' % len(indent_seq))
-        code_pattern = re.compile('^%scode\.(\w+):(.*)$' % indent_seq)
-        export_pattern = re.compile('^%sexport:(.*)$' % indent_seq)
-        property_pattern = re.compile('^%s@([^\s]+)\s+(.*)$' % indent_seq)
-    else:
-        in_task = False
+    indent_seq = next_indentation(lines,lineno)
+    if indent_seq is None or len(indent_seq) == 0:
+        # the task has no content
+        return lineno,task_props,blocks
+
+    indent_len = len(indent_seq)
+    comment_end = indent_seq + '###'
+    in_comment_block = False
 
-    while lineno < len(lines) and in_task:
+    while lineno < len(lines):
         cur_line = lines[lineno].rstrip()
 
         if in_comment_block:
             if not cur_line.startswith(indent_seq):
                 raise ParseException(pipeline_file,lineno,'all lines in a comment block must be indented')
             lineno += 1
-            if cur_line.rstrip() == ('%s###' % indent_seq):
+            if cur_line == comment_end:
                 in_comment_block = False
             continue
 
-        mc = code_pattern.match(cur_line)
-        me = export_pattern.match(cur_line)
-        mp = property_pattern.match(cur_line)
-
-        if cur_line.startswith('%s###' % indent_seq):
-            # we're starting a multi-line comment block
-            in_comment_block = True
+        if len(cur_line) == 0 or len(cur_line.strip()) == 0:
             lineno += 1
-        if cur_line.startswith('%s#' % indent_seq) or len(cur_line.strip()) == 0:
+            continue
+        elif not cur_line.startswith(indent_seq):
+            # the task is over
+            break
+
+        content = cur_line[indent_len:]
+        if content.startswith('#'):
+            # a comment, which may start a multi-line comment block
+            in_comment_block = content.startswith('###')
             lineno += 1
-        elif mc: ### code block starts here
-            lang = mc.group(1)
-            arg_str = mc.group(2)
+            continue
+
+        m = TASK_CONTENT_PATTERN.match(content)
+        if m is None:
+            break
+        elif m.group('lang') is not None:
             logger.debug('found code block at line %d' % lineno)
             block_lineno = lineno
-            lineno,content,content_linenos = read_block_content(lines,lineno+1,indent_seq)
+            lineno,block_content,content_linenos = read_block_content(lines,lineno+1,indent_seq)
 
-            blocks.append(CodeBlock(lang,arg_str,content,pipeline_file,block_lineno))
-        elif me: ### export block starts here
-            arg_str = me.group(1).strip()
+            blocks.append(CodeBlock(m.group('lang'),m.group('arg_str'),block_content,pipeline_file,block_lineno))
+        elif m.group('export_arg_str') is not None:
             logger.debug('found export block at line %d' % lineno)
-            export_lineno = lineno
-
-            if len(arg_str) > 0:
+            if len(m.group('export_arg_str').strip()) > 0:
                 raise ParseException(pipeline_file,lineno,
                     'export block does not accept an argument string')
 
-            new_lineno,content,content_linenos = read_block_content(lines,lineno+1,indent_seq)
-            
+            export_lineno = lineno
+            lineno,block_content,content_linenos = read_block_content(lines,lineno+1,indent_seq)
+
             # parse the content as variable assignments
             statements = []
-            for ln,line in zip(content_linenos,content):
-                line = line.rstrip()
-                ma = var_assignment_pattern.match(line)
-                md = delete_var_pattern.match(line)
-                if ma:
-                    statements.append(VariableAssignment(ma.group(1),ma.group(2),
-                                                        pipeline_file,ln))
-                elif md:
-                    statements.append(DeleteVariable(ma.group(1),pipeline_file,ln))
-                elif len(line) == 0:
-                    pass
-                else:
+            for ln,line in zip(content_linenos,block_content):
+                if len(line) == 0:
+                    continue
+
+                ms = EXPORT_STMT_PATTERN.match(line)
+                if ms is None:
                     raise ParseException(pipeline_file,ln,
                             'expected a variable assignment, got: %s' % line)
+                elif ms.group('assign') is not None:
+                    statements.append(VariableAssignment(ms.group('assign'),ms.group('value'),pipeline_file,ln))
+                else:
+                    statements.append(DeleteVariable(ms.group('unset'),pipeline_file,ln))
 
             blocks.append(ExportBlock(statements,pipeline_file,export_lineno))
-            lineno = new_lineno
-        elif mp: ### task property line
+        else:
             logger.debug('found task property at line %d' % lineno)
-            prop_name = mp.group(1)
-            prop_value = mp.group(2)
-            logger.debug('property "%s" = %s' % (prop_name,prop_value))
-            task_props[prop_name] = prop_value
+            logger.debug('property "%s" = %s' % (m.group('prop_name'),m.group('prop_value')))
+            task_props[m.group('prop_name')] = m.group('prop_value')
 
             lineno += 1
-        else:
-            in_task = False    
 
     return lineno,task_props,blocks
 
-
 def read_block_content(lines,lineno,indent_seq):
     """
-    Extract block content - begins with indent_seq + whatever the new intentation is
+    Extract block content - the lines starting at lineno that are indented
+    further than indent_seq (as far as the first of them is).  Blank lines
+    belong to the block.
 
     Return: (next_lineno,content,content_linenos)
     """
-    indentation_pattern = re.compile('^(%s\s+)[^\s]' % indent_seq)
-
-    im = find_indentation_match(lines,lineno,indentation_pattern)
-    inner_indent_seq = None
-    if im is not None:
-        inner_indent_seq = im.group(1)
-    else:
+    inner_indent_seq = next_indentation(lines,lineno)
+    if inner_indent_seq is None or len(inner_indent_seq) <= len(indent_seq) or \
+       not inner_indent_seq.startswith(indent_seq):
         # there's no content in this block
-        return lineno, [], []
+        return lineno,[],[]
 
-    last_lineno = lineno
-    content_lines = []
+    il = len(inner_indent_seq)
+    content = []
     content_linenos = []
-    while last_lineno < len(lines):
-        if lines[last_lineno].startswith(inner_indent_seq):
-            content_lines.append(lines[last_lineno])
-            content_linenos.append(last_lineno)
-        elif len(lines[last_lineno].strip()) == 0:
-            # empty lines should be added to the block
-            content_lines.append(inner_indent_seq)
-            content_linenos.append(last_lineno)
+    while lineno < len(lines):
+        line = lines[lineno]
+        if line.startswith(inner_indent_seq):
+            content.append(line[il:].rstrip())
+        elif len(line.strip()) == 0:
+            content.append('')
         else:
             break
-        last_lineno += 1
-    
-    il = len(inner_indent_seq)
-    return last_lineno,[x[il:].rstrip() for x in content_lines],content_linenos
+
+        content_linenos.append(lineno)
+        lineno += 1
+
+    return lineno,content,content_linenos
 
 variable_pattern = re.compile('([\w\d_]+)|(\{([\w\d]+\.)?[\w\d_]+?\})')
 SUPPORTED_BUILTIN_FUNCTIONS = ['','PLN']
 SUPPORTED_ESCAPABLE_CHARACTERS = ['$','\\']
 
-def expand_variables(x,context,cwd,pipelines,source_file,lineno,nested=False):
+# the characters that end a run of literal text in a template
+SPECIAL_CHAR_PATTERN = re.compile('[\\\\$]')
+NESTED_SPECIAL_CHAR_PATTERN = re.compile('[\\\\$)]')
+
+def expand_variables(x,context,cwd,pipelines,source_file,lineno):
     """
     This function will both parse variables in the 
     string (assumed to be one line of text) and replace them
@@ -1036,151 +1721,210 @@ def expand_variables(x,context,cwd,pipelines,source_file,lineno,nested=False):
     ParseException is raised if syntax is bad.
     UnknownVariableException is raised if variables or functions can't be resolved.
     """
-    
-    cpos = 0
-    
+    return compile_template(x,source_file,lineno).expand(context,cwd,pipelines)
+
+def compile_template(x,source_file,lineno):
+    """
+    Parse the variable references, functions and escapes in the string
+    (assumed to be one line of text) into a Template.
+
+    ParseException is raised if syntax is bad.
+    UnknownVariableException is raised if a function is unknown.
+    """
+    segments,end = compile_segments(x,0,source_file,lineno,False)
+    return Template(segments,source_file,lineno)
+
+def compile_segments(x,cpos,source_file,lineno,nested):
+    """
+    Compile x, starting at cpos, into a list of segments (see Template).  If
+    nested, compilation stops at the ")" that closes the function being
+    compiled.
+
+    Return (segments,position of the end)
+    """
+    special_pattern = NESTED_SPECIAL_CHAR_PATTERN if nested else SPECIAL_CHAR_PATTERN
+
+    segments = []
+    literal = []
     while cpos < len(x):
-        
+        m = special_pattern.search(x,cpos)
+        if m is None:
+            literal.append(x[cpos:])
+            cpos = len(x)
+            break
+
+        literal.append(x[cpos:m.start()])
+        cpos = m.start()
+        c = x[cpos]
+
         # handle escaping special character
-        if x[cpos] == '\\':
+        if c == '\\':
             if cpos == len(x)-1:
                 raise ParseException(source_file,lineno,'incomplete escape sequence at EOL')
 
             c = x[cpos+1]
-            
             if c not in SUPPORTED_ESCAPABLE_CHARACTERS:
                 raise ParseException(source_file,lineno,'invalid escape sequence \\%s' % c)
-            replacement = c
-            pre_escape = x[:cpos]
-            post_escape = x[(cpos+2):]
-            x = pre_escape + replacement + post_escape
-            cpos = cpos+2
-            
-        elif x[cpos] == '$':
+
+            literal.append(c)
+            cpos += 2
+
+        elif c == ')':
+            # We just found the end of a function (which we're nested inside of)
+            break
+
+        else:
             # variable started!
             if cpos == len(x)-1:
                 raise ParseException(source_file,lineno,'incomplete variable reference')
 
             # get the variable name
-            m = variable_pattern.match(x[(cpos+1):])
+            m = variable_pattern.match(x,cpos+1)
             if m is None:
                 # check if this is a shell call
-                if cpos < len(x)-1 and x[cpos+1] == '(':
+                if x[cpos+1] == '(':
                     varname = ''
+                    name_end = cpos+1
                 else:
                     raise ParseException(source_file,lineno,'invalid variable reference')
             else:
-                varname = None
-                
-                # this is a curly-brace-delimited variable
-                if m.group(1) is None:
-                    varname = m.group(2)
-
-                    # remove curly braces
-                    varname = varname[1:-1]
-                        
-                    # remove the curlies from the string x
-                    x = x[:(cpos+1)] + varname + x[(cpos+len(varname)+3):]
-                else: # not delimited by curly braces
-                    varname = m.group(1)
+                # a curly-brace-delimited variable loses its curly braces
+                varname = m.group(1) if m.group(1) is not None else m.group(2)[1:-1]
+                name_end = m.end()
+
+            if len(literal) > 0:
+                segments.append(''.join(literal))
+                literal = []
 
             # if this variable reference is actually a function
-            fxn_paren_pos = cpos+1+len(varname)
-            if fxn_paren_pos < (len(x)-1) and x[fxn_paren_pos] == '(':
-                fxn_argstart_pos = fxn_paren_pos + 1
+            if name_end < len(x)-1 and x[name_end] == '(':
                 # we only support two functions
                 if varname not in SUPPORTED_BUILTIN_FUNCTIONS:
                     raise UnknownVariableException(source_file,lineno,'invalid builtin function name: %s' % varname)
 
-                # process the rest of the string
-                expanded_x_part,eofxn = expand_variables(x[fxn_argstart_pos:],context,cwd,pipelines,source_file,lineno,nested=True)
-
-                x = x[:fxn_argstart_pos] + expanded_x_part
-                eofxn = fxn_argstart_pos + eofxn
+                # the arguments end at the matching parenthesis
+                arg_segments,eofxn = compile_segments(x,name_end+1,source_file,lineno,True)
+                segments.append((FUNCTION_SEGMENT,varname,Template(arg_segments,source_file,lineno)))
+                cpos = eofxn + 1
+            else:
+                # figure out which pipeline the variable belongs to
+                pln_name = None
+                if '.' in varname:
+                    pln_name, varname = varname.split('.')
 
-                # extract arguments
-                args_str = x[fxn_argstart_pos:eofxn]
-                args = [x.strip() for x in args_str.split(',')]
-                logger.debug('got fxn args: %s' % str(args))
+                segments.append((VARIABLE_SEGMENT,pln_name,varname))
+                cpos = name_end
 
-                # apply the function
-                ret_val = ''
-                if varname == '':
-                    ret_val = subprocess.check_output(args_str,shell=True,cwd=cwd,
-                                                      env=get_total_context(context))
+    # under normal circumstances, reaching the end of the string is what we want.
+    # but if we are nested, then we should find a parenthesis first.
+    if nested and cpos >= len(x):
+        raise ParseException(source_file,lineno,'expected to find a ")", none found')
 
-                    # convert the bytes into a string
-                    ret_val = ret_val.decode()
+    if len(literal) > 0:
+        segments.append(''.join(literal))
 
-                    if ret_val[-1] == '\n':
-                        ret_val = ret_val[:-1]
+    return segments,cpos
 
-                    logger.debug('expanded shell fxn to: %s' % ret_val)
+# the kinds of segments in a template, besides literal text
+VARIABLE_SEGMENT = 'var'
+FUNCTION_SEGMENT = 'fxn'
 
-                    if '\n' in ret_val:
-                        raise Exception('inline shell functions cannot return strings containing newlines: %s' % ret_val)
+class Template:
+    """
+    A line of text with its variable references and functions parsed, so that
+    it can be expanded repeatedly without parsing it again.
 
-                elif varname == 'PLN':
-                    prefix = None
+    segments is a list of:
+      - strings, which are literal text
+      - (VARIABLE_SEGMENT,pipeline alias or None,varname)
+      - (FUNCTION_SEGMENT,function name,Template of the arguments)
+    """
+    def __init__(self,segments,source_file,lineno):
+        self.segments = segments
+        self.source_file = source_file
+        self.lineno = lineno
 
-                    if len(args) == 1:
-                        prefix = context[PIPELINE_PREFIX_VARNAME]
-                        fname = args[0]
-                    elif len(args) == 2:
-                        pln_name = args[0]
-                        
-                        if pln_name not in pipelines:
-                            raise Exception('unable to find pipeline with alias "%s"' % pln_name)
+        # most lines have nothing to expand
+        if len(segments) == 0:
+            self.text = ''
+        elif len(segments) == 1 and isinstance(segments[0],str):
+            self.text = segments[0]
+        else:
+            self.text = None
 
-                        prefix = pipelines[pln_name].get_prefix()
-                        logger.debug('PLN reference got prefix = %s' % prefix)
-                        fname = args[1]
-                    else:
-                        # TODO: Add line number
-                        raise Exception('too many arguments for $PLN(...) fxn')
+    def expand(self,context,cwd,pipelines):
+        """
+        Return the text with all variables and functions replaced by their
+        values in this context.
 
-                    ret_val = '%s%s' % (prefix,fname)
+        UnknownVariableException is raised if variables can't be resolved.
+        """
+        if self.text is not None:
+            return self.text
+
+        parts = []
+        for segment in self.segments:
+            if isinstance(segment,str):
+                parts.append(segment)
+            elif segment[0] == VARIABLE_SEGMENT:
+                parts.append(self.lookup_variable(segment[1],segment[2],context,pipelines))
+            else:
+                parts.append(self.apply_function(segment[1],segment[2],context,cwd,pipelines))
 
-                # make the replacement
-                pre_fxn = x[:cpos]
-                post_fxn = x[(eofxn+1):]
-                x = pre_fxn + ret_val + post_fxn
-                cpos = len(pre_fxn) + len(ret_val)
+        return ''.join(parts)
 
+    def lookup_variable(self,pln_name,varname,context,pipelines):
+        # figure out which context to use
+        var_context = context
+        if pln_name is not None:
+            if pln_name not in pipelines:
+                raise UnknownVariableException(self.source_file,self.lineno,'pipeline %s is unknown' % pln_name)
             else:
-                replacement = ''
+                var_context = pipelines[pln_name].get_context()
 
-                # figure out which context to use
-                var_context = context
-                if '.' in varname:
-                    pln_name, varname = varname.split('.')
+        if varname not in var_context:
+            raise UnknownVariableException(self.source_file,self.lineno,'variable %s does not exist' % varname)
 
-                    if pln_name not in pipelines:
-                        raise UnknownVariableException(source_file,lineno,'pipeline %s is unknown' % pln_name)
-                    else:
-                        var_context = pipelines[pln_name].get_context()
+        return var_context[varname]
 
-                if varname not in var_context:
-                    raise UnknownVariableException(source_file,lineno,'variable %s does not exist' % varname)
+    def apply_function(self,fxn_name,arg_template,context,cwd,pipelines):
+        # extract arguments
+        args_str = arg_template.expand(context,cwd,pipelines)
+        args = [x.strip() for x in args_str.split(',')]
+        logger.debug('got fxn args: %s' % str(args))
 
-                replacement = var_context[varname]    
-    
-                # make the replacement
-                pre_var = x[:cpos]
-                post_var = x[(cpos+1+len(varname)):]
-                x = pre_var + replacement + post_var
-                cpos = cpos+1+len(replacement)
-        
-        elif nested and x[cpos] == ')':
-            # We just found the end of a function (which we're nested inside of)
-            return x,cpos
+        ret_val = ''
+        if fxn_name == '':
+            # the output is remembered for the rest of the run (see xp.shell_memo)
+            ret_val = run_shell_function(args_str,cwd,context)
 
-        else:
-            cpos += 1
+            if ret_val.endswith('\n'):
+                ret_val = ret_val[:-1]
 
-    # under normal circumstances, reaching the end of the string is what we want.
-    # but if we are nested, then we should find a parenthesis first.
-    if nested:
-        raise ParseException(source_file,lineno,'expected to find a ")", none found')
+            logger.debug('expanded shell fxn to: %s' % ret_val)
+
+            if '\n' in ret_val:
+                raise Exception('inline shell functions cannot return strings containing newlines: %s' % ret_val)
+
+        elif fxn_name == 'PLN':
+            prefix = None
+
+            if len(args) == 1:
+                prefix = context[PIPELINE_PREFIX_VARNAME]
+                fname = args[0]
+            elif len(args) == 2:
+                pln_name = args[0]
+
+                if pln_name not in pipelines:
+                    raise Exception('unable to find pipeline with alias "%s"' % pln_name)
+
+                prefix = pipelines[pln_name].get_prefix()
+                logger.debug('PLN reference got prefix = %s' % prefix)
+                fname = args[1]
+            else:
+                # TODO: Add line number
+                raise Exception('too many arguments for $PLN(...) fxn')
+
+            ret_val = '%s%s' % (prefix,fname)
 
-    return x
+        return ret_val
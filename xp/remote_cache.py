@@ -0,0 +1,346 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+A remote cache of task outputs shared over HTTP, so that a task computed on
+one machine is downloaded rather than recomputed on the next.
+
+The protocol is deliberately simple.  Each entry of the local artifact cache
+(see xp.cache) is sent as a gzip-compressed tar archive of its directory:
+
+    GET  <remote_url>/<fingerprint>   200 with the archive, or 404
+    HEAD <remote_url>/<fingerprint>   200 if the entry exists, or 404
+    PUT  <remote_url>/<fingerprint>   stores the archive (any 2xx)
+
+Downloads are unpacked into the local cache as they stream in and uploads are
+streamed from a temporary file.  Uploads happen in the background, up to
+remote_transfers at a time, so that a run doesn't wait for them; downloads
+happen when a task needs them (as many at once as tasks are being run).
+
+Any HTTP server that stores bodies by path will do.  This module can also be
+run as one that keeps the entries in a directory:
+
+    python -m xp.remote_cache -d <dir> -p <port>
+"""
+
+import argparse
+import atexit
+import http.client
+import http.server
+import logging
+import os, os.path
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from xp import config
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+FINGERPRINT_PATTERN = re.compile('^[0-9a-f]+$')
+
+CHUNK_SIZE = 2**16
+
+# newer versions of python can vet archive members themselves
+EXTRACT_OPTIONS = {'filter':'data'} if hasattr(tarfile,'data_filter') else {}
+
+_remotes = {}
+_remotes_lock = threading.Lock()
+
+def get_remote_cache():
+    """
+    Return the configured RemoteCache or None if there isn't one.
+    """
+    config_info = config.config_info()
+    url = config_info.get(config.CACHE_SECTION,config.CACHE_REMOTE_URL_OPT).strip()
+    if len(url) == 0:
+        return None
+
+    max_transfers = int(config_info.get(config.CACHE_SECTION,config.CACHE_REMOTE_TRANSFERS_OPT))
+    timeout = float(config_info.get(config.CACHE_SECTION,config.CACHE_REMOTE_TIMEOUT_OPT))
+    upload = config_info.getboolean(config.CACHE_SECTION,config.CACHE_REMOTE_UPLOAD_OPT)
+
+    key = (url,max_transfers,timeout,upload)
+    with _remotes_lock:
+        if key not in _remotes:
+            _remotes[key] = RemoteCache(url,max_transfers,timeout,upload)
+
+        return _remotes[key]
+
+def extract_archive(fh,dest_dir):
+    """
+    Unpack the tar.gz stream into dest_dir, refusing members that would end
+    up outside it.
+    """
+    archive = tarfile.open(fileobj=fh,mode='r|gz')
+    try:
+        for member in archive:
+            path = os.path.realpath(os.path.join(dest_dir,member.name))
+            if not (member.isfile() or member.isdir() or member.issym()) or \
+               os.path.commonpath([path,os.path.realpath(dest_dir)]) != os.path.realpath(dest_dir):
+                raise ValueError('unsafe member in cache archive: %s' % member.name)
+
+            archive.extract(member,dest_dir,**EXTRACT_OPTIONS)
+    finally:
+        archive.close()
+
+class RemoteCacheError(Exception):
+    pass
+
+class RemoteCache:
+    """
+    The client of a remote cache at the given URL.  If upload is False, the
+    cache is only read from.
+    """
+    def __init__(self,url,max_transfers=4,timeout=30,upload=True):
+        parts = urlsplit(url)
+        if parts.scheme not in ['http','https']:
+            raise Exception('unsupported remote cache URL: %s' % url)
+
+        self.url = url
+        self.timeout = timeout
+        self.upload_enabled = upload
+
+        self._scheme = parts.scheme
+        self._netloc = parts.netloc
+        self._base_path = parts.path.rstrip('/')
+
+        self._pool = ThreadPoolExecutor(max_workers=max_transfers)
+        self._pending = set()
+        self._lock = threading.Lock()
+        atexit.register(self.wait)
+
+    def _connect(self):
+        if self._scheme == 'https':
+            return http.client.HTTPSConnection(self._netloc,timeout=self.timeout)
+        else:
+            return http.client.HTTPConnection(self._netloc,timeout=self.timeout)
+
+    def _path(self,fingerprint):
+        return '%s/%s' % (self._base_path,fingerprint)
+
+    def contains(self,fingerprint):
+        conn = self._connect()
+        try:
+            conn.request('HEAD',self._path(fingerprint))
+            response = conn.getresponse()
+            response.read()
+            return response.status == 200
+        finally:
+            conn.close()
+
+    def fetch(self,fingerprint,local_cache):
+        """
+        Download the entry into the local cache.  Return False if the remote
+        cache doesn't have it.
+        """
+        conn = self._connect()
+        try:
+            conn.request('GET',self._path(fingerprint))
+            response = conn.getresponse()
+            if response.status == 404:
+                response.read()
+                return False
+            elif response.status != 200:
+                raise RemoteCacheError('GET %s failed: %d %s' % (fingerprint,response.status,response.reason))
+
+            tmp_dir = local_cache.make_tmp_dir()
+            try:
+                extract_archive(response,tmp_dir)
+                local_cache.add_entry(fingerprint,tmp_dir)
+            finally:
+                shutil.rmtree(tmp_dir,ignore_errors=True)
+        finally:
+            conn.close()
+
+        logger.info('downloaded %s from the remote cache' % fingerprint)
+        return True
+
+    def upload(self,fingerprint,local_cache):
+        """
+        Start uploading the local cache's entry for the fingerprint in the
+        background.  The archive is made right away, so the entry can be
+        evicted from the local cache at any time after this returns.
+        """
+        if not self.upload_enabled or fingerprint not in local_cache:
+            return
+
+        fd,archive_file = tempfile.mkstemp(prefix='.upload-',suffix='.tar.gz',dir=local_cache.cache_dir)
+        try:
+            fh = os.fdopen(fd,'wb')
+            archive = tarfile.open(fileobj=fh,mode='w|gz')
+            entry_dir = local_cache.entry_dir(fingerprint)
+            for name in sorted(os.listdir(entry_dir)):
+                archive.add(os.path.join(entry_dir,name),arcname=name)
+            archive.close()
+            fh.close()
+        except:
+            os.remove(archive_file)
+            raise
+
+        future = self._pool.submit(self._put,fingerprint,archive_file)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._upload_done)
+
+    def _put(self,fingerprint,archive_file):
+        try:
+            if self.contains(fingerprint):
+                logger.debug('%s is already in the remote cache' % fingerprint)
+                return
+
+            conn = self._connect()
+            try:
+                fh = open(archive_file,'rb')
+                conn.request('PUT',self._path(fingerprint),body=fh,
+                             headers={'Content-Length':str(os.path.getsize(archive_file)),
+                                      'Content-Type':'application/gzip'})
+                response = conn.getresponse()
+                response.read()
+                fh.close()
+            finally:
+                conn.close()
+
+            if response.status // 100 != 2:
+                raise RemoteCacheError('PUT %s failed: %d %s' % (fingerprint,response.status,response.reason))
+
+            logger.info('uploaded %s to the remote cache' % fingerprint)
+        finally:
+            os.remove(archive_file)
+
+    def _upload_done(self,future):
+        with self._lock:
+            self._pending.discard(future)
+
+        e = future.exception()
+        if e is not None:
+            logger.warn('unable to upload to the remote cache: %s' % e)
+
+    def wait(self):
+        """
+        Wait for all the uploads that have been started to finish.
+        """
+        with self._lock:
+            pending = list(self._pending)
+
+        for future in pending:
+            try:
+                future.result()
+            except Exception:
+                # reported by _upload_done
+                pass
+
+########
+# A stand-in server that keeps the entries in a directory
+########
+class CacheRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def _entry_file(self):
+        fingerprint = self.path.rstrip('/').rsplit('/',1)[-1]
+        if not FINGERPRINT_PATTERN.match(fingerprint):
+            return None
+
+        return os.path.join(self.server.cache_dir,fingerprint[:2],fingerprint)
+
+    def do_HEAD(self):
+        self._get(send_body=False)
+
+    def do_GET(self):
+        self._get(send_body=True)
+
+    def _get(self,send_body):
+        entry_file = self._entry_file()
+        if entry_file is None or not os.path.exists(entry_file):
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type','application/gzip')
+        self.send_header('Content-Length',str(os.path.getsize(entry_file)))
+        self.end_headers()
+
+        if send_body:
+            fh = open(entry_file,'rb')
+            shutil.copyfileobj(fh,self.wfile,CHUNK_SIZE)
+            fh.close()
+
+    def do_PUT(self):
+        entry_file = self._entry_file()
+        if entry_file is None or 'Content-Length' not in self.headers:
+            self.send_error(400)
+            return
+
+        os.makedirs(os.path.dirname(entry_file),exist_ok=True)
+        fd,tmp_file = tempfile.mkstemp(dir=os.path.dirname(entry_file))
+        try:
+            fh = os.fdopen(fd,'wb')
+            remaining = int(self.headers['Content-Length'])
+            while remaining > 0:
+                chunk = self.rfile.read(min(CHUNK_SIZE,remaining))
+                if len(chunk) == 0:
+                    raise OSError('connection closed during upload')
+                fh.write(chunk)
+                remaining -= len(chunk)
+            fh.close()
+
+            os.replace(tmp_file,entry_file)
+        except:
+            os.remove(tmp_file)
+            raise
+
+        self.send_response(201)
+        self.send_header('Content-Length','0')
+        self.end_headers()
+
+    def log_message(self,format,*args):
+        logger.debug(format % args)
+
+def make_server(cache_dir,port=0,host='localhost'):
+    """
+    Return an HTTP server that keeps remote cache entries in cache_dir.  A
+    port of 0 picks a free port (see server.server_address).
+    """
+    os.makedirs(cache_dir,exist_ok=True)
+
+    server = http.server.ThreadingHTTPServer((host,port),CacheRequestHandler)
+    server.cache_dir = cache_dir
+    return server
+
+def main():
+    parser = argparse.ArgumentParser('xp.remote_cache',description='serve a remote cache of xp task outputs')
+    parser.add_argument('-d','--dir',required=True,help='the directory to keep the entries in')
+    parser.add_argument('-p','--port',type=int,default=8080,help='the port to listen on (default: %(default)s)')
+    parser.add_argument('--host',default='localhost',help='the address to listen on (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,format='%(levelname)s: %(message)s')
+
+    server = make_server(args.dir,args.port,args.host)
+    logger.info('serving %s on %s:%d' % (args.dir,*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+"""
+Copyright 2016 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+This module contains the scheduler that runs the tasks of a pipeline
+concurrently while respecting their dependencies.
+"""
+
+import os.path
+import logging
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from xp.pipeline import FORCE_NONE, TasksFailed, build_plan, check_task, get_plan_mark_stamps, get_critical_path_lengths
+from xp.marks import use_fingerprints
+from xp.kernel_loader import KernelLoader
+from xp.executor_loader import ExecutorLoader
+from xp import config
+from xp.config import parse_amount
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+# The ways in which tasks can be executed
+ENGINE_THREADS = 'threads'
+ENGINE_ASYNCIO = 'asyncio'
+ENGINE_CHOICES = [ENGINE_THREADS,ENGINE_ASYNCIO]
+
+# The resources a task can declare using task properties (e.g., @mem 4G) and
+# the amount a task uses if it doesn't declare anything (undeclared tasks are
+# only limited by the number of jobs).
+RESOURCE_NAMES = [config.CPUS_OPT,config.MEM_OPT,config.IO_OPT]
+DEFAULT_DEMAND = {config.CPUS_OPT:0, config.MEM_OPT:0, config.IO_OPT:0}
+
+# The duration (in seconds) assumed for tasks when no task in the run has
+# been timed before
+DEFAULT_DURATION = 1.0
+
+# How many times smaller tasks can go ahead of the highest priority task when
+# it doesn't fit into the remaining resources.  After that, no other task is
+# started until enough resources have been freed up for it.
+MAX_SKIPS = 3
+
+# the number of runs in progress that execute several tasks at the same time
+_num_parallel_runs = 0
+_parallel_runs_lock = threading.Lock()
+
+def is_running_in_parallel():
+    """
+    Return True if blocks may currently be run by several threads of this
+    process at once.  Kernels that change process-wide state (e.g., the
+    working directory) must not do so while this is the case.
+    """
+    return _num_parallel_runs > 0
+
+def _count_parallel_run(delta):
+    global _num_parallel_runs
+    with _parallel_runs_lock:
+        _num_parallel_runs += delta
+
+def get_resource_budget():
+    """
+    Return the resources available on this host, as configured in the
+    Resources section of the configuration.  A budget of 0 means unlimited.
+    """
+    config_info = config.config_info()
+
+    budget = {}
+    for rname in RESOURCE_NAMES:
+        budget[rname] = parse_amount(config_info.get(config.RESOURCES_SECTION,rname))
+
+    return budget
+
+def get_task_demand(task):
+    """
+    Return the resources the task has declared it will use.
+    """
+    demand = dict(DEFAULT_DEMAND)
+    props = task.properties()
+    for rname in RESOURCE_NAMES:
+        if rname in props:
+            try:
+                demand[rname] = parse_amount(props[rname])
+            except ValueError:
+                raise ValueError('task %s: invalid value for @%s: %s' % (task.name,rname,props[rname]))
+
+    return demand
+
+def get_task_priorities(tasks):
+    """
+    Return a dictionary mapping each task to its priority: the expected time
+    from when it starts until the end of the longest chain of tasks that
+    depend on it.  Tasks that have never been run are assumed to take as long
+    as the average task that has.
+    """
+    durations = {t:t.expected_duration() for t in tasks}
+
+    known = [d for d in durations.values() if d is not None]
+    default_duration = sum(known) / len(known) if len(known) > 0 else DEFAULT_DURATION
+    for t,d in durations.items():
+        if d is None:
+            durations[t] = default_duration
+
+    return get_critical_path_lengths(tasks,durations)
+
+class ResourcePool:
+    """
+    Keeps track of how much of the host's resource budget is in use.
+    """
+    def __init__(self,budget):
+        self.budget = dict(budget)
+        self.in_use = {r:0 for r in self.budget}
+        self.num_holders = 0
+
+    def exceeds_budget(self,demand):
+        """
+        Return True if the demand can never be satisfied by this pool.
+        """
+        for r,amount in demand.items():
+            if self.budget.get(r,0) > 0 and amount > self.budget[r]:
+                return True
+
+        return False
+
+    def can_acquire(self,demand):
+        # a demand that is too big to ever fit is allowed to run on its own
+        if self.exceeds_budget(demand):
+            return self.num_holders == 0
+
+        for r,amount in demand.items():
+            if self.budget.get(r,0) > 0 and self.in_use[r] + amount > self.budget[r]:
+                return False
+
+        return True
+
+    def acquire(self,demand):
+        for r,amount in demand.items():
+            if r in self.in_use:
+                self.in_use[r] += amount
+        self.num_holders += 1
+
+    def release(self,demand):
+        for r,amount in demand.items():
+            if r in self.in_use:
+                self.in_use[r] -= amount
+        self.num_holders -= 1
+
+        # don't let rounding errors build up
+        if self.num_holders == 0:
+            self.in_use = {r:0 for r in self.budget}
+
+class Scheduler:
+    """
+    Runs a set of tasks (and their dependencies) with up to num_jobs of them
+    executing at the same time.  A task is dispatched as soon as all of its
+    dependencies in the plan are finished and the resources it declares
+    (@cpus, @mem, @io) fit into what remains of the budget.  When several
+    tasks can be dispatched, the ones at the head of the longest remaining
+    chain of tasks (weighted by how long each took last time) go first.
+    Smaller tasks may go ahead of one that doesn't fit yet, but only
+    MAX_SKIPS times, so that large tasks aren't starved.
+
+    The engine determines how tasks are executed: ENGINE_THREADS runs each
+    task in a worker thread, ENGINE_ASYNCIO runs the blocks as subprocesses
+    supervised by a single asyncio event loop (see Kernel.run_async).
+
+    executor is the name of the executor blocks are sent to (unless a task
+    selects one with @executor).  If it is None, the default executor is used.
+
+    If budget is None, the budget is loaded from the configuration.
+
+    By default, the run stops at the first failed task (once the tasks already
+    running have finished) and the task's exception is raised.  If keep_going
+    is True, the tasks downstream of a failed task are blocked, every other task
+    is still run and a TasksFailed is raised at the end.
+    """
+
+    def __init__(self,num_jobs=1,budget=None,engine=ENGINE_THREADS,executor=None,keep_going=False):
+        if num_jobs < 1:
+            raise ValueError('number of jobs must be at least 1, got %d' % num_jobs)
+        if engine not in ENGINE_CHOICES:
+            raise ValueError('unknown execution engine: %s' % engine)
+
+        self.num_jobs = num_jobs
+        self.engine = engine
+        self.executor = executor
+        self.keep_going = keep_going
+
+        if budget is None:
+            budget = get_resource_budget()
+        self.budget = budget
+
+    def run(self,targets,force=FORCE_NONE):
+        """
+        Run the target tasks and their dependencies.
+
+        Return the list of tasks that were actually run, in the order
+        they finished.
+        """
+        plan = build_plan(targets,force)
+
+        for task in plan:
+            if task.pipeline.is_abstract:
+                raise Exception('an abstract pipeline cannot be run: %s' % task.pipeline.abs_filename)
+
+        # make sure the kernels and executors are loaded before any workers need them
+        KernelLoader.singleton()
+        ExecutorLoader.singleton()
+
+        # the fingerprints of the tasks, if they decide staleness
+        fingerprints = {} if use_fingerprints() else None
+        get_fingerprint = lambda task: fingerprints.get(task) if fingerprints is not None else None
+
+        parallel = self.num_jobs > 1
+        if parallel:
+            _count_parallel_run(1)
+
+        try:
+            if self.engine == ENGINE_THREADS:
+                with ThreadPoolExecutor(max_workers=self.num_jobs) as pool:
+                    start_task = lambda task: asyncio.get_running_loop().run_in_executor(pool,task.execute,self.executor,get_fingerprint(task),not plan[task])
+                    return asyncio.run(self._run_plan(plan,start_task,fingerprints))
+            else:
+                start_task = lambda task: asyncio.ensure_future(task.execute_async(self.executor,get_fingerprint(task),not plan[task]))
+                return asyncio.run(self._run_plan(plan,start_task,fingerprints))
+        finally:
+            if parallel:
+                _count_parallel_run(-1)
+
+    async def _run_plan(self,plan,start_task,fingerprints=None):
+        """
+        Run the tasks in the plan.  start_task(task) must return an asyncio
+        future that completes when the task has been executed.  fingerprints
+        is passed to check_task(...).
+        """
+        # link up the tasks in the plan
+        waiting_on = {}
+        dependents = {t:[] for t in plan}
+        for task in plan:
+            deps = set([d for d in task.get_deps() if d in plan])
+            waiting_on[task] = deps
+            for d in deps:
+                dependents[d].append(task)
+
+        # check the resource declarations up front
+        resources = ResourcePool(self.budget)
+        demands = {}
+        for task in plan:
+            demands[task] = get_task_demand(task)
+            if resources.exceeds_budget(demands[task]):
+                logger.warn('task %s needs more resources than are available, it will be run alone' % task.name)
+
+        priorities = get_task_priorities(plan.keys())
+
+        # ready tasks have all their dependencies finished, runnable tasks
+        # are out of date and waiting for a worker and resources to free up
+        ready = [t for t,deps in waiting_on.items() if len(deps) == 0]
+        runnable = []
+        skips = {}
+        running = {}
+        tasks_run = []
+        mark_stamps = get_plan_mark_stamps(plan)
+        failure = None
+        failed = []
+        blocked = []
+
+        while True:
+
+            # decide which of the ready tasks actually need to run
+            while len(ready) > 0 and failure is None:
+                task = ready.pop()
+
+                task.pipeline.pre_run(task)
+
+                reason,_ = check_task(task,plan[task],mark_stamps,fingerprints)
+                if reason is None:
+                    logger.debug('task %s is up to date' % task.name)
+                    ready.extend(self._release(task,waiting_on,dependents))
+                else:
+                    logger.debug('run task %s: %s' % (task.name,reason))
+                    runnable.append(task)
+
+            # the tasks on the critical path go first
+            runnable.sort(key=lambda t: -priorities[t])
+
+            # dispatch as many tasks as we can
+            while len(running) < self.num_jobs and failure is None:
+                task = self._next_admissible(runnable,demands,resources,skips)
+                if task is None:
+                    break
+
+                runnable.remove(task)
+                resources.acquire(demands[task])
+                running[start_task(task)] = task
+
+            if len(running) == 0:
+                break
+
+            # wait for something to finish
+            done,_ = await asyncio.wait(running.keys(),return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                resources.release(demands[task])
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error('task %s failed: %s' % (task.name,e))
+                    if self.keep_going:
+                        failed.append((task,e))
+                        blocked.extend(self._block(task,dependents,blocked))
+                    elif failure is None:
+                        failure = e
+                    continue
+
+                # its mark just changed
+                mark_stamps.pop(task,None)
+                tasks_run.append(task)
+                ready.extend(self._release(task,waiting_on,dependents))
+
+        if failure is not None:
+            raise failure
+        elif len(failed) > 0:
+            raise TasksFailed(tasks_run,failed,blocked)
+
+        return tasks_run
+
+    def _next_admissible(self,runnable,demands,resources,skips):
+        """
+        Return the highest priority runnable task whose resources are available
+        or None.  Smaller tasks are allowed to go ahead of the first task if it
+        doesn't fit yet, which skips records, up to MAX_SKIPS times.  After
+        that, the resources are held back for it.
+        """
+        for task in runnable:
+            if resources.can_acquire(demands[task]):
+                if task is not runnable[0]:
+                    skips[runnable[0]] = skips.get(runnable[0],0) + 1
+                return task
+            elif task is runnable[0] and skips.get(task,0) >= MAX_SKIPS:
+                logger.debug('holding resources back for task %s' % task.name)
+                return None
+
+        return None
+
+    def _block(self,task,dependents,blocked):
+        """
+        Return the tasks downstream of the failed task that haven't been
+        blocked yet.  None of them can have started, since they all
+        (indirectly) depend on the failed task.
+        """
+        newly_blocked = []
+        seen = set(blocked)
+        to_visit = list(dependents[task])
+        while len(to_visit) > 0:
+            t = to_visit.pop()
+            if t in seen:
+                continue
+
+            seen.add(t)
+            newly_blocked.append(t)
+            logger.warn('task %s is blocked by failed task %s' % (t.name,task.name))
+            to_visit.extend(dependents[t])
+
+        return newly_blocked
+
+    def _release(self,task,waiting_on,dependents):
+        """
+        Record that task is finished and return the dependents that are now ready.
+        """
+        now_ready = []
+        for t in dependents[task]:
+            waiting_on[t].discard(task)
+            if len(waiting_on[t]) == 0:
+                now_ready.append(t)
+
+        return now_ready
@@ -0,0 +1,146 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+This module runs inline shell functions ($(...)) and remembers their outputs.
+
+The same function is usually expanded many times in a run: the preamble is
+evaluated when a pipeline is loaded and again when it's run, and a task's
+blocks are expanded both to fingerprint the task and to run it.  A command is
+only run once for each combination of command, working directory and xp
+variables until the run ends (see forget_outputs()).  The rest of the
+environment is the same throughout a run and so isn't considered.
+
+Outputs can also be kept between runs, for a number of seconds:
+
+  - for every function, with the shell_ttl option of the Functions section
+
+  - for one function, by ending its command with a "# ttl=<seconds>" comment,
+    e.g., $(curl -s http://example.com/latest_version # ttl=3600).  The shell
+    ignores the comment.
+
+These outputs are kept in the shell_cache_dir directory, one file per
+function.  Only commands that succeed are remembered.
+"""
+
+import os, os.path
+import hashlib
+import json
+import logging
+import re
+import subprocess
+import tempfile
+import threading
+import time
+
+from xp import config
+from xp.kernels.base import get_total_context
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+TTL_PATTERN = re.compile('#\s*ttl=(\d+)\s*$')
+
+_outputs = {}
+_outputs_lock = threading.Lock()
+
+def forget_outputs():
+    """
+    Forget the outputs remembered during this run.  Outputs kept between runs
+    are unaffected.
+    """
+    with _outputs_lock:
+        _outputs.clear()
+
+def get_ttl(cmd):
+    """
+    Return the number of seconds the output of the command is kept between
+    runs (0 if it isn't).
+    """
+    m = TTL_PATTERN.search(cmd)
+    if m is not None:
+        return int(m.group(1))
+
+    return int(config.config_info().get(config.FUNCTIONS_SECTION,config.SHELL_TTL_OPT))
+
+def get_cache_file(key):
+    cache_dir = os.path.expanduser(config.config_info().get(config.FUNCTIONS_SECTION,config.SHELL_CACHE_DIR_OPT).strip())
+    digest = hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+    return os.path.join(cache_dir,'%s.json' % digest)
+
+def read_kept_output(key,ttl):
+    """
+    Return the output kept for the key if it's newer than ttl seconds or None.
+    """
+    cache_file = get_cache_file(key)
+    try:
+        fh = open(cache_file,'r')
+        entry = json.load(fh)
+        fh.close()
+    except (OSError,ValueError):
+        return None
+
+    if time.time() - entry['time'] > ttl:
+        return None
+
+    logger.debug('using the kept output of %s' % key[0])
+    return entry['output']
+
+def keep_output(key,output):
+    cache_file = get_cache_file(key)
+
+    # write to a temporary file first so that readers never see a partial file
+    tmp_file = None
+    try:
+        os.makedirs(os.path.dirname(cache_file),exist_ok=True)
+        fd,tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+        fh = os.fdopen(fd,'w')
+        json.dump({'cmd':key[0], 'time':time.time(), 'output':output},fh)
+        fh.close()
+        os.replace(tmp_file,cache_file)
+    except OSError as e:
+        logger.debug('unable to keep the output of %s: %s' % (key[0],e))
+        if tmp_file is not None and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def run_shell_function(cmd,cwd,context):
+    """
+    Return the standard out of the command, run by the shell in cwd with the
+    xp variables in context added to the environment.
+
+    subprocess.CalledProcessError is raised if the command fails.
+    """
+    key = (cmd,cwd,sorted(context.items()))
+    memo_key = (cmd,cwd,tuple(key[2]))
+
+    # two threads may run the same command at once, which is harmless
+    with _outputs_lock:
+        if memo_key in _outputs:
+            return _outputs[memo_key]
+
+    ttl = get_ttl(cmd)
+    output = read_kept_output(key,ttl) if ttl > 0 else None
+
+    if output is None:
+        output = subprocess.check_output(cmd,shell=True,cwd=cwd,
+                                         env=get_total_context(context)).decode()
+        if ttl > 0:
+            keep_output(key,output)
+
+    with _outputs_lock:
+        _outputs[memo_key] = output
+
+    return output
@@ -28,6 +28,12 @@ from .tests.dep_cases import *
 from .tests.linenos import *
 from .tests.task_properties import *
 from .tests.kernel_loader import *
+from .tests.scheduler import *
+from .tests.executors import *
+from .tests.marks import *
+from .tests.cache import *
+from .tests.context import *
+from .tests.persistent import *
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
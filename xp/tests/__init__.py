@@ -14,3 +14,21 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+
+import atexit
+import os.path
+import shutil
+import tempfile
+
+from xp import config
+
+# the tests get their own config and cache directories, so that they neither
+# read the user's xp.ini nor leave parse caches, artifacts, etc. behind
+_tmp_dir = tempfile.mkdtemp(prefix='xp-tests-')
+atexit.register(shutil.rmtree,_tmp_dir,True)
+
+config.DEFAULT_CONFIG_DIR = os.path.join(_tmp_dir,'config')
+config.DEFAULT_CACHE_DIR = os.path.join(_tmp_dir,'cache','artifacts')
+config.DEFAULT_SHELL_CACHE_DIR = os.path.join(_tmp_dir,'cache','shell')
+config.DEFAULT_DURATIONS_DIR = os.path.join(_tmp_dir,'cache','durations')
+config.initialize_config_info()
@@ -19,7 +19,9 @@ from xp.pipeline import *
 import xp.pipeline as pipeline
 import os, os.path
 import shutil
+import tempfile
 import time
+from xp import config
 
 BASE_PATH = os.path.dirname(__file__)
 
@@ -448,15 +450,254 @@ class ForceTestCase(unittest.TestCase):
 
         p.unmark_all_tasks(recur=True)
 
-class LineNoTestCase(unittest.TestCase):
-
-    def test_varexpands1(self):
-        p = get_pipeline(get_complete_filename('lineno1'),
+    def test_force_all_diamond(self):
+        """
+        A task reached along several paths is only run once.
+        """
+        p = get_pipeline(get_complete_filename('diamond1'),
                          default_prefix=USE_FILE_PREFIX)
         p.unmark_all_tasks(recur=True)
+        runs_file = get_complete_filename('diamond1_runs.txt')
+        if os.path.exists(runs_file):
+            os.remove(runs_file)
+
+        p.run()
+        tasks_run = p.get_task('top').run(force=FORCE_ALL)
+
+        self.assertEqual([t.name for t in tasks_run],['base','left','right','top'])
+
+        fh = open(runs_file,'r')
+        runs = fh.read().split()
+        fh.close()
+        self.assertEqual(runs,['base','left','right','top']*2)
+
+        os.remove(runs_file)
+        p.unmark_all_tasks(recur=True)
+
+    def test_plan_order(self):
+        p = get_pipeline(get_complete_filename('diamond1'),
+                         default_prefix=USE_FILE_PREFIX)
+        top = p.get_task('top')
+        plan = build_plan([top],FORCE_NONE)
+
+        self.assertEqual([t.name for t in get_plan_order([top],plan)],['base','left','right','top'])
+
+        plan = build_plan([top],FORCE_SOLO)
+        self.assertEqual([t.name for t in get_plan_order([top],plan)],['top'])
+
+class DryRunTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.p = get_pipeline(get_complete_filename('diamond1'),
+                              default_prefix=USE_FILE_PREFIX)
+        self.p.unmark_all_tasks(recur=True)
+
+    def tearDown(self):
+        self.p.unmark_all_tasks(recur=True)
+
+    def get_dry_run(self,task_name=None,force=FORCE_NONE):
+        if task_name is None:
+            to_run = self.p.dry_run(force)
+        else:
+            to_run = self.p.get_task(task_name).dry_run(force)
+
+        return [(t.name,reason) for t,reason in to_run]
+
+    def test_unmarked(self):
+        self.assertEqual(self.get_dry_run(),
+                         [('base','unmarked'),('left','unmarked'),('right','unmarked'),('top','unmarked')])
+
+    def test_marked(self):
+        self.p.mark_all_tasks()
+        self.assertEqual(self.get_dry_run(),[])
+        self.assertEqual(self.get_dry_run('top',FORCE_TOP),[('top','forced')])
+        self.assertEqual(len(self.get_dry_run('top',FORCE_ALL)),4)
+        self.assertEqual(self.get_dry_run('left',FORCE_SOLO),[('left','forced')])
+
+    def test_upstream_newer(self):
+        self.p.mark_all_tasks()
+        time.sleep(0.01)
+        self.p.get_task('left').mark()
+
+        self.assertEqual(self.get_dry_run(),[('top','dependency left is newer')])
+
+        # base running makes everything downstream of it stale
+        self.p.get_task('base').unmark()
+        self.assertEqual(self.get_dry_run(),
+                         [('base','unmarked'),('left','dependency base is newer'),
+                          ('right','dependency base is newer'),('top','dependency left is newer')])
+
+    def test_get_mark_stamps(self):
+        self.p.get_task('left').mark()
+
+        tasks = self.p.get_all_tasks()
+        stamps = get_mark_stamps(tasks)
+        for t in tasks:
+            self.assertEqual(stamps[t],t.mark_stamp())
+
+class DeclaredFilesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.p = get_pipeline(get_complete_filename('inout1'),
+                              default_prefix=USE_FILE_PREFIX)
+        self.p.unmark_all_tasks()
+
+        self.raw_file = get_complete_filename('inout1_raw.txt')
+        self.extra_file = get_complete_filename('inout1_extra1.txt')
+        self.runs_file = get_complete_filename('inout1_runs.txt')
+
+        fh = open(self.extra_file,'w')
+        fh.close()
+
+    def tearDown(self):
+        self.p.unmark_all_tasks()
+        for fname in [self.raw_file,self.extra_file,self.runs_file]:
+            if os.path.exists(fname):
+                os.remove(fname)
+
+    def get_dry_run(self):
+        return [(t.name,reason) for t,reason in self.p.dry_run()]
+
+    def touch_later(self,fname):
+        # newer than everything that exists, regardless of clock resolution
+        stamp = time.time_ns() + 10**9
+        os.utime(fname,ns=(stamp,stamp))
+
+    def test_declared_files(self):
+        summary = self.p.get_task('summary')
+        self.assertEqual(summary.declared_files('inputs'),
+                         [(self.raw_file,[self.raw_file]),('inout1_extra*.txt',[self.extra_file])])
+        self.assertEqual(summary.declared_files('outputs'),[])
+
+    def test_run(self):
+        self.assertEqual(self.get_dry_run(),
+                         [('raw','output %s is missing' % self.raw_file),('summary','unmarked')])
+        self.assertEqual([t.name for t in self.p.run()],['raw','summary'])
+        self.assertEqual(self.p.run(),[])
+
+    def test_input_changed(self):
+        self.p.run()
+
+        # a changed data file re-runs the task even though it's marked
+        self.touch_later(self.extra_file)
+        self.assertEqual(self.get_dry_run(),[('summary','input inout1_extra*.txt changed')])
+        self.assertEqual([t.name for t in self.p.run()],['summary'])
+
+    def test_outputs(self):
+        self.p.run()
+
+        # a missing output re-runs the task even though it's marked
+        os.remove(self.raw_file)
+        self.assertEqual([t.name for t in self.p.run()],['raw','summary'])
+
+    def test_unmarked_outputs(self):
+        self.p.run()
+
+        # unmarking a task runs it again, even if its outputs are up to date
+        self.p.get_task('raw').unmark()
+        self.assertEqual(self.get_dry_run(),[('raw','unmarked'),('summary','dependency raw is newer')])
+        self.assertEqual([t.name for t in self.p.run()],['raw','summary'])
+
+class ParseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        config.initialize_config_info_from_string("""
+[Parsing]
+cache_dir: %s
+""" % os.path.join(self.tmp_dir,'parse_cache'))
+
+        self.pipeline_file = os.path.join(self.tmp_dir,'parsed1')
+        self.write_pipeline('task1')
+
+        self.parse_pipeline_file = pipeline.parse_pipeline_file
+
+    def tearDown(self):
+        pipeline.parse_pipeline_file = self.parse_pipeline_file
+        config.initialize_config_info()
+        shutil.rmtree(self.tmp_dir)
+
+    def write_pipeline(self,task_name):
+        fh = open(self.pipeline_file,'w')
+        fh.write('X=1\n\n%s:\n\tcode.sh:\n\t\techo $X\n' % task_name)
+        fh.close()
+
+    def parse(self):
+        return parse_pipeline(self.pipeline_file,USE_FILE_PREFIX)
+
+    def test_unchanged(self):
+        p1 = self.parse()
+
+        def fail(pipeline_file):
+            raise Exception('the pipeline should not be parsed again')
+        pipeline.parse_pipeline_file = fail
+
+        p2 = self.parse()
+        self.assertEqual([t.name for t in p2.tasks],['task1'])
+        self.assertEqual(p2.get_context()['X'],'1')
+        self.assertIsNot(p2.tasks[0],p1.tasks[0])
+
+    def test_changed(self):
+        self.parse()
+        self.write_pipeline('task22')
+
+        self.assertEqual([t.name for t in self.parse().tasks],['task22'])
+
+    def test_disabled(self):
+        config.initialize_config_info_from_string("""
+[Parsing]
+cache: false
+cache_dir: %s
+""" % os.path.join(self.tmp_dir,'parse_cache'))
+
+        self.parse()
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir,'parse_cache')))
+
+    def test_pruned(self):
+        cache_dir = os.path.join(self.tmp_dir,'parse_cache')
+        config.initialize_config_info_from_string("""
+[Parsing]
+cache_dir: %s
+max_entries: 2
+""" % cache_dir)
+
+        def cached_files():
+            return sorted(os.listdir(cache_dir))
+
+        self.parse()
+        first = cached_files()
+
+        self.pipeline_file = os.path.join(self.tmp_dir,'parsed2')
+        self.write_pipeline('task2')
+        self.parse()
+        both = cached_files()
+
+        # the pickles of files that are gone are removed
+        os.remove(os.path.join(self.tmp_dir,'parsed1'))
+        self.pipeline_file = os.path.join(self.tmp_dir,'parsed3')
+        self.write_pipeline('task3')
+        self.parse()
+        self.assertEqual(len(cached_files()),2)
+        self.assertNotIn(first[0],cached_files())
+
+        # then the least recently used ones
+        self.pipeline_file = os.path.join(self.tmp_dir,'parsed2')
+        self.parse()
+        self.pipeline_file = os.path.join(self.tmp_dir,'parsed4')
+        self.write_pipeline('task4')
+        self.parse()
+
+        # parsed2 was used more recently than parsed3
+        self.assertEqual(len(cached_files()),2)
+        self.assertIn((set(both) - set(first)).pop(),cached_files())
 
+class LineNoTestCase(unittest.TestCase):
+
+    def test_varexpands1(self):
+        # bad syntax is reported when the pipeline is loaded
         try:
-            p.run()
+            get_pipeline(get_complete_filename('lineno1'),
+                         default_prefix=USE_FILE_PREFIX)
             self.fail()
         except ParseException as e:
             self.assertTrue(e.source_file.endswith('lineno1'))
@@ -465,12 +706,10 @@ class LineNoTestCase(unittest.TestCase):
         return
 
     def test_use_varexpands1(self):
-        p = get_pipeline(get_complete_filename('lineno2'),
-                         default_prefix=USE_FILE_PREFIX)
-        p.unmark_all_tasks(recur=True)
-
+        # bad syntax is reported when the pipeline is loaded
         try:
-            p.run()
+            get_pipeline(get_complete_filename('lineno2'),
+                         default_prefix=USE_FILE_PREFIX)
             self.fail()
         except ParseException as e:
             self.assertTrue(e.source_file.endswith('lineno1'))
@@ -479,13 +718,10 @@ class LineNoTestCase(unittest.TestCase):
         return
 
     def test_in_task_comment(self):
-        p = get_pipeline(get_complete_filename('comment3'),
-                         default_prefix=USE_FILE_PREFIX)
-        p.unmark_all_tasks(recur=True)
-        t = p.get_task('prep_tsvs')
-
+        # bad syntax is reported when the pipeline is loaded
         try:
-            t.run()
+            get_pipeline(get_complete_filename('comment3'),
+                         default_prefix=USE_FILE_PREFIX)
             self.fail()
         except ParseException as e:
             self.assertTrue(e.source_file.endswith('comment3'))
@@ -494,12 +730,10 @@ class LineNoTestCase(unittest.TestCase):
         return
 
     def test_multiline_comment(self):
-        p = get_pipeline(get_complete_filename('lineno_comment1'),
-                         default_prefix=USE_FILE_PREFIX)
-        p.unmark_all_tasks(recur=True)
-
+        # bad syntax is reported when the pipeline is loaded
         try:
-            p.run()
+            get_pipeline(get_complete_filename('lineno_comment1'),
+                         default_prefix=USE_FILE_PREFIX)
             self.fail()
         except ParseException as e:
             self.assertTrue(e.source_file.endswith('lineno_comment1'))
@@ -556,6 +790,45 @@ class CommentingTestCase(unittest.TestCase):
         p.unmark_all_tasks(recur=True)
         p.run()    
 
+    def test_property_after_multiline_comment(self):
+        """
+        The line after a multi-line comment in a task is part of the task
+        """
+        p = get_pipeline(get_complete_filename('multiline_comment5'),
+                         default_prefix=USE_FILE_PREFIX)
+        t = p.get_task('task1')
+
+        self.assertEquals(t.properties()['cpus'],'2')
+        self.assertEquals(len(t.blocks),1)
+
+class ParserTestCase(unittest.TestCase):
+
+    def test_export_unset(self):
+        p = get_pipeline(get_complete_filename('export_unset1'),
+                         default_prefix=USE_FILE_PREFIX)
+        export_block = p.get_task('task1').blocks[0]
+
+        self.assertEquals([type(s) for s in export_block.statements],[VariableAssignment,DeleteVariable])
+        self.assertEquals(export_block.statements[1].varname,'Y')
+
+    def test_same_tasks_at_scale(self):
+        content = open(get_complete_filename('tasks2')).read()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            pipeline_file = os.path.join(tmp_dir,'big')
+            fh = open(pipeline_file,'w')
+            fh.write(content)
+            for i in range(500):
+                fh.write('\nt%d: t%d\n\tcode.sh:\n\t\techo %d\n' % (i+1,i,i))
+            fh.close()
+
+            preamble,tasks = pipeline.parse_pipeline_file(pipeline_file)
+            self.assertEquals(len(tasks),len(pipeline.parse_pipeline_file(get_complete_filename('tasks2'))[1]) + 500)
+            self.assertEquals(tasks[-1].name,'t500')
+            self.assertEquals(tasks[-1].blocks[0].content,['echo 499'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
 class IndentingTestCase(unittest.TestCase):
 
     def test_space_after_block_def(self):
@@ -18,11 +18,19 @@ import unittest
 from xp.pipeline import get_pipeline, USE_FILE_PREFIX
 import xp.pipeline as pipeline
 import os, os.path
+import io
+import contextlib
+import shutil
+import tempfile
+from subprocess import CalledProcessError
+
+from xp.executors.base import ExecutionFailed
+from xp.kernels.pyinline import PythonInlineKernel
 
 # check for gnuplot
 gnuplot_installed = os.system('gnuplot -V') == 0
 
-__all__ = ['BlockArgStringTestCase','AwkTestCase','PYHMRTestCase']
+__all__ = ['BlockArgStringTestCase','AwkTestCase','PYHMRTestCase','PyInlineTestCase']
 
 if gnuplot_installed:
     __all__.append('GnuplotTestCase')
@@ -95,4 +103,121 @@ class PYHMRTestCase(unittest.TestCase):
 
         os.remove(fname)
 
+class PyInlineTestCase(unittest.TestCase):
+
+    def test_inline1(self):
+        p = get_pipeline(get_complete_filename('pyinline1'),
+                        default_prefix=USE_FILE_PREFIX)
+        t = p.get_task('inline_task')
+        t.unmark()
+        t.run()
+
+        fname = get_complete_filename('pyinline1_out.txt')
+
+        # the block ran in the pipeline's directory, with its variables
+        self.assertTrue(os.path.exists(fname))
+        self.assertEquals(open(fname).read(),'hello hello\n')
+        os.remove(fname)
+
+        self.assertNotIn('GREETING',os.environ)
+
+    def test_exception(self):
+        p = get_pipeline(get_complete_filename('pyinline1'),
+                        default_prefix=USE_FILE_PREFIX)
+        t = p.get_task('failing_task')
+        t.unmark()
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(pipeline.BlockFailed) as cm:
+                t.run()
+
+        self.assertIn('ValueError: bad value',str(cm.exception))
+
+    def test_namespace_and_output(self):
+        kernel = PythonInlineKernel()
+        cwd = os.getcwd()
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            kernel.run('',{},BASE_PATH,['import os','x = 1','os.environ["XP_INLINE_TEST"] = "1"','print(os.getcwd())'])
+            kernel.run('',{},BASE_PATH,["print('x' in globals())"])
+
+        # each block gets a fresh namespace and the process is left as it was
+        self.assertEquals(out.getvalue(),'%s\nFalse\n' % os.path.abspath(BASE_PATH))
+        self.assertEquals(os.getcwd(),cwd)
+        self.assertNotIn('XP_INLINE_TEST',os.environ)
+
+    def test_parallel(self):
+        p = get_pipeline(get_complete_filename('pyinline2'),
+                        default_prefix=USE_FILE_PREFIX)
+        p.unmark_all_tasks()
+        cwd = os.getcwd()
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            p.run(num_jobs=2)
+
+        shell_fname = get_complete_filename('pyinline2_shell.txt')
+        inline_fname = get_complete_filename('pyinline2_inline.txt')
+        shell_dir = open(shell_fname).read().strip()
+        greeting,env_greeting,pid = open(inline_fname).read().split()
+        os.remove(shell_fname)
+        os.remove(inline_fname)
+        p.unmark_all_tasks()
+
+        # the inline block was run in another process, so it didn't change
+        # the working directory or environment of the shell task or of xp
+        self.assertEquals((greeting,env_greeting),('hello','hello'))
+        self.assertNotEquals(int(pid),os.getpid())
+        self.assertEquals(shell_dir,os.path.abspath(BASE_PATH + '/pipelines'))
+        self.assertEquals(os.getcwd(),cwd)
+        self.assertNotIn('GREETING',os.environ)
+
+        # and all of its output came out
+        lines = out.getvalue().split('\n')
+        self.assertEquals([l for l in lines if l.startswith('inline')],['inline %d' % i for i in range(10)])
+
+    def test_output_order(self):
+        kernel = PythonInlineKernel()
+
+        # the output of subprocesses is interleaved with the block's own
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            kernel.run('',{},BASE_PATH,["print('a')","import os","os.system('echo b')","print('c')"])
+
+        self.assertEquals(out.getvalue(),'a\nb\nc\n')
+
+    def test_output_streamed(self):
+        kernel = PythonInlineKernel()
+        tmp_dir = tempfile.mkdtemp()
+
+        class Console(io.StringIO):
+            def write(self,data):
+                # tell the block its first line has been seen
+                if 'started' in data:
+                    open(os.path.join(tmp_dir,'seen'),'w').close()
+                return super().write(data)
+
+        # the block only finishes once its first line is shown
+        out = Console()
+        try:
+            with contextlib.redirect_stdout(out):
+                kernel.run('',{},tmp_dir,['import os, time',
+                                          "print('started')",
+                                          'for i in range(1000):',
+                                          "    if os.path.exists('seen'): break",
+                                          '    time.sleep(0.01)',
+                                          "print('seen' if i < 999 else 'timed out')"])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        self.assertEquals(out.getvalue(),'started\nseen\n')
+
+    def test_exit(self):
+        kernel = PythonInlineKernel()
+
+        kernel.run('',{},BASE_PATH,['import sys','sys.exit(0)'])
+        with self.assertRaises(CalledProcessError) as cm:
+            kernel.run('',{},BASE_PATH,['import sys','sys.exit(2)'])
+        self.assertEquals(cm.exception.returncode,2)
 
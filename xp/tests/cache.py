@@ -0,0 +1,258 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+from xp.pipeline import *
+from xp.cache import ArtifactCache, get_artifact_cache, RESTORE_LINK
+from xp.remote_cache import RemoteCache, make_server, get_remote_cache
+from xp import config
+import os, os.path
+import shutil
+import tempfile
+import threading
+import time
+
+def write_file(fname,content):
+    fh = open(fname,'w')
+    fh.write(content)
+    fh.close()
+
+def read_file(fname):
+    fh = open(fname,'r')
+    content = fh.read()
+    fh.close()
+    return content
+
+class ArtifactCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = ArtifactCache(os.path.join(self.tmp_dir,'cache'))
+
+        self.out_file = os.path.join(self.tmp_dir,'out.txt')
+        self.out_dir = os.path.join(self.tmp_dir,'out_dir')
+        write_file(self.out_file,'hello')
+        os.makedirs(self.out_dir)
+        write_file(os.path.join(self.out_dir,'part1'),'world')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_store_restore(self):
+        self.assertFalse(self.cache.restore('ab12',self.tmp_dir))
+        self.assertTrue(self.cache.store('ab12',[self.out_file,self.out_dir],self.tmp_dir))
+        self.assertTrue('ab12' in self.cache)
+
+        os.remove(self.out_file)
+        write_file(os.path.join(self.out_dir,'part1'),'changed')
+        write_file(os.path.join(self.out_dir,'part2'),'extra')
+
+        self.assertTrue(self.cache.restore('ab12',self.tmp_dir))
+        self.assertEqual(read_file(self.out_file),'hello')
+        self.assertEqual(os.listdir(self.out_dir),['part1'])
+        self.assertEqual(read_file(os.path.join(self.out_dir,'part1')),'world')
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['entries'],1)
+        self.assertEqual(stats['size'],10)
+
+    def test_link(self):
+        cache = ArtifactCache(os.path.join(self.tmp_dir,'cache'),restore=RESTORE_LINK)
+        cache.store('cd34',[self.out_file],self.tmp_dir)
+        os.remove(self.out_file)
+
+        cache.restore('cd34',self.tmp_dir)
+        self.assertEqual(os.stat(self.out_file).st_nlink,1)
+
+        # changing a restored output in place doesn't change the cache
+        fh = open(self.out_file,'a')
+        fh.write(' again')
+        fh.close()
+
+        cache.restore('cd34',self.tmp_dir)
+        self.assertEqual(read_file(self.out_file),'hello')
+
+    def test_moved(self):
+        self.cache.store('ab12',[self.out_file,self.out_dir],self.tmp_dir)
+
+        # the outputs are restored relative to wherever the pipeline is now
+        new_dir = os.path.join(self.tmp_dir,'moved')
+        self.assertTrue(self.cache.restore('ab12',new_dir))
+        self.assertEqual(read_file(os.path.join(new_dir,'out.txt')),'hello')
+        self.assertEqual(read_file(os.path.join(new_dir,'out_dir','part1')),'world')
+
+    def test_lru_eviction(self):
+        cache = ArtifactCache(os.path.join(self.tmp_dir,'cache'),max_size=10)
+        cache.store('aa01',[self.out_file],self.tmp_dir)
+        time.sleep(0.01)
+        cache.store('bb02',[self.out_file],self.tmp_dir)
+        time.sleep(0.01)
+
+        # using the older entry makes the other one the least recently used
+        cache.restore('aa01',self.tmp_dir)
+        cache.store('cc03',[self.out_file],self.tmp_dir)
+
+        self.assertEqual(sorted([e[0] for e in cache.entries()]),['aa01','cc03'])
+
+        self.assertEqual(cache.prune(5),(1,5))
+        self.assertEqual([e[0] for e in cache.entries()],['cc03'])
+
+    def test_too_large(self):
+        cache = ArtifactCache(os.path.join(self.tmp_dir,'cache'),max_size=4)
+        self.assertFalse(cache.store('ee05',[self.out_file],self.tmp_dir))
+        self.assertEqual(cache.entries(),[])
+
+CACHE_PIPELINE = """
+NAME=%s
+
+greet:
+	@outputs $PLN(out.txt)
+	code.sh:
+		echo $NAME >> $PLN(runs.txt)
+		echo hello $NAME > $PLN(out.txt)
+"""
+
+class CachedRunTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        config.initialize_config_info_from_string("""
+[Cache]
+enabled: true
+dir: %s
+""" % os.path.join(self.tmp_dir,'cache'))
+
+        self.pipeline_file = os.path.join(self.tmp_dir,'cached1')
+        self.out_file = os.path.join(self.tmp_dir,'cached1_out.txt')
+        self.runs_file = os.path.join(self.tmp_dir,'cached1_runs.txt')
+
+    def tearDown(self):
+        config.initialize_config_info()
+        shutil.rmtree(self.tmp_dir)
+
+    def run_with(self,name,force=FORCE_NONE):
+        write_file(self.pipeline_file,CACHE_PIPELINE % name)
+        reset_pipeline_factory()
+
+        p = get_pipeline(self.pipeline_file,default_prefix=USE_FILE_PREFIX)
+        return [t.name for t in p.run(force)]
+
+    def test_restore(self):
+        self.assertEqual(self.run_with('first'),['greet'])
+        self.assertEqual(self.run_with('second'),['greet'])
+        self.assertEqual(read_file(self.out_file),'hello second\n')
+
+        # switching back restores the outputs instead of running the task
+        self.assertEqual(self.run_with('first'),['greet'])
+        self.assertEqual(read_file(self.out_file),'hello first\n')
+        self.assertEqual(read_file(self.runs_file).split(),['first','second'])
+
+        self.assertEqual(self.run_with('first'),[])
+        self.assertEqual(get_artifact_cache().stats()['entries'],2)
+
+    def test_forced(self):
+        self.run_with('first')
+        self.run_with('first',FORCE_ALL)
+
+        self.assertEqual(read_file(self.runs_file).split(),['first','first'])
+
+class RemoteCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        self.server = make_server(os.path.join(self.tmp_dir,'server'))
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+        self.url = 'http://localhost:%d/xp' % self.server.server_address[1]
+
+        self.pipeline_file = os.path.join(self.tmp_dir,'cached1')
+        self.out_file = os.path.join(self.tmp_dir,'cached1_out.txt')
+        self.runs_file = os.path.join(self.tmp_dir,'cached1_runs.txt')
+
+    def tearDown(self):
+        config.initialize_config_info()
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+
+        shutil.rmtree(self.tmp_dir)
+
+    def test_transfer(self):
+        out_file = os.path.join(self.tmp_dir,'out.txt')
+        write_file(out_file,'hello')
+
+        # two machines with their own local caches
+        cache1 = ArtifactCache(os.path.join(self.tmp_dir,'cache1'))
+        cache2 = ArtifactCache(os.path.join(self.tmp_dir,'cache2'))
+        remote = RemoteCache(self.url)
+
+        self.assertFalse(remote.fetch('ab12',cache2))
+
+        cache1.store('ab12',[out_file],self.tmp_dir)
+        remote.upload('ab12',cache1)
+        remote.wait()
+        self.assertTrue(remote.contains('ab12'))
+
+        os.remove(out_file)
+        self.assertTrue(remote.fetch('ab12',cache2))
+        self.assertTrue(cache2.restore('ab12',self.tmp_dir))
+        self.assertEqual(read_file(out_file),'hello')
+
+    def use_machine(self,name,pipeline_file=None):
+        config.initialize_config_info_from_string("""
+[Cache]
+dir: %s
+remote_url: %s
+""" % (os.path.join(self.tmp_dir,name),self.url))
+
+        pipeline_file = pipeline_file or self.pipeline_file
+        write_file(pipeline_file,CACHE_PIPELINE % 'first')
+        reset_pipeline_factory()
+
+        return get_pipeline(pipeline_file,default_prefix=USE_FILE_PREFIX)
+
+    def test_shared_run(self):
+        p = self.use_machine('machine1')
+        self.assertEqual([t.name for t in p.run()],['greet'])
+        get_remote_cache().wait()
+
+        # another machine downloads the outputs rather than running the task
+        p.unmark_all_tasks()
+        os.remove(self.out_file)
+
+        p = self.use_machine('machine2')
+        self.assertEqual([t.name for t in p.run()],['greet'])
+        self.assertEqual(read_file(self.out_file),'hello first\n')
+        self.assertEqual(read_file(self.runs_file).split(),['first'])
+
+    def test_shared_checkouts(self):
+        # the same pipeline checked out in two places, on two machines
+        checkouts = [os.path.join(self.tmp_dir,'a'),os.path.join(self.tmp_dir,'b')]
+        for checkout in checkouts:
+            os.makedirs(checkout)
+
+        p = self.use_machine('machine1',os.path.join(checkouts[0],'cached1'))
+        self.assertEqual([t.name for t in p.run()],['greet'])
+        get_remote_cache().wait()
+
+        # the second checkout downloads the outputs rather than running the task
+        p = self.use_machine('machine2',os.path.join(checkouts[1],'cached1'))
+        self.assertEqual([t.name for t in p.run()],['greet'])
+        self.assertEqual(read_file(os.path.join(checkouts[1],'cached1_out.txt')),'hello first\n')
+        self.assertFalse(os.path.exists(os.path.join(checkouts[1],'cached1_runs.txt')))
+
@@ -0,0 +1,93 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+import os
+import subprocess
+from xp.context import Context, get_environment, refresh_environment, with_environment
+from xp.pipeline import *
+
+BASE_PATH = os.path.dirname(__file__)
+
+def get_complete_filename(fname):
+    return os.path.join(BASE_PATH,'pipelines',fname)
+
+class ContextTestCase(unittest.TestCase):
+
+    def test_layers(self):
+        parent = Context({'X':'1', 'Y':'2'})
+        child = parent.child()
+
+        child['X'] = 'a'
+        child['Z'] = 'b'
+        del child['Y']
+
+        self.assertEqual(dict(child),{'X':'a', 'Z':'b'})
+        self.assertEqual(dict(parent),{'X':'1', 'Y':'2'})
+        self.assertFalse('Y' in child)
+        self.assertEqual(len(child),2)
+
+        # unset variables can be set again
+        child['Y'] = 'c'
+        self.assertEqual(child['Y'],'c')
+
+        del child['Z']
+        self.assertRaises(KeyError,lambda: child['Z'])
+
+    def test_environment(self):
+        context = Context({'XP_CONTEXT_TEST':'hello'})
+        env = with_environment(context)
+
+        self.assertEqual(env['XP_CONTEXT_TEST'],'hello')
+        self.assertEqual(env['PATH'],os.environ['PATH'])
+
+        # kernels can't change the environment they're given
+        with self.assertRaises(TypeError):
+            env['XP_CONTEXT_TEST'] = 'bye'
+
+        # it's shared until the context changes
+        child = context.child()
+        self.assertTrue(with_environment(context) is env)
+        self.assertTrue(with_environment(child) is env)
+
+        child['XP_CONTEXT_TEST'] = 'bye'
+        self.assertEqual(with_environment(child)['XP_CONTEXT_TEST'],'bye')
+        self.assertTrue(with_environment(context) is env)
+
+        output = subprocess.check_output('echo $XP_CONTEXT_TEST',shell=True,env=with_environment(context))
+        self.assertEqual(output,b'hello\n')
+
+    def test_environment_snapshot(self):
+        snapshot = get_environment()
+        self.assertTrue(get_environment() is snapshot)
+
+        os.environ['XP_CONTEXT_TEST'] = 'x'
+        try:
+            self.assertFalse('XP_CONTEXT_TEST' in get_environment())
+            refresh_environment()
+            self.assertEqual(get_environment()['XP_CONTEXT_TEST'],'x')
+        finally:
+            del os.environ['XP_CONTEXT_TEST']
+            refresh_environment()
+
+    def test_pipeline_context(self):
+        p = get_pipeline(get_complete_filename('varexpand1'),default_prefix=USE_FILE_PREFIX)
+
+        context = p.get_context()
+        context['X'] = 'changed'
+        del context['Y']
+        self.assertEqual(p.get_context()['X'],'hello')
+        self.assertTrue('Y' in p.get_context())
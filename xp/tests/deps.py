@@ -16,6 +16,7 @@ limitations under the License.
 
 import unittest
 from xp.pipeline import get_pipeline, USE_FILE_PREFIX
+from xp.graph import DependencyCycle
 import xp.pipeline as pipeline
 import os, os.path
 
@@ -42,3 +43,35 @@ class DependenciesTestCase(unittest.TestCase):
 
 		self.assertDictEqual(vl,{'p1_t4':0,'p1_t3':1,'p1_t2':1,'p1_t1':2,'p0_t3':3,'p0_t2':4,'p0_t1':5})
 
+
+class TaskGraphTestCase(unittest.TestCase):
+
+	def test_graph_views(self):
+		p = get_pipeline(get_complete_filename('dep_test2'),default_prefix=USE_FILE_PREFIX)
+		graph = p.get_task_graph()
+		t = lambda name: [x for x in graph if x.name == name][0]
+
+		self.assertEqual(len(graph),7)
+
+		order = graph.topological_order()
+		for task in order:
+			for d in graph.deps(task):
+				self.assertLess(order.index(d),order.index(task))
+
+		self.assertEqual(set([x.name for x in graph.upstream(t('p1_t2'))]),set(['p1_t1','p0_t1','p0_t2','p0_t3']))
+		self.assertEqual(set([x.name for x in graph.downstream(t('p1_t1'))]),set(['p1_t2','p1_t3','p1_t4']))
+		self.assertEqual([x.name for x in graph.leaves()],['p1_t4'])
+
+	def test_graph_cached(self):
+		p = get_pipeline(get_complete_filename('dep_test1'),default_prefix=USE_FILE_PREFIX)
+		graph = p.get_task_graph()
+
+		self.assertIs(p.get_task_graph(),graph)
+
+		p.initialize()
+		self.assertIsNot(p.get_task_graph(),graph)
+
+	def test_cycle(self):
+		p = get_pipeline(get_complete_filename('cycle1'),default_prefix=USE_FILE_PREFIX)
+
+		self.assertRaises(DependencyCycle,p.get_task_graph)
@@ -0,0 +1,115 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+from xp.pipeline import *
+import xp.pipeline as pipeline
+import os, os.path
+import io
+import asyncio
+import contextlib
+from subprocess import CalledProcessError
+
+import xp.config as config
+from xp.executor_loader import ExecutorLoader
+from xp.executors.base import ExecutionFailed
+from xp.executors.local import LocalExecutor
+from xp.executors.workerpool import WorkerPoolExecutor
+
+BASE_PATH = os.path.dirname(__file__)
+
+def get_complete_filename(fname):
+    return os.path.join(BASE_PATH,'pipelines',fname)
+
+class ExecutorLoaderTestCase(unittest.TestCase):
+
+    def test_default_executors(self):
+        el = ExecutorLoader.reinitialize_singleton()
+
+        self.assertEqual(sorted(el.names()),['local','workers'])
+        self.assertTrue(isinstance(el.get_executor(),LocalExecutor))
+        self.assertTrue(el.get_executor('workers') is el.get_executor('workers'))
+
+    def test_custom_executor_name(self):
+        config.initialize_config_info_from_string("""
+[Executors]
+active_executors: xp.executors.local.LocalExecutor(here)
+default_executor: here
+""")
+        el = ExecutorLoader.reinitialize_singleton()
+
+        self.assertEqual(el.names(),['here'])
+        self.assertTrue(isinstance(el.get_executor(),LocalExecutor))
+        self.assertRaises(Exception,el.get_executor,'local')
+
+        config.initialize_config_info()
+        ExecutorLoader.reinitialize_singleton()
+
+class WorkerPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        config.initialize_config_info_from_string("""
+[Executors]
+workerpool_workers: 2
+""")
+        self.executor = WorkerPoolExecutor()
+
+    def tearDown(self):
+        self.executor.shutdown()
+        config.initialize_config_info()
+        ExecutorLoader.reinitialize_singleton()
+
+    def test_run_block(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.executor.run_block('sh','',{'MSG':'hello'},'.',['echo $MSG'])
+
+        self.assertEqual(out.getvalue(),'hello\n')
+
+    def test_run_block_async(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            asyncio.run(self.executor.run_block_async('test','',{},'.',['hello']))
+
+        self.assertEqual(out.getvalue(),'hello\n')
+
+    def test_block_failure(self):
+        try:
+            self.executor.run_block('sh','',{},'.',['exit 3'])
+            self.fail('the block should have failed')
+        except CalledProcessError as e:
+            self.assertEqual(e.returncode,3)
+
+    def test_unknown_kernel(self):
+        self.assertRaises(ExecutionFailed,self.executor.run_block,'nolang','',{},'.',['hi'])
+
+    def test_task_executor_property(self):
+        ExecutorLoader.reinitialize_singleton()
+
+        p = get_pipeline(get_complete_filename('executor1'),default_prefix=USE_FILE_PREFIX)
+        p.unmark_all_tasks(recur=True)
+
+        pid_file = get_complete_filename('executor1_pid.txt')
+        p.get_task('remote_task').run()
+
+        # the block was run by a worker, not a child of this process
+        self.assertNotEqual(int(open(pid_file,'r').read()),os.getpid())
+        os.remove(pid_file)
+
+        self.assertRaises(BlockFailed,p.get_task('failing_task').run)
+
+        ExecutorLoader.singleton().shutdown()
+        p.unmark_all_tasks(recur=True)
@@ -0,0 +1,176 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+from xp.pipeline import *
+from xp.marks import migrate_marks, get_mark_store, SqliteMarkStore, BACKEND_FILE, BACKEND_SQLITE
+from xp import config
+import os, os.path
+import shutil
+import tempfile
+
+BASE_PATH = os.path.dirname(__file__)
+
+def get_complete_filename(fname):
+    return os.path.join(BASE_PATH,'pipelines',fname)
+
+class SqliteMarksTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        config.initialize_config_info_from_string("""
+[Marks]
+backend: sqlite
+db_file: %s
+""" % os.path.join(self.tmp_dir,'marks.db'))
+
+        self.p = get_pipeline(get_complete_filename('diamond1'),default_prefix=USE_FILE_PREFIX)
+        self.p.unmark_all_tasks(recur=True)
+        self.runs_file = get_complete_filename('diamond1_runs.txt')
+
+    def tearDown(self):
+        self.p.unmark_all_tasks(recur=True)
+        if os.path.exists(self.runs_file):
+            os.remove(self.runs_file)
+
+        config.initialize_config_info()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_run(self):
+        tasks_run = self.p.run()
+
+        self.assertEqual(len(tasks_run),4)
+        self.assertTrue(isinstance(tasks_run[0].mark_store(),SqliteMarkStore))
+        self.assertFalse(os.path.exists(tasks_run[0].mark_file()))
+
+        # stamps are strictly increasing in the order the tasks were marked
+        stamps = [t.mark_stamp() for t in tasks_run]
+        self.assertEqual(stamps,sorted(set(stamps)))
+
+        self.assertEqual(self.p.run(),[])
+
+        self.p.get_task('left').mark()
+        self.assertEqual([t.name for t,reason in self.p.dry_run()],['top'])
+
+    def test_unmark(self):
+        t = self.p.get_task('base')
+        t.mark()
+        self.assertTrue(t.is_marked())
+
+        t.unmark()
+        self.assertFalse(t.is_marked())
+        self.assertIsNone(t.mark_timestamp())
+
+    def test_migrate(self):
+        tasks = self.p.get_all_tasks()
+
+        file_store = get_mark_store(self.p,BACKEND_FILE)
+        for t in self.p.get_task_graph().topological_order():
+            file_store.mark(t)
+        file_stamps = file_store.get_stamps(tasks)
+
+        num_moved = migrate_marks(tasks,BACKEND_FILE,BACKEND_SQLITE)
+
+        self.assertEqual(num_moved,4)
+        for t in tasks:
+            self.assertFalse(os.path.exists(t.mark_file()))
+            self.assertEqual(t.mark_stamp(),file_stamps[t])
+
+        # new marks are still newer than the migrated ones
+        base = self.p.get_task('base')
+        base.mark()
+        self.assertGreater(base.mark_stamp(),max(file_stamps.values()))
+
+FINGERPRINT_PIPELINE = """
+# %s
+a:
+	# %s
+	code.sh:
+		echo %s >> $PLN(runs.txt)
+
+b: a
+	code.sh:
+		echo b >> $PLN(runs.txt)
+"""
+
+class FingerprintTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        config.initialize_config_info_from_string("""
+[Marks]
+fingerprints: true
+""")
+
+        self.pipeline_file = os.path.join(self.tmp_dir,'fp1')
+        self.runs_file = os.path.join(self.tmp_dir,'fp1_runs.txt')
+
+    def tearDown(self):
+        config.initialize_config_info()
+        shutil.rmtree(self.tmp_dir)
+
+    def write_pipeline(self,comment,word):
+        fh = open(self.pipeline_file,'w')
+        fh.write(FINGERPRINT_PIPELINE % (comment,comment,word))
+        fh.close()
+
+        # parse the edited file rather than reusing the cached pipeline
+        reset_pipeline_factory()
+        return get_pipeline(self.pipeline_file,default_prefix=USE_FILE_PREFIX)
+
+    def run_names(self,p):
+        return [t.name for t in p.run()]
+
+    def test_comment_edit(self):
+        p = self.write_pipeline('first','a')
+        self.assertEqual(self.run_names(p),['a','b'])
+        self.assertIsNotNone(p.get_task('a').mark_fingerprint())
+
+        p = self.write_pipeline('second','a')
+        self.assertEqual(p.dry_run(),[])
+        self.assertEqual(self.run_names(p),[])
+
+    def test_code_edit(self):
+        p = self.write_pipeline('first','a')
+        self.run_names(p)
+
+        # the change propagates to the dependent
+        p = self.write_pipeline('first','aa')
+        self.assertEqual([(t.name,r) for t,r in p.dry_run()],[('a','inputs changed'),('b','inputs changed')])
+        self.assertEqual(self.run_names(p),['a','b'])
+
+        fh = open(self.runs_file,'r')
+        self.assertEqual(fh.read().split(),['a','b','aa','b'])
+        fh.close()
+
+    def test_newer_dependency(self):
+        p = self.write_pipeline('first','a')
+        self.run_names(p)
+
+        # re-marking a dependency doesn't matter if nothing changed
+        p.get_task('a').mark()
+        self.assertEqual(self.run_names(p),[])
+
+    def test_adopt_old_marks(self):
+        p = self.write_pipeline('first','a')
+        p.mark_all_tasks()
+        self.assertIsNone(p.get_task('b').mark_fingerprint())
+
+        self.assertEqual(self.run_names(p),[])
+        self.assertIsNotNone(p.get_task('b').mark_fingerprint())
+
+        p = self.write_pipeline('first','aa')
+        self.assertEqual(self.run_names(p),['a','b'])
@@ -0,0 +1,281 @@
+"""
+Copyright 2017 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+from xp.pipeline import get_pipeline, USE_FILE_PREFIX
+import os, os.path
+import io
+import contextlib
+import shutil
+import signal
+import sys
+import tempfile
+from subprocess import CalledProcessError
+
+from xp.executors.base import ExecutionFailed
+from xp.kernel_loader import KernelLoader
+from xp.kernels.test import PersistentTestKernel
+from xp.kernels.pyfork import PythonForkKernel
+from xp.kernels.pysession import PythonSessionKernel
+
+BASE_PATH = os.path.dirname(__file__)
+
+def get_complete_filename(fname):
+    return os.path.join(BASE_PATH,'pipelines',fname)
+
+def is_running(pid):
+    try:
+        os.kill(pid,0)
+    except ProcessLookupError:
+        return False
+
+    return True
+
+class PersistentKernelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.kernel = PersistentTestKernel()
+        self.cwd = tempfile.mkdtemp()
+
+    def tearDown(self):
+        KernelLoader.singleton().shutdown_kernel_processes()
+        shutil.rmtree(self.cwd)
+
+    def get_pid(self):
+        """
+        Return the pid of the process that runs the kernel's blocks.
+        """
+        self.kernel.run('',{},self.cwd,['import os',"open('pid','w').write(str(os.getpid()))"])
+        return int(open(os.path.join(self.cwd,'pid')).read())
+
+    def test_one_process_per_run(self):
+        p = get_pipeline(get_complete_filename('persistent1'),default_prefix=USE_FILE_PREFIX)
+        p.unmark_all_tasks()
+        p.run()
+
+        fname = get_complete_filename('persistent1_pids.txt')
+        lines = open(fname).read().split('\n')[:-1]
+        os.remove(fname)
+
+        self.assertEquals(len(lines),3)
+        self.assertEquals(len(set(lines)),1)
+
+        pid,greeting = lines[0].split()
+        self.assertNotEquals(int(pid),os.getpid())
+        self.assertEquals(greeting,'hello')
+
+        # the kernel is shut down at the end of the run
+        self.assertFalse(is_running(int(pid)))
+
+    def test_reused(self):
+        self.assertEquals(self.get_pid(),self.get_pid())
+
+    def test_output(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.kernel.run('',{'X':'1'},self.cwd,["print('X is', context['X'])"])
+
+        self.assertEquals(out.getvalue(),'X is 1\n')
+
+    def test_output_streamed(self):
+        cwd = self.cwd
+
+        class Console(io.StringIO):
+            def write(self,data):
+                # tell the block its first line has been seen
+                if 'started' in data:
+                    open(os.path.join(cwd,'seen'),'w').close()
+                return super().write(data)
+
+        # the block only finishes once its first line is shown
+        out = Console()
+        with contextlib.redirect_stdout(out):
+            self.kernel.run('',{},self.cwd,['import os, time',
+                                            "print('started',flush=True)",
+                                            'for i in range(1000):',
+                                            "    if os.path.exists('seen'): break",
+                                            '    time.sleep(0.01)',
+                                            "print('seen' if i < 999 else 'timed out')"])
+
+        self.assertEquals(out.getvalue(),'started\nseen\n')
+
+    def test_block_fails(self):
+        pid = self.get_pid()
+
+        with self.assertRaises(CalledProcessError) as cm:
+            self.kernel.run('',{},self.cwd,['import subprocess',"raise subprocess.CalledProcessError(2,'cmd')"])
+        self.assertEquals(cm.exception.returncode,2)
+
+        with self.assertRaises(ExecutionFailed):
+            self.kernel.run('',{},self.cwd,["raise ValueError('oops')"])
+
+        # failing blocks don't affect the kernel
+        self.assertEquals(self.get_pid(),pid)
+
+    def test_restart_on_crash(self):
+        pid = self.get_pid()
+
+        with self.assertRaises(ExecutionFailed):
+            self.kernel.run('',{},self.cwd,['import os','os._exit(3)'])
+
+        self.assertNotEquals(self.get_pid(),pid)
+
+    def test_restart_when_dead(self):
+        pid = self.get_pid()
+
+        # the health check notices that the idle kernel has gone
+        os.kill(pid,signal.SIGKILL)
+        self.assertNotEquals(self.get_pid(),pid)
+
+    def test_shutdown(self):
+        pid = self.get_pid()
+
+        KernelLoader.singleton().shutdown_kernel_processes()
+        self.assertFalse(is_running(pid))
+
+        self.assertNotEquals(self.get_pid(),pid)
+
+class PythonForkKernelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.kernel = PythonForkKernel()
+        self.cwd = tempfile.mkdtemp()
+
+    def tearDown(self):
+        KernelLoader.singleton().shutdown_kernel_processes()
+        shutil.rmtree(self.cwd)
+
+    def run_block(self,content,preload=''):
+        """
+        Run the block and return what it wrote to the file named out.
+        """
+        context = {'PYTHON_CMD':sys.executable, 'PYTHON_PRELOAD':preload, 'GREETING':'hello'}
+        self.kernel.run('',context,self.cwd,content)
+
+        return open(os.path.join(self.cwd,'out')).read()
+
+    def test_forked(self):
+        pids = [self.run_block(['import os',"open('out','w').write('%d %d' % (os.getpid(),os.getppid()))"]).split()
+                for i in range(2)]
+
+        # each block gets its own child of the same server
+        self.assertNotEquals(pids[0][0],pids[1][0])
+        self.assertEquals(pids[0][1],pids[1][1])
+
+    def test_preload(self):
+        block = ['import sys',"open('out','w').write(str('wave' in sys.modules))"]
+
+        self.assertEquals(self.run_block(block,'wave'),'True')
+        self.assertEquals(self.run_block(block),'False')
+
+    def test_isolated(self):
+        self.run_block(['import os','os.environ["GREETING"] = "bye"','X = 1',"open('out','w').write('')"])
+
+        out = self.run_block(['import os',"open('out','w').write('%s %s' % (os.environ['GREETING'],'X' in globals()))"])
+        self.assertEquals(out,'hello False')
+
+    def test_output(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.run_block(["print('hi')","open('out','w').write('')"])
+
+        self.assertEquals(out.getvalue(),'hi\n')
+
+    def test_failures(self):
+        with self.assertRaises(CalledProcessError) as cm:
+            self.run_block(['import sys','sys.exit(3)'])
+        self.assertEquals(cm.exception.returncode,3)
+
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            with self.assertRaises(CalledProcessError) as cm:
+                self.run_block(["raise ValueError('oops')"])
+        self.assertEquals(cm.exception.returncode,1)
+        self.assertIn('ValueError: oops',err.getvalue())
+
+    def test_preload_property(self):
+        p = get_pipeline(get_complete_filename('pyfork1'),default_prefix=USE_FILE_PREFIX)
+        t = p.get_task('pyfork_task')
+        self.assertEquals(t.get_context()['PYTHON_PRELOAD'],'wave')
+
+        context = t.get_context()
+        context['PYTHON_CMD'] = sys.executable
+        self.assertIn('wave',self.kernel.kernel_command(context))
+
+        p.unmark_all_tasks()
+        p.run()
+
+        fname = get_complete_filename('pyfork1_out.txt')
+        out = open(fname).read()
+        os.remove(fname)
+
+        self.assertEquals(out,'True\n')
+
+class PythonSessionTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        KernelLoader.singleton().shutdown_kernel_processes()
+
+    def test_session(self):
+        p = get_pipeline(get_complete_filename('session1'),default_prefix=USE_FILE_PREFIX)
+        t = p.get_task('session_task')
+        t.unmark()
+        t.run()
+
+        fname = get_complete_filename('session1_out.txt')
+        total,num_pids,pid = open(fname).read().split()
+        os.remove(fname)
+
+        # the blocks shared their globals and their interpreter, which is gone
+        self.assertEquals(total,'16')
+        self.assertEquals(num_pids,'1')
+        self.assertFalse(is_running(int(pid)))
+
+    def test_session_blocks(self):
+        p = get_pipeline(get_complete_filename('session1'),default_prefix=USE_FILE_PREFIX)
+        t = p.get_task('session_task')
+
+        self.assertEquals(t.get_session(),'python')
+        self.assertEquals([b.lang for b in t.get_blocks()[1:]],['pysession']*3)
+        self.assertEquals([b.lang for b in t.blocks[1:]],['py','ipy','py'])
+
+    def test_separate_sessions(self):
+        kernel = PythonSessionKernel()
+        cwd = tempfile.mkdtemp()
+        try:
+            kernel.run('',{'XP_SESSION':'a'},cwd,['x = 1'])
+            kernel.run('',{'XP_SESSION':'a'},cwd,["open('out','w').write(str(x))"])
+            self.assertEquals(open(os.path.join(cwd,'out')).read(),'1')
+
+            err = io.StringIO()
+            with contextlib.redirect_stderr(err):
+                with self.assertRaises(CalledProcessError):
+                    kernel.run('',{'XP_SESSION':'b'},cwd,['print(x)'])
+            self.assertIn('NameError',err.getvalue())
+
+            # once a session is shut down, its globals are gone
+            kernel.shutdown({'XP_SESSION':'a'})
+            with contextlib.redirect_stderr(err):
+                with self.assertRaises(CalledProcessError):
+                    kernel.run('',{'XP_SESSION':'a'},cwd,['print(x)'])
+        finally:
+            shutil.rmtree(cwd)
+
+    def test_unknown_session(self):
+        p = get_pipeline(get_complete_filename('session1'),default_prefix=USE_FILE_PREFIX)
+
+        with self.assertRaises(Exception):
+            p.get_task('bad_session_task').get_session()
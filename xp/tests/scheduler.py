@@ -0,0 +1,332 @@
+"""
+Copyright 2016 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+from xp.pipeline import *
+import xp.pipeline as pipeline
+from xp.scheduler import parse_amount, get_task_priorities, Scheduler, ResourcePool, ENGINE_ASYNCIO, MAX_SKIPS
+from xp.durations import get_duration_history
+from xp.kernels.shell import ShellKernel
+from subprocess import CalledProcessError
+import os, os.path
+import io
+import shutil
+import tempfile
+import asyncio
+import contextlib
+
+BASE_PATH = os.path.dirname(__file__)
+
+def get_complete_filename(fname):
+    return os.path.join(BASE_PATH,'pipelines',fname)
+
+def remove_files(*fnames):
+    for fname in fnames:
+        if os.path.exists(fname):
+            os.remove(fname)
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def test_parallel_tasks(self):
+        """
+        Tasks a and b each wait for the other to start, so they can only
+        succeed if they are run at the same time.
+        """
+        p = get_pipeline(get_complete_filename('parallel1'),default_prefix=USE_FILE_PREFIX)
+        p.unmark_all_tasks(recur=True)
+
+        outputs = [get_complete_filename('parallel1_%s' % x) for x in ['a_started','b_started','c_done']]
+        remove_files(*outputs)
+
+        tasks_run = p.run(num_jobs=2)
+
+        self.assertEqual(len(tasks_run),3)
+        self.assertEqual(tasks_run[-1].name,'c')
+        self.assertTrue(os.path.exists(outputs[2]))
+
+        # everything is marked now, so nothing should run
+        self.assertEqual(len(p.run(num_jobs=2)),0)
+
+        remove_files(*outputs)
+        p.unmark_all_tasks(recur=True)
+
+    def test_parallel_force_all(self):
+        p = get_pipeline(get_complete_filename('diamond1'),default_prefix=USE_FILE_PREFIX)
+        p.unmark_all_tasks(recur=True)
+
+        runs_file = get_complete_filename('diamond1_runs.txt')
+        remove_files(runs_file)
+
+        p.run(num_jobs=4)
+        p.get_task('top').run(force=FORCE_ALL,num_jobs=4)
+
+        runs = open(runs_file,'r').read().split()
+        self.assertEqual(runs.count('base'),2)
+        self.assertEqual(runs.count('top'),2)
+        self.assertEqual(runs[0],'base')
+        self.assertEqual(runs[-1],'top')
+
+        remove_files(runs_file)
+        p.unmark_all_tasks(recur=True)
+
+    def test_parallel_solo(self):
+        p = get_pipeline(get_complete_filename('diamond1'),default_prefix=USE_FILE_PREFIX)
+        p.unmark_all_tasks(recur=True)
+
+        runs_file = get_complete_filename('diamond1_runs.txt')
+        remove_files(runs_file)
+
+        tasks_run = p.get_task('left').run(force=FORCE_SOLO,num_jobs=4)
+
+        self.assertEqual([t.name for t in tasks_run],['left'])
+        self.assertEqual(open(runs_file,'r').read().split(),['left'])
+
+        remove_files(runs_file)
+        p.unmark_all_tasks(recur=True)
+
+    def test_build_plan(self):
+        p = get_pipeline(get_complete_filename('diamond1'),default_prefix=USE_FILE_PREFIX)
+        top = p.get_task('top')
+
+        plan = build_plan([top],FORCE_TOP)
+        self.assertEqual({t.name:f for t,f in plan.items()},
+                         {'top':True,'left':False,'right':False,'base':False})
+
+        plan = build_plan([top],FORCE_ALL)
+        self.assertTrue(all(plan.values()))
+        self.assertEqual(len(plan),4)
+
+        plan = build_plan([top],FORCE_SOLO)
+        self.assertEqual({t.name:f for t,f in plan.items()},{'top':True})
+
+class ResourceTestCase(unittest.TestCase):
+
+    def run_resources1(self,budget):
+        p = get_pipeline(get_complete_filename('resources1'),default_prefix=USE_FILE_PREFIX)
+        p.unmark_all_tasks(recur=True)
+
+        log_file = get_complete_filename('resources1_log.txt')
+        remove_files(log_file)
+
+        Scheduler(num_jobs=2,budget=budget).run(p.tasks)
+        log = open(log_file,'r').read().split()
+
+        remove_files(log_file)
+        p.unmark_all_tasks(recur=True)
+
+        return log
+
+    def test_memory_limit(self):
+        log = self.run_resources1({'cpus':0,'mem':parse_amount('3G'),'io':1})
+        self.assertEqual(log,['start','end','start','end'])
+
+    def test_no_memory_limit(self):
+        log = self.run_resources1({'cpus':0,'mem':0,'io':1})
+        self.assertEqual(log,['start','start','end','end'])
+
+    def test_oversized_task(self):
+        # a task that can never fit is run on its own
+        log = self.run_resources1({'cpus':0,'mem':parse_amount('1G'),'io':1})
+        self.assertEqual(log,['start','end','start','end'])
+
+    def test_no_starvation(self):
+        class Stub:
+            def __init__(self,name):
+                self.name = name
+
+        budget = {'cpus':4, 'mem':0, 'io':1}
+        scheduler = Scheduler(num_jobs=4,budget=budget)
+        resources = ResourcePool(budget)
+
+        big = Stub('big')
+        holder = Stub('holder')
+        smalls = [Stub('small%d' % i) for i in range(MAX_SKIPS + 1)]
+        demands = {t:{'cpus':1, 'mem':0, 'io':0} for t in smalls + [holder]}
+        demands[big] = {'cpus':4, 'mem':0, 'io':0}
+
+        # while the holder runs, small tasks keep coming and going ahead of big
+        resources.acquire(demands[holder])
+        runnable = [big] + smalls
+        skips = {}
+        for small in smalls[:MAX_SKIPS]:
+            self.assertIs(scheduler._next_admissible(runnable,demands,resources,skips),small)
+            runnable.remove(small)
+
+        # until the resources are held back for it
+        self.assertIsNone(scheduler._next_admissible(runnable,demands,resources,skips))
+
+        resources.release(demands[holder])
+        self.assertIs(scheduler._next_admissible(runnable,demands,resources,skips),big)
+
+    def test_parse_amount(self):
+        self.assertEqual(parse_amount('2'),2)
+        self.assertEqual(parse_amount('0.5'),0.5)
+        self.assertEqual(parse_amount('4G'),4*2**30)
+        self.assertEqual(parse_amount('512mb'),512*2**20)
+        self.assertRaises(ValueError,parse_amount,'lots')
+
+class AsyncEngineTestCase(unittest.TestCase):
+
+    def test_asyncio_parallel_tasks(self):
+        p = get_pipeline(get_complete_filename('parallel1'),default_prefix=USE_FILE_PREFIX)
+        p.unmark_all_tasks(recur=True)
+
+        outputs = [get_complete_filename('parallel1_%s' % x) for x in ['a_started','b_started','c_done']]
+        remove_files(*outputs)
+
+        tasks_run = p.run(num_jobs=2,engine=ENGINE_ASYNCIO)
+
+        self.assertEqual(len(tasks_run),3)
+        self.assertTrue(os.path.exists(outputs[2]))
+
+        remove_files(*outputs)
+        p.unmark_all_tasks(recur=True)
+
+    def test_asyncio_many_tasks(self):
+        tmp_dir = tempfile.mkdtemp()
+        pln_file = os.path.join(tmp_dir,'many.xp')
+
+        num_tasks = 100
+        fh = open(pln_file,'w')
+        for i in range(num_tasks):
+            fh.write('t%d:\n\tcode.sh:\n\t\techo $PLN(%d) > /dev/null\n\n' % (i,i))
+        fh.write('final: %s\n\tcode.sh:\n\t\ttrue\n' % ' '.join(['t%d' % i for i in range(num_tasks)]))
+        fh.close()
+
+        p = get_pipeline(pln_file,default_prefix=USE_FILE_PREFIX)
+        tasks_run = p.run(num_jobs=num_tasks,engine=ENGINE_ASYNCIO)
+
+        self.assertEqual(len(tasks_run),num_tasks+1)
+        self.assertEqual(tasks_run[-1].name,'final')
+
+        shutil.rmtree(tmp_dir)
+
+    def test_asyncio_block_failure(self):
+        kernel = ShellKernel()
+        self.assertRaises(CalledProcessError,asyncio.run,kernel.run_async('',{},'.',['exit 3']))
+
+    def test_asyncio_streams_output(self):
+        kernel = ShellKernel()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            asyncio.run(kernel.run_async('',{'MSG':'hello'},'.',['echo $MSG','echo world']))
+
+        self.assertEqual(out.getvalue(),'hello\nworld\n')
+
+    def test_asyncio_long_line(self):
+        # longer than the default limit of asyncio's stream readers
+        kernel = ShellKernel()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            asyncio.run(kernel.run_async('',{},'.',["head -c 100000 /dev/zero | tr '\\0' z",'echo','echo done']))
+
+        self.assertEqual(out.getvalue(),'z'*100000 + '\ndone\n')
+
+class KeepGoingTestCase(unittest.TestCase):
+
+    def run_keepgoing1(self,**kwargs):
+        p = get_pipeline(get_complete_filename('keepgoing1'),default_prefix=USE_FILE_PREFIX)
+        p.unmark_all_tasks(recur=True)
+
+        runs_file = get_complete_filename('keepgoing1_runs.txt')
+        remove_files(runs_file)
+
+        try:
+            p.run(**kwargs)
+            self.fail('the plot task should have failed')
+        except TasksFailed as e:
+            fh = open(runs_file,'r')
+            runs = fh.read().split()
+            fh.close()
+
+            return p,e,runs
+        finally:
+            remove_files(runs_file)
+            p.unmark_all_tasks(recur=True)
+
+    def test_keep_going(self):
+        p,e,runs = self.run_keepgoing1(keep_going=True)
+
+        self.assertEqual([t.name for t,_ in e.failed],['plot'])
+        self.assertIsInstance(e.failed[0][1],BlockFailed)
+        self.assertEqual(set([t.name for t in e.blocked]),set(['report','all']))
+        self.assertEqual([t.name for t in e.completed],['fit'])
+        self.assertEqual(runs,['fit'])
+
+    def test_keep_going_parallel(self):
+        p,e,runs = self.run_keepgoing1(keep_going=True,num_jobs=2)
+
+        self.assertEqual([t.name for t in e.completed],['fit'])
+        self.assertEqual(set([t.name for t in e.blocked]),set(['report','all']))
+
+    def test_stop_on_failure(self):
+        p = get_pipeline(get_complete_filename('keepgoing1'),default_prefix=USE_FILE_PREFIX)
+        p.unmark_all_tasks(recur=True)
+
+        self.assertRaises(BlockFailed,p.run)
+
+        remove_files(get_complete_filename('keepgoing1_runs.txt'))
+        p.unmark_all_tasks(recur=True)
+
+class CriticalPathTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.p = get_pipeline(get_complete_filename('critical1'),default_prefix=USE_FILE_PREFIX)
+        self.p.unmark_all_tasks(recur=True)
+        self.runs_file = get_complete_filename('critical1_runs.txt')
+        remove_files(self.runs_file)
+
+    def tearDown(self):
+        self.p.unmark_all_tasks(recur=True)
+        remove_files(self.runs_file,get_duration_history(self.p).fname)
+
+    def record_durations(self,**durations):
+        for tname,duration in durations.items():
+            self.p.get_task(tname).record_duration(duration)
+
+    def get_runs(self):
+        fh = open(self.runs_file,'r')
+        runs = fh.read().split()
+        fh.close()
+
+        return runs
+
+    def test_priorities(self):
+        self.record_durations(all=1,a2=1,a1=1,b=10)
+        priorities = {t.name:p for t,p in get_task_priorities(self.p.get_all_tasks()).items()}
+
+        self.assertEqual(priorities,{'all':1, 'a2':2, 'a1':3, 'b':11})
+
+    def test_long_task_first(self):
+        self.record_durations(all=1,a2=1,a1=1,b=10)
+        Scheduler(1).run([self.p.get_task('all')])
+
+        self.assertEqual(self.get_runs()[0],'b')
+
+    def test_long_chain_first(self):
+        self.record_durations(all=1,a2=5,a1=5,b=4)
+        Scheduler(1).run([self.p.get_task('all')])
+
+        self.assertEqual(self.get_runs(),['a1','a2','b','all'])
+
+    def test_durations_recorded(self):
+        self.p.run()
+
+        for t in self.p.get_all_tasks():
+            self.assertIsNotNone(t.expected_duration())
+        # the history is kept out of the pipeline's directory
+        self.assertTrue(os.path.exists(get_duration_history(self.p).fname))
+        self.assertFalse(os.path.exists(get_complete_filename('.critical1.durations')))
@@ -15,10 +15,13 @@ limitations under the License.
 """
 
 import unittest
-from xp.pipeline import get_pipeline, expand_variables, PIPELINE_PREFIX_VARNAME, ParseException, USE_FILE_PREFIX
+from xp.pipeline import get_pipeline, expand_variables, compile_template, PIPELINE_PREFIX_VARNAME, ParseException, UnknownVariableException, USE_FILE_PREFIX
 import xp.pipeline as pipeline
 import os, os.path
 import shutil
+import tempfile
+from xp import config
+from xp.shell_memo import forget_outputs
 
 BASE_PATH = os.path.dirname(__file__)
 
@@ -124,6 +127,33 @@ class InnerVarExpansionTestCase(unittest.TestCase):
         
         # this should get here without an exception...
 
+    def test_adjacent1(self):
+        context = {'var1':'hello', 'foobar':'test', PIPELINE_PREFIX_VARNAME:'/foo/bar_'}
+        cwd = '.'
+
+        exval = expand_variables('$var1$foobar',context,cwd,None,None,-1)
+        self.assertEquals(exval,'hellotest')
+
+        exval = expand_variables('\\$$var1',context,cwd,None,None,-1)
+        self.assertEquals(exval,'$hello')
+
+        exval = expand_variables('touch $PLN($var1)',context,cwd,None,None,-1)
+        self.assertEquals(exval,'touch /foo/bar_hello')
+
+    def test_template1(self):
+        template = compile_template('touch $PLN($var1.txt) \\$var1',None,-1)
+        cwd = '.'
+
+        exval = template.expand({'var1':'a', PIPELINE_PREFIX_VARNAME:'/foo/bar_'},cwd,None)
+        self.assertEquals(exval,'touch /foo/bar_a.txt $var1')
+
+        exval = template.expand({'var1':'b', PIPELINE_PREFIX_VARNAME:'/foo/bar_'},cwd,None)
+        self.assertEquals(exval,'touch /foo/bar_b.txt $var1')
+
+    def test_template_parse_error1(self):
+        # syntax is checked when the template is compiled, not when it's expanded
+        self.assertRaises(ParseException,compile_template,'touch $PLN(test1.txt',None,-1)
+
 class VarExpansionTestCase(unittest.TestCase):
     
     def test_varexpand1(self):
@@ -193,6 +223,138 @@ class VarExpansionTestCase(unittest.TestCase):
         p = get_pipeline(get_complete_filename('plnref_varexpand1'),default_prefix=USE_FILE_PREFIX)
         context = p.get_context()
 
-        self.assertTrue(context['VAR1'],'test')
-        self.assertTrue(context['VAR2'],'varexpand1_test_xyz')
+        self.assertEquals(context['VAR1'],'test')
+        self.assertEquals(context['VAR2'],'varexpand1_test.txt_xyz')
+
+SHELL_PIPELINE = """
+COUNT=$(echo x >> %(counter)s; wc -l < %(counter)s)
+
+t1:
+	code.sh:
+		echo $(echo x >> %(counter)s; echo hi) > %(out)s
+t2: t1
+	code.sh:
+		echo $(echo x >> %(counter)s; echo hi) >> %(out)s
+"""
+
+class ShellFunctionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.counter = os.path.join(self.tmp_dir,'counter')
+        config.initialize_config_info_from_string("""
+[Functions]
+shell_cache_dir: %s
+""" % os.path.join(self.tmp_dir,'shell'))
+
+    def tearDown(self):
+        forget_outputs()
+        config.initialize_config_info()
+        shutil.rmtree(self.tmp_dir)
+
+    def num_runs(self):
+        return len(open(self.counter).readlines())
+
+    def test_memo_in_run(self):
+        cmd = 'echo $(echo x >> %s; echo hi)' % self.counter
+
+        self.assertEquals(expand_variables(cmd,{},self.tmp_dir,None,None,-1),'echo hi')
+        self.assertEquals(expand_variables(cmd,{},self.tmp_dir,None,None,-1),'echo hi')
+        self.assertEquals(self.num_runs(),1)
+
+        # different variables are a different environment
+        expand_variables(cmd,{'X':'1'},self.tmp_dir,None,None,-1)
+        self.assertEquals(self.num_runs(),2)
+
+        forget_outputs()
+        expand_variables(cmd,{},self.tmp_dir,None,None,-1)
+        self.assertEquals(self.num_runs(),3)
+
+    def test_ttl(self):
+        cmd = 'echo $(echo x >> %s; echo hi # ttl=3600)' % self.counter
+
+        expand_variables(cmd,{},self.tmp_dir,None,None,-1)
+        forget_outputs()
+        self.assertEquals(expand_variables(cmd,{},self.tmp_dir,None,None,-1),'echo hi')
+        self.assertEquals(self.num_runs(),1)
+
+    def test_pipeline_run(self):
+        pipeline_file = os.path.join(self.tmp_dir,'shell1')
+        out_file = os.path.join(self.tmp_dir,'out.txt')
+        fh = open(pipeline_file,'w')
+        fh.write(SHELL_PIPELINE % {'counter':self.counter, 'out':out_file})
+        fh.close()
+
+        pipeline.reset_pipeline_factory()
+        p = get_pipeline(pipeline_file,default_prefix=USE_FILE_PREFIX)
+        p.run()
+
+        # the preamble is evaluated when the pipeline is loaded and the same
+        # function in two tasks is run once
+        self.assertEquals(p.get_context()['COUNT'],'1')
+        self.assertEquals(self.num_runs(),2)
+        self.assertEquals(open(out_file).read(),'hi\nhi\n')
+
+        p.unmark_all_tasks()
+
+LAZY_PIPELINE = """
+SLOW=$(echo x >> %(counter)s; echo slow)
+GONE=$(echo x >> %(counter)s; echo gone)
+unset GONE
+X=first
+Y=${X}_y
+X=second
+Z=$Y
+unset Y
+W=$Y
+
+t1:
+	code.sh:
+		echo $X > %(out)s
+"""
+
+class LazyPreambleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.counter = os.path.join(self.tmp_dir,'counter')
+        self.out_file = os.path.join(self.tmp_dir,'out.txt')
+
+        pipeline_file = os.path.join(self.tmp_dir,'lazy1')
+        fh = open(pipeline_file,'w')
+        fh.write(LAZY_PIPELINE % {'counter':self.counter, 'out':self.out_file})
+        fh.close()
+
+        pipeline.reset_pipeline_factory()
+        self.pipeline = get_pipeline(pipeline_file,default_prefix=USE_FILE_PREFIX)
+
+    def tearDown(self):
+        forget_outputs()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_not_evaluated(self):
+        context = self.pipeline.get_context()
+
+        # variables are evaluated in the order they were assigned in
+        self.assertEquals(context['X'],'second')
+        self.assertEquals(context['Z'],'first_y')
+        self.assertFalse('Y' in context)
+        self.assertRaises(UnknownVariableException,lambda: context['W'])
+
+        # nor to check for them or unset them
+        self.assertTrue('SLOW' in context)
+        self.assertFalse('GONE' in context)
+        child = context.child()
+        del child['SLOW']
+        self.assertFalse('SLOW' in child)
+
+        self.assertFalse(os.path.exists(self.counter))
+
+    def test_evaluated_once(self):
+        context = self.pipeline.get_context()
+        self.assertEquals(context['SLOW'],'slow')
+        self.assertEquals(self.pipeline.get_context()['SLOW'],'slow')
 
+        forget_outputs()
+        self.assertEquals(context['SLOW'],'slow')
+        self.assertEquals(len(open(self.counter).readlines()),1)